@@ -3,107 +3,1196 @@ import os
 import subprocess
 import ctypes
 import json
+import base64
+import queue
+import atexit
+import time
+import csv
+import re
+from array import array
+from bisect import bisect_left
 from pathlib import Path
 from enum import Enum
-from typing import Dict, List, Optional
-import tkinter as tk
-from tkinter import ttk, messagebox
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
 import threading
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# tkinter is only imported when the GUI starts (see load_tkinter), so the
+# headless commands stay cheap to launch.
+tk = ttk = messagebox = None
 
+# Python-level import budget for `import battery_saver`, checked by the
+# `importtime` command
+IMPORT_BUDGET_MS = 100
+
+
+# The built-in profiles; users can define more in the profile config
 class PowerProfile(Enum):
     BATTERY_SAVER = "battery_saver"
     PERFORMANCE = "performance"
 
 
-class PowerManager:
+def profile_name(profile) -> str:
+    return profile.value if isinstance(profile, PowerProfile) else str(profile)
+
+
+def configure_logging(level: int = logging.INFO):
+    # Records are queued as-is and formatted and written by a listener
+    # thread, so a log call costs the switching thread one queue put.
+    # logging.handlers is imported here to keep it out of the import budget.
+    from logging.handlers import QueueHandler, QueueListener
+
+    class DeferredQueueHandler(QueueHandler):
+        def prepare(self, record):
+            return record
+
+    root = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        return
+    records = queue.SimpleQueue()
+    handlers = root.handlers or [logging.StreamHandler()]
+    for handler in handlers:
+        if handler.formatter is None:
+            handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    root.handlers = [DeferredQueueHandler(records)]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+# Histogram bucket upper bounds in seconds; an implicit +Inf bucket follows
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class LatencyHistogram:
+    # Fixed buckets, so memory does not grow with the number of samples;
+    # quantiles are interpolated within a bucket.
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = 0
+        for index, count in enumerate(self.counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                value = lower + (upper - lower) * (rank - cumulative) / count
+                return min(max(value, self.min), self.max)
+            cumulative += count
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+        }
+
+
+class Span:
+    # Times a with-block into a Metrics histogram
+    __slots__ = ("metrics", "name", "labels", "start", "elapsed")
+
+    def __init__(self, metrics: "Metrics", name: str, labels: Dict[str, str]):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.elapsed = None
+
+    def __enter__(self) -> "Span":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.elapsed = time.perf_counter() - self.start
+        self.metrics.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+class Metrics:
+    # Latency histograms keyed by metric name and labels, exported as a
+    # stats dict, JSON or the Prometheus text format.
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = (name, tuple(sorted((label, str(value)) for label, value in labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+
+    def span(self, name: str, **labels) -> Span:
+        return Span(self, name, labels)
+
+    @staticmethod
+    def _series(name: str, labels: Tuple[Tuple[str, str], ...]) -> str:
+        if not labels:
+            return name
+        escaped = (value.replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+        return name + "{" + ",".join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + "}"
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {self._series(name, labels): histogram.summary()
+                    for (name, labels), histogram in sorted(self._histograms.items())}
+
+    def to_json(self) -> str:
+        return json.dumps(self.stats(), indent=2)
+
+    def to_prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            current = None
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                if name != current:
+                    lines.append(f"# TYPE {name} histogram")
+                    current = name
+                cumulative = 0
+                bounds = [f"{bound:g}" for bound in histogram.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{self._series(name + '_bucket', labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{self._series(name + '_sum', labels)} {histogram.sum:.6f}")
+                lines.append(f"{self._series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+
+# Process-wide latency metrics; see the `stats` command
+metrics = Metrics()
+
+
+def _command_label(command: str) -> str:
+    # First word of a command, without path or extension, as a metric label
+    words = command.split(None, 1)
+    word = words[0].strip("(&{") if words else ""
+    return os.path.splitext(os.path.basename(word))[0].lower() or "script"
+
+
+POWERSHELL_TIMEOUT = 15.0
+POWERSHELL_POOL_SIZE = 2
+
+
+class PowerShellSession:
+    # A long-lived PowerShell host fed over stdin. Each command is sent as a
+    # single base64-encoded line and its reply is delimited by a unique marker
+    # on both stdout and stderr, so one process can serve many commands.
+    ARGV = ["powershell", "-NoLogo", "-NoProfile", "-NonInteractive", "-Command", "-"]
+    PRELUDE = "[Console]::OutputEncoding = [Text.Encoding]::UTF8; $ProgressPreference = 'SilentlyContinue'"
+
+    def __init__(self, argv: Optional[List[str]] = None):
+        self.argv = argv or self.ARGV
+        self._process = None
+        self._stdout = None
+        self._stderr = None
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self):
+        self._process = subprocess.Popen(
+            self.argv,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        )
+        self._stdout = queue.Queue()
+        self._stderr = queue.Queue()
+        for stream, lines in ((self._process.stdout, self._stdout), (self._process.stderr, self._stderr)):
+            reader = threading.Thread(target=self._pump, args=(stream, lines), daemon=True)
+            reader.start()
+        if self.PRELUDE:
+            self._process.stdin.write(self.PRELUDE + "\n")
+            self._process.stdin.flush()
+        logger.debug(f"Started shell session (pid {self._process.pid})")
+
+    @staticmethod
+    def _pump(stream, lines: queue.Queue):
+        try:
+            for line in stream:
+                lines.put(line.rstrip("\r\n"))
+        except (OSError, ValueError):
+            pass
+        lines.put(None)
+
+    def _frame(self, command: str, marker: str) -> str:
+        encoded = base64.b64encode(command.encode("utf-8")).decode("ascii")
+        return (
+            "$global:LASTEXITCODE = 0; $__errs = $Error.Count; "
+            "try { Invoke-Expression ([Text.Encoding]::UTF8.GetString([Convert]::FromBase64String('" + encoded + "'))) } "
+            "catch { [Console]::Error.WriteLine($_) }; "
+            "$__rc = if ($LASTEXITCODE) { $LASTEXITCODE } elseif ($Error.Count -gt $__errs) { 1 } else { 0 }; "
+            "[Console]::Out.WriteLine('" + marker + " ' + $__rc); [Console]::Error.WriteLine('" + marker + "')\n"
+        )
+
+    def _read_until(self, lines: queue.Queue, marker: str, deadline: float):
+        collected = []
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise queue.Empty
+            line = lines.get(timeout=remaining)
+            if line is None:
+                raise EOFError
+            if line.startswith(marker):
+                return collected, line[len(marker):].strip()
+            collected.append(line)
+
+    def run(self, command: str, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        label = _command_label(command)
+        if not self.alive:
+            with metrics.span("battery_saver_command_seconds", kind="powershell", command=label, phase="spawn"):
+                self._start()
+
+        marker = f"__battery_saver_{os.urandom(16).hex()}__"
+        deadline = time.monotonic() + (timeout or POWERSHELL_TIMEOUT)
+        try:
+            with metrics.span("battery_saver_command_seconds", kind="powershell", command=label, phase="wait"):
+                self._process.stdin.write(self._frame(command, marker))
+                self._process.stdin.flush()
+                stdout, status = self._read_until(self._stdout, marker, deadline)
+                stderr, _ = self._read_until(self._stderr, marker, deadline)
+        except queue.Empty:
+            self.close()
+            raise subprocess.TimeoutExpired(command, timeout or POWERSHELL_TIMEOUT)
+        except (EOFError, OSError) as e:
+            self.close()
+            raise subprocess.SubprocessError(f"Shell session exited unexpectedly: {e!r}")
+
+        returncode = int(status) if status.lstrip("-").isdigit() else 1
+        return subprocess.CompletedProcess(command, returncode, "\n".join(stdout), "\n".join(stderr))
+
+    def close(self):
+        if self._process is None:
+            return
+        try:
+            self._process.kill()
+            self._process.wait(timeout=5)
+        except (OSError, subprocess.SubprocessError):
+            pass
+        for stream in (self._process.stdin, self._process.stdout, self._process.stderr):
+            try:
+                stream.close()
+            except (OSError, ValueError):
+                pass
+        self._process = None
+
+
+class PowerShellPool:
+    # Hands out idle sessions to callers; sessions are started lazily and a
+    # crashed or timed-out session is restarted on its next use.
+    def __init__(self, size: int = POWERSHELL_POOL_SIZE, argv: Optional[List[str]] = None):
+        self.size = size
+        self.argv = argv
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._sessions = []
+
+    def _acquire(self) -> PowerShellSession:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                session = PowerShellSession(self.argv)
+                self._sessions.append(session)
+                return session
+        return self._idle.get()
+
+    def run(self, command: str, timeout: Optional[float] = None, check: bool = False) -> subprocess.CompletedProcess:
+        with metrics.span("battery_saver_command_seconds", kind="powershell", command=_command_label(command),
+                          phase="queue"):
+            session = self._acquire()
+        try:
+            result = session.run(command, timeout)
+        finally:
+            self._idle.put(session)
+        if check and result.returncode != 0:
+            raise subprocess.CalledProcessError(result.returncode, command, result.stdout, result.stderr)
+        return result
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+
+
+_shell_pool = None
+_shell_pool_lock = threading.Lock()
+
+
+def get_shell_pool() -> PowerShellPool:
+    global _shell_pool
+    with _shell_pool_lock:
+        if _shell_pool is None:
+            _shell_pool = PowerShellPool()
+            atexit.register(_shell_pool.close)
+        return _shell_pool
+
+
+class CommandExecutor:
+    # Every external command the managers issue goes through one of these, so
+    # a profile switch can be recorded on real hardware and replayed elsewhere.
+    # Managers only use native (ctypes) backends when allow_native is set;
+    # transcript executors clear it so every hardware call is captured.
+    allow_native = True
+    
+    def run(self, args: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        raise NotImplementedError
+
+    def run_powershell(self, command: str, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        raise NotImplementedError
+
+    def exists(self, path: str) -> bool:
+        raise NotImplementedError
+
+
+class SubprocessExecutor(CommandExecutor):
+    def __init__(self, shell_pool: Optional[PowerShellPool] = None):
+        self.shell_pool = shell_pool
+
+    def run(self, args: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        # Spawn and output wait are timed separately
+        label = _command_label(args[0])
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        )
+        spawned = time.perf_counter()
+        metrics.observe("battery_saver_command_seconds", spawned - start, kind="run", command=label, phase="spawn")
+        try:
+            with metrics.span("battery_saver_command_seconds", kind="run", command=label, phase="wait"):
+                stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    def run_powershell(self, command: str, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        return (self.shell_pool or get_shell_pool()).run(command, timeout)
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(path)
+
+
+# Exceptions that can be stored in a transcript and raised again on replay
+_REPLAYABLE_ERRORS = {
+    "FileNotFoundError": FileNotFoundError,
+    "PermissionError": PermissionError,
+    "OSError": OSError,
+    "SubprocessError": subprocess.SubprocessError,
+}
+
+
+class RecordingExecutor(CommandExecutor):
+    # Wraps another executor and appends every call, with its result and
+    # latency, to a JSON-lines transcript.
+    allow_native = False
+    
+    def __init__(self, inner: CommandExecutor, path):
+        self.inner = inner
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def _record(self, kind: str, command, call):
+        entry = {"kind": kind, "command": command}
+        start = time.perf_counter()
+        try:
+            result = call()
+        except subprocess.TimeoutExpired as e:
+            entry.update(error="TimeoutExpired", message=str(e), timeout=e.timeout)
+            raise
+        except tuple(_REPLAYABLE_ERRORS.values()) as e:
+            name = next(name for name, cls in _REPLAYABLE_ERRORS.items() if isinstance(e, cls))
+            entry.update(error=name, message=str(e))
+            raise
+        else:
+            if isinstance(result, subprocess.CompletedProcess):
+                entry.update(returncode=result.returncode, stdout=result.stdout, stderr=result.stderr)
+            else:
+                entry.update(result=result)
+            return result
+        finally:
+            entry["latency"] = time.perf_counter() - start
+            with self._lock:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def run(self, args: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        return self._record("run", list(args), lambda: self.inner.run(args, timeout))
+
+    def run_powershell(self, command: str, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        return self._record("powershell", command, lambda: self.inner.run_powershell(command, timeout))
+
+    def exists(self, path: str) -> bool:
+        return self._record("exists", path, lambda: self.inner.exists(path))
+
+
+class ReplayExecutor(CommandExecutor):
+    # Plays back a transcript written by RecordingExecutor. Repeated calls to
+    # the same command walk through its recorded replies in order and then
+    # keep returning the last one, so a transcript can be replayed in a loop.
+    allow_native = False
+    
+    def __init__(self, path, realtime: bool = True):
+        self.realtime = realtime
+        self._replies = {}
+        self._cursor = {}
+        self._lock = threading.Lock()
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._replies.setdefault(self._key(entry["kind"], entry["command"]), []).append(entry)
+
+    @staticmethod
+    def _key(kind: str, command) -> str:
+        return json.dumps([kind, command], ensure_ascii=False)
+
+    def _replay(self, kind: str, command):
+        key = self._key(kind, command)
+        with self._lock:
+            replies = self._replies.get(key)
+            if not replies:
+                raise subprocess.SubprocessError(f"No recorded reply for {kind} command: {command}")
+            index = self._cursor.get(key, 0)
+            self._cursor[key] = index + 1
+            entry = replies[min(index, len(replies) - 1)]
+
+        if self.realtime:
+            time.sleep(entry.get("latency", 0))
+        error = entry.get("error")
+        if error == "TimeoutExpired":
+            raise subprocess.TimeoutExpired(command, entry.get("timeout"))
+        if error:
+            raise _REPLAYABLE_ERRORS.get(error, OSError)(entry.get("message", ""))
+        if kind == "exists":
+            return entry["result"]
+        return subprocess.CompletedProcess(command, entry["returncode"], entry["stdout"], entry["stderr"])
+
+    def run(self, args: List[str], timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        return self._replay("run", list(args))
+
+    def run_powershell(self, command: str, timeout: Optional[float] = None) -> subprocess.CompletedProcess:
+        return self._replay("powershell", command)
+
+    def exists(self, path: str) -> bool:
+        return self._replay("exists", path)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> CommandExecutor:
+    # BATTERY_SAVER_RECORD / BATTERY_SAVER_REPLAY select a transcript backend
+    # without touching the code, e.g. to capture a session on real hardware.
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            replay_path = os.environ.get("BATTERY_SAVER_REPLAY")
+            record_path = os.environ.get("BATTERY_SAVER_RECORD")
+            if replay_path:
+                _executor = ReplayExecutor(replay_path)
+            elif record_path:
+                _executor = RecordingExecutor(SubprocessExecutor(), record_path)
+            else:
+                _executor = SubprocessExecutor()
+        return _executor
+
+
+def set_executor(executor: CommandExecutor):
+    global _executor
+    with _executor_lock:
+        _executor = executor
+
+
+GUID_PATTERN = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+# GUIDs behind the powercfg scheme aliases used by set_power_plan
+SCHEME_ALIAS_GUIDS = {
+    "SCHEME_MAX": "a1841308-3541-4fab-bc81-f71556f20b4a",
+    "SCHEME_MIN": "8c5e7fda-e8bf-4a96-9a85-a6e23a8c635c",
+    "SCHEME_BALANCED": "381b4222-f694-41f0-9685-ff5bb260df2e",
+}
+
+
+STANDARD_SCHEME_TYPES = {
+    SCHEME_ALIAS_GUIDS["SCHEME_BALANCED"]: 'balanced',
+    SCHEME_ALIAS_GUIDS["SCHEME_MIN"]: 'performance',
+    SCHEME_ALIAS_GUIDS["SCHEME_MAX"]: 'saver',
+}
+PLAN_SCHEME_GUIDS = {plan_type: guid for guid, plan_type in STANDARD_SCHEME_TYPES.items()}
+
+# powercfg aliases per plan type. The naming is counterintuitive!
+# SCHEME_MAX = Power Saver (MAXimum power saving)
+# SCHEME_MIN = High Performance (MINimum power saving)
+PLAN_ALIASES = {'saver': "SCHEME_MAX", 'balanced': "SCHEME_BALANCED", 'performance': "SCHEME_MIN"}
+
+SUB_PROCESSOR = "54533251-82be-4824-96c1-47b60b740d00"
+SUB_PCIEXPRESS = "501a4d13-42af-4429-9fd1-a8218c268e20"
+SUB_DISK = "0012ee47-9041-4b5d-9b77-535fba8b1442"
+
+
+class PowerSetting(NamedTuple):
+    subgroup: str
+    guid: str
+    low: int
+    high: int
+    # Names accepted in profiles instead of the raw index
+    choices: Optional[Dict[str, int]] = None
+
+
+# Power plan sub-settings a profile can set, per AC and DC
+POWER_SETTINGS = {
+    # Percent
+    "processor_max_state": PowerSetting(SUB_PROCESSOR, "bc5038f7-23e0-4960-96da-33abaf5935ec", 0, 100),
+    # 0 favours performance, 100 energy saving
+    "energy_performance_preference": PowerSetting(SUB_PROCESSOR, "36687f9e-e3a5-4dbf-b1dc-15eb381c6863", 0, 100),
+    "boost_mode": PowerSetting(SUB_PROCESSOR, "be337238-0d82-4146-a960-4f3749d470c7", 0, 6, {
+        "disabled": 0, "enabled": 1, "aggressive": 2, "efficient_enabled": 3, "efficient_aggressive": 4,
+    }),
+    "pcie_aspm": PowerSetting(SUB_PCIEXPRESS, "ee12f906-d277-404b-b6da-e5fa1a576df5", 0, 2, {
+        "off": 0, "moderate": 1, "maximum": 2,
+    }),
+    # NVMe APST, in milliseconds: idle time before the drive drops to a
+    # non-operational power state, and the wake-up latency it may accept
+    "nvme_idle_timeout": PowerSetting(SUB_DISK, "d639518a-e56d-4345-8af2-b9f32fb26109", 0, 60000),
+    "nvme_latency_tolerance": PowerSetting(SUB_DISK, "fc95af4d-40e7-4b6d-835a-56d131dbc80e", 0, 60000),
+}
+
+
+class GUID(ctypes.Structure):
+    _fields_ = [
+        ("Data1", ctypes.c_ulong),
+        ("Data2", ctypes.c_ushort),
+        ("Data3", ctypes.c_ushort),
+        ("Data4", ctypes.c_ubyte * 8),
+    ]
+
+    @classmethod
+    def from_string(cls, value: str) -> "GUID":
+        parts = value.strip("{}").split("-")
+        tail = bytes.fromhex(parts[3] + parts[4])
+        return cls(int(parts[0], 16), int(parts[1], 16), int(parts[2], 16), (ctypes.c_ubyte * 8)(*tail))
+
+    def __str__(self) -> str:
+        tail = bytes(self.Data4).hex()
+        return f"{self.Data1:08x}-{self.Data2:04x}-{self.Data3:04x}-{tail[:4]}-{tail[4:]}"
+
+
+class PowrProf:
+    # Direct calls into powrprof.dll. Scheme reads and switches take well
+    # under a millisecond and return GUIDs and names without any console
+    # output to parse.
+    ACCESS_SCHEME = 16
+    ERROR_NO_MORE_ITEMS = 259
+
     def __init__(self):
-        self.power_plans = self._get_power_plans()
+        self._dll = ctypes.windll.powrprof
+        self._kernel32 = ctypes.windll.kernel32
+
+    def _check(self, status: int, call: str):
+        if status != 0:
+            raise OSError(status, f"{call} failed with error {status}")
+
+    def _friendly_name(self, scheme: GUID) -> str:
+        size = ctypes.c_ulong(0)
+        self._dll.PowerReadFriendlyName(None, ctypes.byref(scheme), None, None, None, ctypes.byref(size))
+        if not size.value:
+            return ""
+        buffer = ctypes.create_string_buffer(size.value)
+        self._check(self._dll.PowerReadFriendlyName(None, ctypes.byref(scheme), None, None, buffer, ctypes.byref(size)),
+                    "PowerReadFriendlyName")
+        return buffer.raw.decode("utf-16-le").rstrip("\x00")
+
+    def enumerate_schemes(self) -> Dict[str, str]:
+        schemes = {}
+        index = 0
+        while True:
+            scheme = GUID()
+            size = ctypes.c_ulong(ctypes.sizeof(scheme))
+            status = self._dll.PowerEnumerate(None, None, None, self.ACCESS_SCHEME, index,
+                                              ctypes.byref(scheme), ctypes.byref(size))
+            if status == self.ERROR_NO_MORE_ITEMS:
+                break
+            self._check(status, "PowerEnumerate")
+            schemes[str(scheme)] = self._friendly_name(scheme)
+            index += 1
+        return schemes
+
+    def get_active_scheme(self) -> str:
+        active = ctypes.POINTER(GUID)()
+        self._check(self._dll.PowerGetActiveScheme(None, ctypes.byref(active)), "PowerGetActiveScheme")
+        try:
+            return str(active.contents)
+        finally:
+            self._kernel32.LocalFree(active)
+
+    def set_active_scheme(self, scheme: str):
+        self._check(self._dll.PowerSetActiveScheme(None, ctypes.byref(GUID.from_string(scheme))), "PowerSetActiveScheme")
+
+    def read_value_index(self, scheme: str, subgroup: str, setting: str, ac: bool) -> int:
+        call = "PowerReadACValueIndex" if ac else "PowerReadDCValueIndex"
+        value = ctypes.c_ulong()
+        self._check(getattr(self._dll, call)(None, ctypes.byref(GUID.from_string(scheme)),
+                                             ctypes.byref(GUID.from_string(subgroup)),
+                                             ctypes.byref(GUID.from_string(setting)), ctypes.byref(value)), call)
+        return value.value
+
+    def write_value_index(self, scheme: str, subgroup: str, setting: str, ac: bool, value: int):
+        call = "PowerWriteACValueIndex" if ac else "PowerWriteDCValueIndex"
+        self._check(getattr(self._dll, call)(None, ctypes.byref(GUID.from_string(scheme)),
+                                             ctypes.byref(GUID.from_string(subgroup)),
+                                             ctypes.byref(GUID.from_string(setting)), ctypes.c_ulong(value)), call)
+
+
+def load_powrprof() -> Optional[PowrProf]:
+    if not hasattr(ctypes, "windll"):
+        return None
+    try:
+        return PowrProf()
+    except OSError as e:
+        logger.warning(f"powrprof.dll not available, using powercfg: {e}")
+        return None
+
+
+class PowerManager:
+    def __init__(self, executor: Optional[CommandExecutor] = None, capabilities: Optional[Dict] = None,
+                 powrprof: Optional[PowrProf] = None):
+        self.executor = executor or get_executor()
+        self.powrprof = powrprof or (load_powrprof() if self.executor.allow_native else None)
+        # Every installed scheme, GUID -> friendly name
+        self.schemes: Dict[str, str] = {}
+        # (scheme, setting name) -> (AC, DC) index as last read or written;
+        # (None, None) if the setting does not exist on this system
+        self._setting_cache: Dict[Tuple[str, str], Tuple[Optional[int], Optional[int]]] = {}
+        if capabilities is not None:
+            self.schemes = dict(capabilities["schemes"])
+            self.power_plans = dict(capabilities["power_plans"])
+        else:
+            self.power_plans = self._get_power_plans()
+    
+    def get_capabilities(self) -> Dict:
+        return {"schemes": dict(self.schemes), "power_plans": dict(self.power_plans)}
         
     def _run_powershell(self, command: str) -> str:
         try:
-            result = subprocess.run(
-                ["powershell", "-Command", command],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            result = self.executor.run_powershell(command, timeout=POWERSHELL_TIMEOUT)
+            result.check_returncode()
             return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
+        except subprocess.SubprocessError as e:
             logger.error(f"PowerShell command failed: {e}")
             return ""
     
+    def _list_schemes(self) -> Dict[str, str]:
+        if self.powrprof:
+            try:
+                return self.powrprof.enumerate_schemes()
+            except OSError as e:
+                logger.warning(f"PowerEnumerate failed, falling back to powercfg: {e}")
+        
+        schemes = {}
+        for line in self._run_powershell("powercfg /list").split('\n'):
+            match = GUID_PATTERN.search(line)
+            if 'GUID:' in line and match:
+                name = line[match.end():].strip().rstrip('*').strip()
+                schemes[match.group(0).lower()] = name.strip('()')
+        return schemes
+    
     def _get_power_plans(self) -> Dict[str, str]:
-        output = self._run_powershell("powercfg /list")
+        self.schemes = self._list_schemes()
         plans = {}
         
         # Use standard Windows power scheme GUIDs
-        standard_guids = {
-            '381b4222-f694-41f0-9685-ff5bb260df2e': 'balanced',
-            '8c5e7fda-e8bf-4a96-9a85-a6e23a8c635c': 'performance',
-            'a1841308-3541-4fab-bc81-f71556f20b4a': 'saver'
-        }
-        
-        for line in output.split('\n'):
-            if 'GUID:' in line:
-                for guid, plan_type in standard_guids.items():
-                    if guid in line:
-                        plans[plan_type] = guid
-                        logger.info(f"Found {plan_type} power plan: {guid}")
+        for guid, plan_type in STANDARD_SCHEME_TYPES.items():
+            if guid in self.schemes:
+                plans[plan_type] = guid
+                logger.info(f"Found {plan_type} power plan: {guid}")
         
         # Fallback: try to detect by keywords in any language
         if not plans:
-            for line in output.split('\n'):
-                if 'GUID:' in line:
-                    parts = line.split()
-                    if len(parts) >= 2:
-                        guid = parts[1]
-                        # Check for English or Korean keywords
-                        if any(keyword in line for keyword in ['Balanced', '균형']):
-                            plans['balanced'] = guid
-                        elif any(keyword in line for keyword in ['High performance', '고성능']):
-                            plans['performance'] = guid
-                        elif any(keyword in line for keyword in ['Power saver', '절전']):
-                            plans['saver'] = guid
+            for guid, name in self.schemes.items():
+                # Check for English or Korean keywords
+                if any(keyword in name for keyword in ['Balanced', '균형']):
+                    plans['balanced'] = guid
+                elif any(keyword in name for keyword in ['High performance', '고성능']):
+                    plans['performance'] = guid
+                elif any(keyword in name for keyword in ['Power saver', '절전']):
+                    plans['saver'] = guid
         
         return plans
     
-    def set_power_plan(self, profile: PowerProfile):
+    def get_active_scheme(self) -> Optional[str]:
+        if self.powrprof:
+            try:
+                return self.powrprof.get_active_scheme()
+            except OSError as e:
+                logger.debug(f"PowerGetActiveScheme failed: {e}")
+        output = self._run_powershell("powercfg /getactivescheme")
+        match = GUID_PATTERN.search(output)
+        return match.group(0).lower() if match else None
+    
+    # A plan is a scheme type ('saver', 'balanced', 'performance') or the
+    # GUID of a specific scheme
+    def scheme_guid(self, plan: str) -> str:
+        return PLAN_SCHEME_GUIDS.get(plan, plan)
+    
+    def target_scheme_guid(self, plan: str) -> str:
+        # The scheme set_power_plan ends up activating: the standard one
+        # unless this image lacks it, otherwise the detected fallback
+        guid = self.scheme_guid(plan)
+        if not self.schemes or guid in self.schemes:
+            return guid
+        return self._fallback_plan_guid(plan) or guid
+    
+    def _fallback_plan_guid(self, plan: str) -> Optional[str]:
+        if plan not in PLAN_SCHEME_GUIDS:
+            return None
+        return self.power_plans.get(plan, self.power_plans.get('balanced'))
+    
+    def set_power_plan(self, plan: str):
+        if self.powrprof:
+            # Try the standard scheme first, then whatever plan was detected
+            # for this profile (OEM images sometimes remove the standard ones)
+            error = None
+            for plan_guid in (self.scheme_guid(plan), self._fallback_plan_guid(plan)):
+                if not plan_guid:
+                    continue
+                try:
+                    self.powrprof.set_active_scheme(plan_guid)
+                    logger.info(f"Set power plan to {plan} ({plan_guid})")
+                    return
+                except OSError as e:
+                    error = e
+            if error:
+                raise error
+            return
+        
         # Use built-in Windows scheme aliases instead of GUIDs
-        # Note: The naming is counterintuitive!
-        # SCHEME_MAX = Power Saver (MAXimum power saving)
-        # SCHEME_MIN = High Performance (MINimum power saving)
-        # SCHEME_BALANCED = Balanced
-        if profile == PowerProfile.BATTERY_SAVER:
-            scheme = "SCHEME_MAX"  # Power Saver
-        else:
-            scheme = "SCHEME_MIN"  # High Performance
+        scheme = PLAN_ALIASES.get(plan, plan)
+        
+        result = self.executor.run_powershell(f"powercfg /setactive {scheme}", timeout=POWERSHELL_TIMEOUT)
+        if result.returncode == 0:
+            logger.info(f"Set power plan to {plan} using {scheme}")
+            return
         
-        result = self._run_powershell(f"powercfg /setactive {scheme}")
-        if result or result == "":
-            logger.info(f"Set power plan to {profile.value} using {scheme}")
+        # Fallback to GUID method if aliases don't work
+        plan_guid = self._fallback_plan_guid(plan)
+        if plan_guid:
+            result = self.executor.run_powershell(f"powercfg /setactive {plan_guid}", timeout=POWERSHELL_TIMEOUT)
+        result.check_returncode()
+        logger.info(f"Set power plan to {plan} using GUID")
+    
+    def activate_scheme(self, guid: str):
+        if self.powrprof:
+            self.powrprof.set_active_scheme(guid)
         else:
-            # Fallback to GUID method if aliases don't work
-            if profile == PowerProfile.BATTERY_SAVER:
-                plan_guid = self.power_plans.get('saver', self.power_plans.get('balanced'))
-            else:
-                plan_guid = self.power_plans.get('performance', self.power_plans.get('balanced'))
-            
-            if plan_guid:
-                self._run_powershell(f"powercfg /setactive {plan_guid}")
-                logger.info(f"Set power plan to {profile.value} using GUID")
+            self.executor.run(["powercfg", "/setactive", guid]).check_returncode()
+        logger.info(f"Activated power scheme {guid}")
+    
+    def read_power_settings(self, scheme: str, names: List[str]) -> Dict[str, Tuple[Optional[int], Optional[int]]]:
+        # (AC, DC) values of POWER_SETTINGS entries; each is read from the
+        # system once per scheme and served from the cache afterwards
+        missing = [name for name in names if (scheme, name) not in self._setting_cache]
+        if missing:
+            for name, values in self._read_settings(scheme, missing).items():
+                self._setting_cache[(scheme, name)] = values
+        return {name: self._setting_cache[(scheme, name)] for name in names}
+    
+    def _read_settings(self, scheme: str, names: List[str]) -> Dict[str, Tuple[Optional[int], Optional[int]]]:
+        values = {}
+        if self.powrprof:
+            for name in names:
+                setting = POWER_SETTINGS[name]
+                try:
+                    values[name] = (self.powrprof.read_value_index(scheme, setting.subgroup, setting.guid, True),
+                                    self.powrprof.read_value_index(scheme, setting.subgroup, setting.guid, False))
+                except OSError as e:
+                    logger.debug(f"Could not read power setting {name}: {e}")
+                    values[name] = (None, None)
+            return values
+        
+        # One PowerShell call for every query. powercfg's labels are
+        # localised, so the AC and DC indexes are taken as the last two hex
+        # values of each setting's section.
+        output = self._run_powershell("; ".join(
+            f"powercfg /q {scheme} {POWER_SETTINGS[name].subgroup} {POWER_SETTINGS[name].guid}; Write-Output '--'"
+            for name in names
+        ))
+        sections = re.split(r"^--\s*$", output, flags=re.MULTILINE)
+        for index, name in enumerate(names):
+            indexes = re.findall(r"0x([0-9a-fA-F]{8})", sections[index]) if index < len(sections) else []
+            values[name] = (int(indexes[-2], 16), int(indexes[-1], 16)) if len(indexes) >= 2 else (None, None)
+        return values
+    
+    def set_power_settings(self, targets: Iterable[Tuple[str, Optional[int], Optional[int]]],
+                           force: bool = False) -> List[str]:
+        # targets are (name, AC value, DC value), None leaving that side
+        # alone. Only values that differ from the active scheme's are
+        # written, then the scheme is re-activated once so they take
+        # effect. Returns the names of the settings written.
+        targets = list(targets)
+        scheme = self.get_active_scheme()
+        if not scheme or not targets:
+            return []
+        names = [name for name, _, _ in targets]
+        if force:
+            for name in names:
+                self._setting_cache.pop((scheme, name), None)
+        current = self.read_power_settings(scheme, names)
+        
+        writes = []
+        for name, ac, dc in targets:
+            current_ac, current_dc = current[name]
+            if current_ac is None and current_dc is None:
+                logger.debug(f"Power setting {name} is not available on this system")
+                continue
+            for is_ac, target, value in ((True, ac, current_ac), (False, dc, current_dc)):
+                if target is not None and (force or target != value):
+                    writes.append((name, is_ac, target))
+        if not writes:
+            return []
+        
+        try:
+            self._write_settings(scheme, writes)
+        except (OSError, subprocess.SubprocessError):
+            # Some writes may have landed; read everything again next time
+            for name in names:
+                self._setting_cache.pop((scheme, name), None)
+            raise
+        for name, is_ac, target in writes:
+            ac_value, dc_value = self._setting_cache[(scheme, name)]
+            self._setting_cache[(scheme, name)] = (target, dc_value) if is_ac else (ac_value, target)
+        changed = list(dict.fromkeys(name for name, _, _ in writes))
+        logger.info(f"Set power settings: {', '.join(changed)}")
+        return changed
+    
+    def _write_settings(self, scheme: str, writes: List[Tuple[str, bool, int]]):
+        if self.powrprof:
+            for name, is_ac, value in writes:
+                setting = POWER_SETTINGS[name]
+                self.powrprof.write_value_index(scheme, setting.subgroup, setting.guid, is_ac, value)
+            self.powrprof.set_active_scheme(scheme)
+            return
+        commands = [
+            f"powercfg /set{'ac' if is_ac else 'dc'}valueindex {scheme} "
+            f"{POWER_SETTINGS[name].subgroup} {POWER_SETTINGS[name].guid} {value}"
+            for name, is_ac, value in writes
+        ]
+        commands.append(f"powercfg /setactive {scheme}")
+        self.executor.run_powershell("; ".join(commands), timeout=POWERSHELL_TIMEOUT).check_returncode()
 
 
-class DisplayManager:
+class PHYSICAL_MONITOR(ctypes.Structure):
+    _fields_ = [("hPhysicalMonitor", ctypes.c_void_p), ("szPhysicalMonitorDescription", ctypes.c_wchar * 128)]
+
+
+class MonitorConfigBrightness:
+    # Brightness through the Win32 monitor configuration API (dxva2). Each
+    # call is a direct DDC/CI request with no COM or process overhead. Many
+    # internal laptop panels do not implement it, so available() is checked
+    # before it is used.
     def __init__(self):
+        self._lock = threading.Lock()
+        self._monitors = None
+        self._ranges = {}
+
+    def _open(self) -> List[PHYSICAL_MONITOR]:
+        if self._monitors is not None:
+            return self._monitors
+        from ctypes import wintypes
+        user32 = ctypes.windll.user32
+        dxva2 = ctypes.windll.dxva2
+        handles = []
+        callback_type = ctypes.WINFUNCTYPE(wintypes.BOOL, wintypes.HMONITOR, wintypes.HDC,
+                                           ctypes.POINTER(wintypes.RECT), wintypes.LPARAM)
+
+        def collect(hmonitor, hdc, rect, data):
+            handles.append(hmonitor)
+            return True
+
+        user32.EnumDisplayMonitors(None, None, callback_type(collect), 0)
+        monitors = []
+        for hmonitor in handles:
+            count = wintypes.DWORD()
+            if not dxva2.GetNumberOfPhysicalMonitorsFromHMONITOR(hmonitor, ctypes.byref(count)) or not count.value:
+                continue
+            physical = (PHYSICAL_MONITOR * count.value)()
+            if dxva2.GetPhysicalMonitorsFromHMONITOR(hmonitor, count.value, physical):
+                monitors.extend(physical)
+        self._monitors = monitors
+        return monitors
+
+    def _read(self, monitor: PHYSICAL_MONITOR) -> Optional[Tuple[int, int, int]]:
+        from ctypes import wintypes
+        minimum, current, maximum = wintypes.DWORD(), wintypes.DWORD(), wintypes.DWORD()
+        if not ctypes.windll.dxva2.GetMonitorBrightness(monitor.hPhysicalMonitor, ctypes.byref(minimum),
+                                                         ctypes.byref(current), ctypes.byref(maximum)):
+            return None
+        self._ranges[monitor.hPhysicalMonitor] = (minimum.value, maximum.value)
+        return minimum.value, current.value, maximum.value
+
+    def available(self) -> bool:
+        if not hasattr(ctypes, "windll"):
+            return False
+        try:
+            with self._lock:
+                return any(self._read(monitor) for monitor in self._open())
+        except (OSError, AttributeError):
+            return False
+
+    def get(self) -> Optional[int]:
+        with self._lock:
+            for monitor in self._open():
+                reading = self._read(monitor)
+                if reading:
+                    minimum, current, maximum = reading
+                    return round((current - minimum) * 100 / max(1, maximum - minimum))
+        return None
+
+    def set(self, level: int):
+        with self._lock:
+            changed = False
+            for monitor in self._open():
+                if monitor.hPhysicalMonitor not in self._ranges and not self._read(monitor):
+                    continue
+                minimum, maximum = self._ranges[monitor.hPhysicalMonitor]
+                value = minimum + round((maximum - minimum) * level / 100)
+                changed |= bool(ctypes.windll.dxva2.SetMonitorBrightness(monitor.hPhysicalMonitor, value))
+            if not changed:
+                raise OSError("SetMonitorBrightness failed on every monitor")
+
+    def close(self):
+        with self._lock:
+            if self._monitors:
+                array = (PHYSICAL_MONITOR * len(self._monitors))(*self._monitors)
+                ctypes.windll.dxva2.DestroyPhysicalMonitors(len(self._monitors), array)
+            self._monitors = None
+            self._ranges = {}
+
+
+class DEVMODEW(ctypes.Structure):
+    # Display variant of DEVMODEW; the printer/display union is the
+    # dmPosition/dmDisplayOrientation/dmDisplayFixedOutput member
+    _fields_ = [
+        ("dmDeviceName", ctypes.c_wchar * 32),
+        ("dmSpecVersion", ctypes.c_ushort),
+        ("dmDriverVersion", ctypes.c_ushort),
+        ("dmSize", ctypes.c_ushort),
+        ("dmDriverExtra", ctypes.c_ushort),
+        ("dmFields", ctypes.c_uint32),
+        ("dmPositionX", ctypes.c_long),
+        ("dmPositionY", ctypes.c_long),
+        ("dmDisplayOrientation", ctypes.c_uint32),
+        ("dmDisplayFixedOutput", ctypes.c_uint32),
+        ("dmColor", ctypes.c_short),
+        ("dmDuplex", ctypes.c_short),
+        ("dmYResolution", ctypes.c_short),
+        ("dmTTOption", ctypes.c_short),
+        ("dmCollate", ctypes.c_short),
+        ("dmFormName", ctypes.c_wchar * 32),
+        ("dmLogPixels", ctypes.c_ushort),
+        ("dmBitsPerPel", ctypes.c_uint32),
+        ("dmPelsWidth", ctypes.c_uint32),
+        ("dmPelsHeight", ctypes.c_uint32),
+        ("dmDisplayFlags", ctypes.c_uint32),
+        ("dmDisplayFrequency", ctypes.c_uint32),
+        ("dmICMMethod", ctypes.c_uint32),
+        ("dmICMIntent", ctypes.c_uint32),
+        ("dmMediaType", ctypes.c_uint32),
+        ("dmDitherType", ctypes.c_uint32),
+        ("dmReserved1", ctypes.c_uint32),
+        ("dmReserved2", ctypes.c_uint32),
+        ("dmPanningWidth", ctypes.c_uint32),
+        ("dmPanningHeight", ctypes.c_uint32),
+    ]
+
+
+class DisplayMode(NamedTuple):
+    width: int
+    height: int
+    bits_per_pixel: int
+    refresh_rate: int
+
+
+class DisplayModes:
+    # Mode enumeration and switching for one display. NativeDisplayModes and
+    # SimulatedDisplayModes implement it, so the rate selection logic can
+    # run without a display.
+    def current(self) -> Optional[DisplayMode]:
+        raise NotImplementedError
+
+    def modes(self) -> List[DisplayMode]:
+        raise NotImplementedError
+
+    def apply(self, mode: DisplayMode):
+        raise NotImplementedError
+
+
+class NativeDisplayModes(DisplayModes):
+    # EnumDisplaySettingsExW / ChangeDisplaySettingsExW on the primary
+    # display (device None)
+    ENUM_CURRENT_SETTINGS = -1
+    DM_DISPLAYFREQUENCY = 0x400000
+    CDS_UPDATEREGISTRY = 0x01
+    CDS_TEST = 0x02
+    DISP_CHANGE_MESSAGES = {
+        1: "a restart is required",
+        -1: "the driver rejected the mode",
+        -2: "the mode is not supported",
+        -3: "the registry could not be updated",
+        -4: "invalid flags",
+        -5: "invalid parameter",
+        -6: "the display is part of a DualView",
+    }
+
+    def __init__(self, device: Optional[str] = None):
+        self.device = device
+        self.user32 = ctypes.windll.user32
+
+    def _enum(self, index: int) -> Optional[DEVMODEW]:
+        devmode = DEVMODEW()
+        devmode.dmSize = ctypes.sizeof(DEVMODEW)
+        if not self.user32.EnumDisplaySettingsExW(self.device, index, ctypes.byref(devmode), 0):
+            return None
+        return devmode
+
+    @staticmethod
+    def _mode(devmode: DEVMODEW) -> DisplayMode:
+        return DisplayMode(devmode.dmPelsWidth, devmode.dmPelsHeight, devmode.dmBitsPerPel, devmode.dmDisplayFrequency)
+
+    def current(self) -> Optional[DisplayMode]:
+        devmode = self._enum(self.ENUM_CURRENT_SETTINGS)
+        return self._mode(devmode) if devmode else None
+
+    def modes(self) -> List[DisplayMode]:
+        modes = []
+        index = 0
+        while True:
+            devmode = self._enum(index)
+            if devmode is None:
+                return modes
+            modes.append(self._mode(devmode))
+            index += 1
+
+    def apply(self, mode: DisplayMode):
+        # Only the frequency changes; the mode is tested before it is set
+        devmode = self._enum(self.ENUM_CURRENT_SETTINGS)
+        if devmode is None:
+            raise OSError("EnumDisplaySettingsExW failed")
+        devmode.dmDisplayFrequency = mode.refresh_rate
+        devmode.dmFields = self.DM_DISPLAYFREQUENCY
+        for flags in (self.CDS_TEST, self.CDS_UPDATEREGISTRY):
+            status = self.user32.ChangeDisplaySettingsExW(self.device, ctypes.byref(devmode), None, flags, None)
+            if status != 0:
+                message = self.DISP_CHANGE_MESSAGES.get(status, f"status {status}")
+                raise OSError(f"ChangeDisplaySettingsExW failed: {message}")
+
+
+class SimulatedDisplayModes(DisplayModes):
+    # A 2560x1600 panel with 60 and 240 Hz modes
+    def __init__(self, rates: Iterable[int] = (60, 240), width: int = 2560, height: int = 1600,
+                 refresh_rate: int = 240):
+        self._modes = [DisplayMode(width, height, 32, rate) for rate in rates]
+        self._current = DisplayMode(width, height, 32, refresh_rate)
+        self.apply_calls = 0
+
+    def current(self) -> Optional[DisplayMode]:
+        return self._current
+
+    def modes(self) -> List[DisplayMode]:
+        return list(self._modes)
+
+    def apply(self, mode: DisplayMode):
+        if mode not in self._modes:
+            raise OSError("ChangeDisplaySettingsExW failed: the mode is not supported")
+        self._current = mode
+        self.apply_calls += 1
+
+
+def closest_refresh_rate(rates: Iterable[int], target: int) -> Optional[int]:
+    # Ties go to the higher rate
+    return min(rates, key=lambda rate: (abs(rate - target), -rate), default=None)
+
+
+class DisplayManager:
+    def __init__(self, executor: Optional[CommandExecutor] = None, capabilities: Optional[Dict] = None,
+                 display_modes: Optional[DisplayModes] = None):
+        self.executor = executor or get_executor()
         self.wmi_available = self._check_wmi()
         self.brightness_supported = False
+        # "monitor_config" (dxva2 via ctypes) or "wmi"
+        self.brightness_backend = None
+        # Supported refresh rates at the current resolution
         self.refresh_rates = []
-        self._check_display_capabilities()
+        self.refresh_resolution = None
+        self.display_modes = display_modes
+        if display_modes is None and self.executor.allow_native and hasattr(ctypes, "windll"):
+            self.display_modes = NativeDisplayModes()
+        self.monitor_config = MonitorConfigBrightness()
+        # WMI objects belong to the COM apartment of the thread that created
+        # them, so the connection and method handle are cached per thread
+        self._wmi_local = threading.local()
+        if capabilities is not None:
+            self.brightness_supported = capabilities["brightness_supported"]
+            self.brightness_backend = capabilities["brightness_backend"]
+            self.refresh_rates = list(capabilities["refresh_rates"])
+            self.refresh_resolution = capabilities["refresh_resolution"]
+        else:
+            self._check_display_capabilities()
+    
+    def get_capabilities(self) -> Dict:
+        return {
+            "brightness_supported": self.brightness_supported,
+            "brightness_backend": self.brightness_backend,
+            "refresh_rates": list(self.refresh_rates),
+            "refresh_resolution": self.refresh_resolution,
+        }
     
     def _check_wmi(self) -> bool:
         try:
@@ -113,83 +1202,563 @@ class DisplayManager:
             logger.warning("WMI module not available. Some display features may be limited.")
             return False
     
+    def _wmi_connection(self):
+        connection = getattr(self._wmi_local, "connection", None)
+        if connection is None:
+            import wmi
+            connection = wmi.WMI(namespace='wmi')
+            self._wmi_local.connection = connection
+        return connection
+    
+    def _brightness_methods(self):
+        methods = getattr(self._wmi_local, "methods", None)
+        if methods is None:
+            methods = self._wmi_connection().WmiMonitorBrightnessMethods()[0]
+            self._wmi_local.methods = methods
+        return methods
+    
+    def _reset_wmi(self):
+        self._wmi_local.connection = None
+        self._wmi_local.methods = None
+    
     def _check_display_capabilities(self):
-        # Check if brightness control is supported
-        try:
-            if self.wmi_available:
-                import wmi
-                c = wmi.WMI(namespace='wmi')
-                brightness_methods = c.WmiMonitorBrightnessMethods()
-                if brightness_methods:
+        # Check if brightness control is supported, preferring the native API
+        if self.executor.allow_native and self.monitor_config.available():
+            self.brightness_supported = True
+            self.brightness_backend = "monitor_config"
+            logger.info("Brightness control is supported (monitor configuration API)")
+        else:
+            try:
+                if self.wmi_available:
+                    self._brightness_methods()
                     self.brightness_supported = True
+                    self.brightness_backend = "wmi"
                     logger.info("Brightness control is supported")
-        except:
-            self.brightness_supported = False
-            logger.info("Brightness control not supported on this display")
+            except:
+                self._reset_wmi()
+                self.brightness_supported = False
+                logger.info("Brightness control not supported on this display")
         
         # Get supported refresh rates
         try:
-            result = subprocess.run([
-                "wmic", "path", "Win32_VideoController", "get", "CurrentRefreshRate,MinRefreshRate,MaxRefreshRate"
-            ], capture_output=True, text=True)
-            if result.returncode == 0:
-                lines = result.stdout.strip().split('\n')
-                if len(lines) > 1:
-                    values = lines[1].split()
-                    if values and values[0].isdigit():
-                        current_rate = int(values[0])
-                        self.refresh_rates.append(current_rate)
-                        logger.info(f"Current refresh rate: {current_rate}Hz")
-        except:
-            pass
+            self._load_refresh_rates()
+            if self.refresh_rates:
+                logger.info(f"Supported refresh rates: {', '.join(f'{rate}Hz' for rate in self.refresh_rates)}")
+        except OSError as e:
+            logger.info(f"Could not enumerate display modes: {e}")
+    
+    def _load_refresh_rates(self, current: Optional[DisplayMode] = None) -> List[int]:
+        # Modes are enumerated once per resolution; the result is cached
+        # with the other capabilities
+        if self.display_modes is None:
+            return []
+        current = current or self.display_modes.current()
+        if current is None:
+            return []
+        resolution = [current.width, current.height]
+        if resolution != self.refresh_resolution:
+            self.refresh_rates = sorted({
+                mode.refresh_rate for mode in self.display_modes.modes()
+                if (mode.width, mode.height, mode.bits_per_pixel) == current[:3] and mode.refresh_rate > 1
+            })
+            self.refresh_resolution = resolution
+        return self.refresh_rates
+    
+    def get_brightness(self) -> Optional[int]:
+        if not self.brightness_supported:
+            return None
+        try:
+            if self.brightness_backend == "monitor_config":
+                return self.monitor_config.get()
+            if self.wmi_available:
+                return int(self._wmi_connection().WmiMonitorBrightness()[0].CurrentBrightness)
+            result = self.executor.run_powershell(
+                "(Get-WmiObject -Namespace root/WMI -Class WmiMonitorBrightness).CurrentBrightness"
+            )
+            values = result.stdout.split()
+            return int(values[0]) if values and values[0].isdigit() else None
+        except Exception as e:
+            self._reset_wmi()
+            logger.debug(f"Could not read brightness: {e}")
+            return None
     
     def set_brightness(self, level: int):
         if not self.brightness_supported:
-            raise Exception("Brightness control not supported on this display")
+            raise NotSupportedError("Brightness control not supported on this display")
         
         level = max(0, min(100, level))
         
-        if self.wmi_available:
-            try:
-                import wmi
-                c = wmi.WMI(namespace='wmi')
-                methods = c.WmiMonitorBrightnessMethods()[0]
-                methods.WmiSetBrightness(level, 0)
-                logger.info(f"Set brightness to {level}%")
-                return True
-            except Exception as e:
-                error_msg = str(e)
-                if "0x8004100c" in error_msg:
-                    raise Exception("Brightness control not supported on this display")
-                raise e
+        if self.brightness_backend == "monitor_config":
+            self.monitor_config.set(level)
+            logger.info(f"Set brightness to {level}%")
+            return True
+        elif self.wmi_available:
+            # A cached handle can go stale (e.g. after a display change), so
+            # drop it and retry once with a fresh connection
+            for attempt in range(2):
+                try:
+                    self._brightness_methods().WmiSetBrightness(level, 0)
+                    logger.info(f"Set brightness to {level}%")
+                    return True
+                except Exception as e:
+                    self._reset_wmi()
+                    error_msg = str(e)
+                    if "0x8004100c" in error_msg:
+                        raise NotSupportedError("Brightness control not supported on this display")
+                    if attempt:
+                        raise e
         else:
             try:
-                subprocess.run([
-                    "powershell", "-Command",
+                self.executor.run_powershell(
                     f"(Get-WmiObject -Namespace root/WMI -Class WmiMonitorBrightnessMethods).WmiSetBrightness(1,{level})"
-                ], check=True)
+                ).check_returncode()
                 logger.info(f"Set brightness to {level}%")
                 return True
             except Exception as e:
-                raise Exception("Brightness control not supported on this display")
+                raise NotSupportedError("Brightness control not supported on this display")
     
-    def set_refresh_rate(self, rate: int):
+    def get_refresh_rate(self) -> Optional[int]:
+        if self.display_modes is None:
+            return None
         try:
-            subprocess.run([
-                "powershell", "-Command",
-                f"$displays = Get-CimInstance -Namespace root\\wmi -ClassName WmiMonitorListedSupportedSourceModes; "
-                f"# This would require more complex implementation with display API"
-            ])
-            logger.info(f"Refresh rate control requires additional display API implementation")
-        except Exception as e:
-            logger.error(f"Failed to set refresh rate: {e}")
+            current = self.display_modes.current()
+        except OSError as e:
+            logger.debug(f"Could not read refresh rate: {e}")
+            return None
+        return current.refresh_rate if current else None
+    
+    def set_refresh_rate(self, rate: int) -> Optional[int]:
+        # Switches to the supported rate closest to `rate`; returns it, or
+        # None when the panel is already there
+        current = self.display_modes.current() if self.display_modes else None
+        if current is None:
+            raise NotSupportedError("Refresh rate control not supported on this display")
+        target = closest_refresh_rate(self._load_refresh_rates(current), rate)
+        if target is None:
+            raise NotSupportedError("Refresh rate control not supported on this display")
+        if target == current.refresh_rate:
+            return None
+        self.display_modes.apply(current._replace(refresh_rate=target))
+        logger.info(f"Set refresh rate to {target}Hz")
+        return target
 
 
-class ProcessManager:
+class ProcessInfo(NamedTuple):
+    name: str
+    pid: int
+
+
+class KillReport:
     def __init__(self):
-        self.bloatware_processes = [
-            "ArmouryCrate.exe",
-            "ArmouryCrate.Service.exe",
+        # pid -> (image name, terminated, message)
+        self.results: Dict[int, Tuple[str, bool, str]] = {}
+        self.elapsed = 0.0
+
+    @property
+    def killed(self) -> List[str]:
+        return [name for name, ok, _ in self.results.values() if ok]
+
+    @property
+    def failed(self) -> List[str]:
+        return [name for name, ok, _ in self.results.values() if not ok]
+
+
+class ProcessSample(NamedTuple):
+    # One entry of a process-table snapshot. cpu_time is user plus kernel
+    # time in seconds, context_switches the sum over the process's threads.
+    pid: int
+    name: str
+    create_time: int
+    session_id: int
+    cpu_time: float
+    context_switches: int
+
+
+class ProcessActivity(NamedTuple):
+    pid: int
+    name: str
+    create_time: int
+    session_id: int
+    # Cores kept busy and thread wake-ups per second between two snapshots
+    cpu_share: float
+    wakeups_per_second: float
+    score: float
+
+
+class ThrottledProcess(NamedTuple):
+    pid: int
+    name: str
+    create_time: int
+    # "suspend" or "eco"; priority is the priority class to restore for eco
+    mode: str
+    priority: Optional[int] = None
+
+
+THROTTLE_MODES = ("eco", "suspend")
+
+# Wake-ups per second that rank the same as one fully busy core
+WAKEUPS_PER_CORE = 2000.0
+# Processes scoring below this (about 2% of a core) are left alone
+THROTTLE_MIN_SCORE = 0.02
+
+
+def rank_processes(before: Iterable[ProcessSample], after: Iterable[ProcessSample],
+                   interval: float) -> List[ProcessActivity]:
+    # Busiest processes first. Processes are matched on PID and creation
+    # time so a reused PID is never compared with the process it replaced.
+    if interval <= 0:
+        raise ValueError("interval must be positive")
+    previous = {(sample.pid, sample.create_time): sample for sample in before}
+    ranked = []
+    for sample in after:
+        old = previous.get((sample.pid, sample.create_time))
+        if old is None:
+            continue
+        cpu_share = max(0.0, sample.cpu_time - old.cpu_time) / interval
+        wakeups = max(0, sample.context_switches - old.context_switches) / interval
+        ranked.append(ProcessActivity(sample.pid, sample.name, sample.create_time, sample.session_id,
+                                      cpu_share, wakeups, cpu_share + wakeups / WAKEUPS_PER_CORE))
+    ranked.sort(key=lambda activity: (-activity.score, activity.pid))
+    return ranked
+
+
+def select_throttle_targets(ranked: Iterable[ProcessActivity], allowlist: Iterable[str], limit: int,
+                            min_score: float = THROTTLE_MIN_SCORE,
+                            protected_pids: Iterable[int] = ()) -> List[ProcessActivity]:
+    # The top `limit` consumers, skipping session 0 (services and the
+    # kernel), allowlisted image names and protected PIDs
+    allowed = {name.lower() for name in allowlist}
+    protected = set(protected_pids)
+    targets = []
+    for activity in ranked:
+        if len(targets) >= limit or activity.score < min_score:
+            break
+        if activity.session_id == 0 or activity.pid in protected or activity.name.lower() in allowed:
+            continue
+        targets.append(activity)
+    return targets
+
+
+class ProcessControl:
+    # Process-table snapshots and per-process throttling.
+    # NativeProcessControl and SimulatedProcessControl implement it, so the
+    # throttling bookkeeping can run without Windows.
+    IDLE_PRIORITY_CLASS = 0x40
+
+    def snapshot(self) -> List[ProcessSample]:
+        raise NotImplementedError
+
+    def foreground_pid(self) -> Optional[int]:
+        raise NotImplementedError
+
+    def suspend(self, pid: int):
+        raise NotImplementedError
+
+    def resume(self, pid: int):
+        raise NotImplementedError
+
+    def get_priority(self, pid: int) -> int:
+        raise NotImplementedError
+
+    def set_priority(self, pid: int, priority: int):
+        raise NotImplementedError
+
+    def set_eco_qos(self, pid: int, enabled: bool):
+        raise NotImplementedError
+
+
+class SYSTEM_PROCESS_INFORMATION(ctypes.Structure):
+    # Followed in the buffer by NumberOfThreads SYSTEM_THREAD_INFORMATION
+    _fields_ = [
+        ("NextEntryOffset", ctypes.c_uint32),
+        ("NumberOfThreads", ctypes.c_uint32),
+        ("WorkingSetPrivateSize", ctypes.c_int64),
+        ("HardFaultCount", ctypes.c_uint32),
+        ("NumberOfThreadsHighWatermark", ctypes.c_uint32),
+        ("CycleTime", ctypes.c_uint64),
+        ("CreateTime", ctypes.c_int64),
+        ("UserTime", ctypes.c_int64),
+        ("KernelTime", ctypes.c_int64),
+        ("ImageNameLength", ctypes.c_uint16),
+        ("ImageNameMaximumLength", ctypes.c_uint16),
+        ("ImageNameBuffer", ctypes.c_void_p),
+        ("BasePriority", ctypes.c_int32),
+        ("UniqueProcessId", ctypes.c_void_p),
+        ("InheritedFromUniqueProcessId", ctypes.c_void_p),
+        ("HandleCount", ctypes.c_uint32),
+        ("SessionId", ctypes.c_uint32),
+        ("UniqueProcessKey", ctypes.c_void_p),
+        ("PeakVirtualSize", ctypes.c_size_t),
+        ("VirtualSize", ctypes.c_size_t),
+        ("PageFaultCount", ctypes.c_uint32),
+        ("PeakWorkingSetSize", ctypes.c_size_t),
+        ("WorkingSetSize", ctypes.c_size_t),
+        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+        ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+        ("PagefileUsage", ctypes.c_size_t),
+        ("PeakPagefileUsage", ctypes.c_size_t),
+        ("PrivatePageCount", ctypes.c_size_t),
+        ("ReadOperationCount", ctypes.c_int64),
+        ("WriteOperationCount", ctypes.c_int64),
+        ("OtherOperationCount", ctypes.c_int64),
+        ("ReadTransferCount", ctypes.c_int64),
+        ("WriteTransferCount", ctypes.c_int64),
+        ("OtherTransferCount", ctypes.c_int64),
+    ]
+
+
+class SYSTEM_THREAD_INFORMATION(ctypes.Structure):
+    _fields_ = [
+        ("KernelTime", ctypes.c_int64),
+        ("UserTime", ctypes.c_int64),
+        ("CreateTime", ctypes.c_int64),
+        ("WaitTime", ctypes.c_uint32),
+        ("StartAddress", ctypes.c_void_p),
+        ("UniqueProcess", ctypes.c_void_p),
+        ("UniqueThread", ctypes.c_void_p),
+        ("Priority", ctypes.c_int32),
+        ("BasePriority", ctypes.c_int32),
+        ("ContextSwitches", ctypes.c_uint32),
+        ("ThreadState", ctypes.c_uint32),
+        ("WaitReason", ctypes.c_uint32),
+    ]
+
+
+class PROCESS_POWER_THROTTLING_STATE(ctypes.Structure):
+    _fields_ = [
+        ("Version", ctypes.c_uint32),
+        ("ControlMask", ctypes.c_uint32),
+        ("StateMask", ctypes.c_uint32),
+    ]
+
+
+class NativeProcessControl(ProcessControl):
+    # One NtQuerySystemInformation call returns every process with its CPU
+    # times and per-thread context switch counts. Suspension uses the
+    # process-wide NtSuspendProcess/NtResumeProcess; EcoQoS is the
+    # ProcessPowerThrottling execution-speed flag.
+    SYSTEM_PROCESS_INFORMATION_CLASS = 5
+    STATUS_INFO_LENGTH_MISMATCH = 0xC0000004
+    PROCESS_SET_INFORMATION = 0x0200
+    PROCESS_SUSPEND_RESUME = 0x0800
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    PROCESS_POWER_THROTTLING = 4
+    POWER_THROTTLING_EXECUTION_SPEED = 0x1
+
+    def __init__(self):
+        self.ntdll = ctypes.WinDLL("ntdll")
+        self.kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self.user32 = ctypes.windll.user32
+        self.ntdll.NtQuerySystemInformation.argtypes = [ctypes.c_uint32, ctypes.c_void_p, ctypes.c_uint32,
+                                                        ctypes.POINTER(ctypes.c_uint32)]
+        self.ntdll.NtQuerySystemInformation.restype = ctypes.c_uint32
+        for name in ("NtSuspendProcess", "NtResumeProcess"):
+            getattr(self.ntdll, name).argtypes = [ctypes.c_void_p]
+            getattr(self.ntdll, name).restype = ctypes.c_uint32
+        self.kernel32.OpenProcess.argtypes = [ctypes.c_uint32, ctypes.c_int, ctypes.c_uint32]
+        self.kernel32.OpenProcess.restype = ctypes.c_void_p
+        self.kernel32.CloseHandle.argtypes = [ctypes.c_void_p]
+        self.kernel32.GetPriorityClass.argtypes = [ctypes.c_void_p]
+        self.kernel32.GetPriorityClass.restype = ctypes.c_uint32
+        self.kernel32.SetPriorityClass.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self.kernel32.SetProcessInformation.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                                                        ctypes.c_uint32]
+        # Grown when the process table outgrows it, then reused
+        self._buffer_size = 1 << 20
+
+    def snapshot(self) -> List[ProcessSample]:
+        while True:
+            buffer = ctypes.create_string_buffer(self._buffer_size)
+            needed = ctypes.c_uint32()
+            status = self.ntdll.NtQuerySystemInformation(self.SYSTEM_PROCESS_INFORMATION_CLASS, buffer,
+                                                         self._buffer_size, ctypes.byref(needed))
+            if status != self.STATUS_INFO_LENGTH_MISMATCH:
+                break
+            self._buffer_size = max(self._buffer_size * 2, needed.value + (64 << 10))
+        if status != 0:
+            raise OSError(f"NtQuerySystemInformation failed with status 0x{status:08X}")
+
+        samples = []
+        header_size = ctypes.sizeof(SYSTEM_PROCESS_INFORMATION)
+        offset = 0
+        while True:
+            info = SYSTEM_PROCESS_INFORMATION.from_buffer(buffer, offset)
+            threads = (SYSTEM_THREAD_INFORMATION * info.NumberOfThreads).from_buffer(buffer, offset + header_size)
+            pid = info.UniqueProcessId or 0
+            if info.ImageNameBuffer:
+                name = ctypes.wstring_at(info.ImageNameBuffer, info.ImageNameLength // 2)
+            else:
+                name = "System Idle Process" if pid == 0 else ""
+            samples.append(ProcessSample(
+                pid, name, info.CreateTime, info.SessionId,
+                (info.UserTime + info.KernelTime) / 1e7,
+                sum(thread.ContextSwitches for thread in threads),
+            ))
+            if not info.NextEntryOffset:
+                return samples
+            offset += info.NextEntryOffset
+
+    def foreground_pid(self) -> Optional[int]:
+        window = self.user32.GetForegroundWindow()
+        if not window:
+            return None
+        pid = ctypes.c_uint32()
+        self.user32.GetWindowThreadProcessId(window, ctypes.byref(pid))
+        return pid.value or None
+
+    def _call(self, pid: int, access: int, func: Callable):
+        handle = self.kernel32.OpenProcess(access, False, pid)
+        if not handle:
+            raise ctypes.WinError(ctypes.get_last_error())
+        try:
+            return func(handle)
+        finally:
+            self.kernel32.CloseHandle(handle)
+
+    def _nt_call(self, pid: int, name: str):
+        status = self._call(pid, self.PROCESS_SUSPEND_RESUME, getattr(self.ntdll, name))
+        if status != 0:
+            raise OSError(f"{name} failed with status 0x{status:08X}")
+
+    def suspend(self, pid: int):
+        self._nt_call(pid, "NtSuspendProcess")
+
+    def resume(self, pid: int):
+        self._nt_call(pid, "NtResumeProcess")
+
+    def get_priority(self, pid: int) -> int:
+        priority = self._call(pid, self.PROCESS_QUERY_LIMITED_INFORMATION, self.kernel32.GetPriorityClass)
+        if not priority:
+            raise ctypes.WinError(ctypes.get_last_error())
+        return priority
+
+    def set_priority(self, pid: int, priority: int):
+        if not self._call(pid, self.PROCESS_SET_INFORMATION,
+                          lambda handle: self.kernel32.SetPriorityClass(handle, priority)):
+            raise ctypes.WinError(ctypes.get_last_error())
+
+    def set_eco_qos(self, pid: int, enabled: bool):
+        # Disabling clears the control mask, handing the decision back to
+        # the system
+        state = PROCESS_POWER_THROTTLING_STATE(
+            1,
+            self.POWER_THROTTLING_EXECUTION_SPEED if enabled else 0,
+            self.POWER_THROTTLING_EXECUTION_SPEED if enabled else 0,
+        )
+        if not self._call(pid, self.PROCESS_SET_INFORMATION, lambda handle: self.kernel32.SetProcessInformation(
+                handle, self.PROCESS_POWER_THROTTLING, ctypes.byref(state), ctypes.sizeof(state))):
+            raise ctypes.WinError(ctypes.get_last_error())
+
+
+class SimulatedProcessControl(ProcessControl):
+    # A process table whose CPU time and context switches grow in real time
+    # at the rates given in `load` (pid -> (busy cores, wake-ups per
+    # second)). Suspended processes stop accumulating.
+    NORMAL_PRIORITY_CLASS = 0x20
+
+    def __init__(self, processes: Iterable[ProcessSample] = (),
+                 load: Optional[Dict[int, Tuple[float, float]]] = None, foreground: Optional[int] = None):
+        self.processes = {process.pid: process for process in processes}
+        self.load = dict(load or {})
+        self.foreground = foreground
+        self.suspended = set()
+        self.priorities = {pid: self.NORMAL_PRIORITY_CLASS for pid in self.processes}
+        self.eco_qos = set()
+        self.calls = []
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _advance(self):
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        for pid, process in self.processes.items():
+            if pid in self.suspended:
+                continue
+            cores, wakeups = self.load.get(pid, (0.0, 0.0))
+            self.processes[pid] = process._replace(
+                cpu_time=process.cpu_time + cores * elapsed,
+                context_switches=process.context_switches + int(wakeups * elapsed),
+            )
+
+    def _check(self, pid: int):
+        if pid not in self.processes:
+            raise OSError(f"No process with PID {pid}")
+
+    def snapshot(self) -> List[ProcessSample]:
+        with self._lock:
+            self._advance()
+            return list(self.processes.values())
+
+    def foreground_pid(self) -> Optional[int]:
+        return self.foreground
+
+    def suspend(self, pid: int):
+        with self._lock:
+            self._check(pid)
+            self._advance()
+            self.suspended.add(pid)
+            self.calls.append(("suspend", pid))
+
+    def resume(self, pid: int):
+        with self._lock:
+            self._check(pid)
+            self._advance()
+            self.suspended.discard(pid)
+            self.calls.append(("resume", pid))
+
+    def get_priority(self, pid: int) -> int:
+        self._check(pid)
+        return self.priorities[pid]
+
+    def set_priority(self, pid: int, priority: int):
+        self._check(pid)
+        self.priorities[pid] = priority
+        self.calls.append(("priority", pid, priority))
+
+    def set_eco_qos(self, pid: int, enabled: bool):
+        self._check(pid)
+        (self.eco_qos.add if enabled else self.eco_qos.discard)(pid)
+        self.calls.append(("eco_qos", pid, enabled))
+
+
+class RecordStore:
+    # A list of NamedTuple records on disk, such as the processes or
+    # services this tool has throttled, so a later run (or another CLI
+    # invocation) can undo the change
+    def __init__(self, path: Path, record_type: type):
+        self.path = path
+        self.record_type = record_type
+        self._lock = threading.Lock()
+
+    def load(self) -> List:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return [self.record_type(**entry) for entry in json.load(f)]
+        except (OSError, ValueError, TypeError):
+            return []
+
+    def save(self, records: List):
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with self._lock:
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump([record._asdict() for record in records], f)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write {self.path}: {e}")
+
+
+class ProcessManager:
+    def __init__(self, executor: Optional[CommandExecutor] = None, process_control: Optional[ProcessControl] = None):
+        self.executor = executor or get_executor()
+        self.process_control = process_control
+        if process_control is None and self.executor.allow_native and hasattr(ctypes, "windll"):
+            self.process_control = NativeProcessControl()
+        self.bloatware_processes = [
+            "ArmouryCrate.exe",
+            "ArmouryCrate.Service.exe",
             "GameBarPresenceWriter.exe",
             "Xbox.TCUI.exe",
             "XboxGameBarSpotify.exe",
@@ -204,33 +1773,862 @@ class ProcessManager:
             "slack.exe",
             "spotify.exe"
         ]
+        self._bloatware_key = None
+        self._bloatware_names = frozenset()
+        # Never throttled, in addition to session 0, this process and the
+        # foreground window's process
+        self.throttle_allowlist = [
+            "explorer.exe",
+            "dwm.exe",
+            "csrss.exe",
+            "winlogon.exe",
+            "sihost.exe",
+            "ctfmon.exe",
+            "audiodg.exe",
+            "conhost.exe",
+            "fontdrvhost.exe",
+            "RuntimeBroker.exe",
+            "ShellExperienceHost.exe",
+            "StartMenuExperienceHost.exe",
+            "SearchHost.exe",
+            "TextInputHost.exe",
+            "SecurityHealthSystray.exe",
+        ]
+        self.throttle_limit = 5
+        self.throttle_min_score = THROTTLE_MIN_SCORE
+        # Seconds between the two process-table snapshots
+        self.sample_interval = 1.0
+        self.throttle_store = RecordStore(Path.home() / ".battery_saver_throttled.json", ThrottledProcess)
+    
+    def _bloatware_set(self) -> frozenset:
+        # Image names are case-insensitive on Windows; rebuilt only if the list changes
+        key = tuple(self.bloatware_processes)
+        if key != self._bloatware_key:
+            self._bloatware_names = frozenset(name.lower() for name in key)
+            self._bloatware_key = key
+        return self._bloatware_names
+    
+    def snapshot(self) -> List[ProcessInfo]:
+        result = self.executor.run(["tasklist", "/FO", "CSV", "/NH"])
+        result.check_returncode()
+        processes = []
+        for row in csv.reader(result.stdout.splitlines()):
+            if len(row) >= 2 and row[1].isdigit():
+                processes.append(ProcessInfo(row[0], int(row[1])))
+        return processes
     
-    def kill_bloatware(self):
-        killed = []
-        for process in self.bloatware_processes:
+    def terminate(self, targets: List[ProcessInfo], report: KillReport):
+        if not targets:
+            return
+        args = ["taskkill", "/F"]
+        for process in targets:
+            args += ["/PID", str(process.pid)]
+        result = self.executor.run(args)
+        
+        # taskkill reports each PID on its own line: successes on stdout,
+        # failures on stderr. Match on the PID so this works in any locale.
+        stdout_lines = result.stdout.splitlines()
+        stderr_lines = result.stderr.splitlines()
+        for process in targets:
+            pid_pattern = re.compile(rf"\b{process.pid}\b")
+            if any(pid_pattern.search(line) for line in stdout_lines):
+                report.results[process.pid] = (process.name, True, "terminated")
+                logger.info(f"Killed process: {process.name} (PID {process.pid})")
+            else:
+                message = next((line for line in stderr_lines if pid_pattern.search(line)), result.stderr.strip())
+                report.results[process.pid] = (process.name, False, message)
+                logger.debug(f"Could not kill {process.name} (PID {process.pid}): {message}")
+    
+    def kill_bloatware(self) -> KillReport:
+        start = time.perf_counter()
+        report = KillReport()
+        names = self._bloatware_set()
+        targets = [process for process in self.snapshot() if process.name.lower() in names]
+        self.terminate(targets, report)
+        report.elapsed = time.perf_counter() - start
+        logger.info(f"Terminated {len(report.killed)}/{len(targets)} bloatware processes in {report.elapsed * 1000:.0f}ms")
+        return report
+    
+    def _require_control(self) -> ProcessControl:
+        if self.process_control is None:
+            raise NotSupportedError("Process throttling not supported on this device")
+        return self.process_control
+    
+    def sample_activity(self, interval: Optional[float] = None) -> List[ProcessActivity]:
+        control = self._require_control()
+        before = control.snapshot()
+        start = time.perf_counter()
+        time.sleep(self.sample_interval if interval is None else interval)
+        after = control.snapshot()
+        return rank_processes(before, after, time.perf_counter() - start)
+    
+    def throttled(self) -> List[ThrottledProcess]:
+        return self.throttle_store.load()
+    
+    def throttle(self, mode: str) -> List[ThrottledProcess]:
+        # Suspends ("suspend") or drops to idle priority with EcoQoS ("eco")
+        # the top consumers, up to throttle_limit processes in total
+        if mode not in THROTTLE_MODES:
+            raise ValueError(f"Unknown throttle mode '{mode}'")
+        control = self._require_control()
+        throttled = self.throttled()
+        remaining = self.throttle_limit - len(throttled)
+        if remaining <= 0:
+            return []
+        protected = {os.getpid(), control.foreground_pid()} | {process.pid for process in throttled}
+        targets = select_throttle_targets(self.sample_activity(), self.throttle_allowlist, remaining,
+                                          self.throttle_min_score, protected)
+        if not targets:
+            return []
+        
+        # Recorded before anything is touched so a crash part way through
+        # still leaves every target resumable
+        planned = [ThrottledProcess(target.pid, target.name, target.create_time, mode) for target in targets]
+        self.throttle_store.save(throttled + planned)
+        done = []
+        for target, process in zip(targets, planned):
             try:
-                result = subprocess.run(
-                    ["taskkill", "/F", "/IM", process],
-                    capture_output=True,
-                    text=True
-                )
-                if result.returncode == 0:
-                    killed.append(process)
-                    logger.info(f"Killed process: {process}")
-            except Exception as e:
-                logger.debug(f"Could not kill {process}: {e}")
+                if mode == "suspend":
+                    control.suspend(process.pid)
+                else:
+                    process = process._replace(priority=control.get_priority(process.pid))
+                    control.set_priority(process.pid, control.IDLE_PRIORITY_CLASS)
+                    try:
+                        control.set_eco_qos(process.pid, True)
+                    except OSError:
+                        # Not recorded, so it must not be left at idle priority
+                        control.set_priority(process.pid, process.priority)
+                        raise
+            except OSError as e:
+                logger.debug(f"Could not throttle {process.name} (PID {process.pid}): {e}")
+                continue
+            done.append(process)
+            logger.info(f"{'Suspended' if mode == 'suspend' else 'Throttled'} {process.name} (PID {process.pid}, "
+                        f"{target.cpu_share:.0%} CPU, {target.wakeups_per_second:.0f} wake-ups/s)")
+        self.throttle_store.save(throttled + done)
+        return done
+    
+    def resume_throttled(self) -> List[ThrottledProcess]:
+        # Resumes everything throttled earlier in one pass. Processes that
+        # have exited are dropped; ones that could not be resumed are kept
+        # for the next attempt.
+        throttled = self.throttled()
+        if not throttled:
+            return []
+        control = self._require_control()
+        running = {(sample.pid, sample.create_time) for sample in control.snapshot()}
+        resumed = []
+        failed = []
+        for process in throttled:
+            if (process.pid, process.create_time) not in running:
+                continue
+            try:
+                if process.mode == "suspend":
+                    control.resume(process.pid)
+                else:
+                    control.set_eco_qos(process.pid, False)
+                    if process.priority:
+                        control.set_priority(process.pid, process.priority)
+            except OSError as e:
+                logger.warning(f"Could not resume {process.name} (PID {process.pid}): {e}")
+                failed.append(process)
+                continue
+            resumed.append(process)
+        self.throttle_store.save(failed)
+        if resumed:
+            logger.info(f"Resumed {len(resumed)} throttled processes: {', '.join(p.name for p in resumed)}")
+        return resumed
+
+
+class ServiceState(NamedTuple):
+    # status: stopped, start_pending, stop_pending, running,
+    # continue_pending, pause_pending or paused. start_type: boot, system,
+    # auto, demand or disabled.
+    status: str
+    start_type: str
+    can_pause: bool = False
+
+
+class SuspendedService(NamedTuple):
+    # A service or scheduled task changed by a profile, with the state to
+    # restore. kind is "service" or "task"; for tasks status is "enabled".
+    kind: str
+    name: str
+    action: str
+    status: str
+    start_type: Optional[str] = None
+
+
+# stop: stop the service; pause: pause it (only services that accept
+# pause); disable: stop it and set its start type to disabled so triggers
+# cannot restart it
+SERVICE_ACTIONS = ("stop", "pause", "disable")
+
+# Seconds to wait for services to reach the requested state
+SERVICE_TIMEOUT = 20.0
+
+
+class ServiceControl:
+    # Service Control Manager and Task Scheduler access. NativeServiceControl
+    # and SimulatedServiceControl implement it, so the suspend/restore
+    # bookkeeping can run without Windows. Control requests return once they
+    # are sent; callers poll query() for the service to get there. query()
+    # and task_enabled() return None for services and tasks that are not
+    # installed.
+    def query(self, name: str) -> Optional[ServiceState]:
+        raise NotImplementedError
+
+    def start(self, name: str):
+        raise NotImplementedError
+
+    def stop(self, name: str):
+        raise NotImplementedError
+
+    def pause(self, name: str):
+        raise NotImplementedError
+
+    def resume(self, name: str):
+        raise NotImplementedError
+
+    def set_start_type(self, name: str, start_type: str):
+        raise NotImplementedError
+
+    def task_enabled(self, path: str) -> Optional[bool]:
+        raise NotImplementedError
+
+    def set_task_enabled(self, path: str, enabled: bool):
+        raise NotImplementedError
+
+
+class SERVICE_STATUS_PROCESS(ctypes.Structure):
+    _fields_ = [
+        ("dwServiceType", ctypes.c_uint32),
+        ("dwCurrentState", ctypes.c_uint32),
+        ("dwControlsAccepted", ctypes.c_uint32),
+        ("dwWin32ExitCode", ctypes.c_uint32),
+        ("dwServiceSpecificExitCode", ctypes.c_uint32),
+        ("dwCheckPoint", ctypes.c_uint32),
+        ("dwWaitHint", ctypes.c_uint32),
+        ("dwProcessId", ctypes.c_uint32),
+        ("dwServiceFlags", ctypes.c_uint32),
+    ]
+
+
+class NativeServiceControl(ServiceControl):
+    # advapi32 through ctypes for services. Scheduled tasks go through the
+    # Task Scheduler COM API when pywin32 is installed, otherwise schtasks.
+    SC_MANAGER_CONNECT = 0x0001
+    SERVICE_QUERY_CONFIG = 0x0001
+    SERVICE_CHANGE_CONFIG = 0x0002
+    SERVICE_QUERY_STATUS = 0x0004
+    SERVICE_START = 0x0010
+    SERVICE_STOP = 0x0020
+    SERVICE_PAUSE_CONTINUE = 0x0040
+    SERVICE_CONTROL_STOP = 1
+    SERVICE_CONTROL_PAUSE = 2
+    SERVICE_CONTROL_CONTINUE = 3
+    SERVICE_ACCEPT_PAUSE_CONTINUE = 0x2
+    SERVICE_NO_CHANGE = 0xFFFFFFFF
+    ERROR_INSUFFICIENT_BUFFER = 122
+    ERROR_SERVICE_DOES_NOT_EXIST = 1060
+    # HRESULT_FROM_WIN32(ERROR_FILE_NOT_FOUND) from the Task Scheduler
+    TASK_NOT_FOUND = -2147024894
+    STATUSES = {1: "stopped", 2: "start_pending", 3: "stop_pending", 4: "running",
+                5: "continue_pending", 6: "pause_pending", 7: "paused"}
+    START_TYPES = {0: "boot", 1: "system", 2: "auto", 3: "demand", 4: "disabled"}
+
+    def __init__(self, executor: Optional[CommandExecutor] = None):
+        self.executor = executor or get_executor()
+        self.advapi32 = ctypes.WinDLL("advapi32", use_last_error=True)
+        self.advapi32.OpenSCManagerW.argtypes = [ctypes.c_wchar_p, ctypes.c_wchar_p, ctypes.c_uint32]
+        self.advapi32.OpenSCManagerW.restype = ctypes.c_void_p
+        self.advapi32.OpenServiceW.argtypes = [ctypes.c_void_p, ctypes.c_wchar_p, ctypes.c_uint32]
+        self.advapi32.OpenServiceW.restype = ctypes.c_void_p
+        self.advapi32.CloseServiceHandle.argtypes = [ctypes.c_void_p]
+        self.advapi32.QueryServiceStatusEx.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_uint32,
+                                                       ctypes.POINTER(ctypes.c_uint32)]
+        self.advapi32.QueryServiceConfigW.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32,
+                                                      ctypes.POINTER(ctypes.c_uint32)]
+        self.advapi32.ControlService.argtypes = [ctypes.c_void_p, ctypes.c_uint32, ctypes.c_void_p]
+        self.advapi32.StartServiceW.argtypes = [ctypes.c_void_p, ctypes.c_uint32, ctypes.c_void_p]
+        self.advapi32.ChangeServiceConfigW.argtypes = [ctypes.c_void_p, ctypes.c_uint32, ctypes.c_uint32,
+                                                       ctypes.c_uint32] + [ctypes.c_void_p] * 7
+        self._manager = None
+        self._lock = threading.Lock()
+
+    def _error(self):
+        return ctypes.WinError(ctypes.get_last_error())
+
+    def _scm(self):
+        # One connection to the SCM for the life of the process
+        with self._lock:
+            if self._manager is None:
+                manager = self.advapi32.OpenSCManagerW(None, None, self.SC_MANAGER_CONNECT)
+                if not manager:
+                    raise self._error()
+                self._manager = manager
+            return self._manager
+
+    def _call(self, name: str, access: int, func: Callable):
+        handle = self.advapi32.OpenServiceW(self._scm(), name, access)
+        if not handle:
+            raise self._error()
+        try:
+            if not func(handle):
+                raise self._error()
+        finally:
+            self.advapi32.CloseServiceHandle(handle)
+
+    def query(self, name: str) -> Optional[ServiceState]:
+        status = SERVICE_STATUS_PROCESS()
+        config = []
+
+        def read(handle) -> bool:
+            needed = ctypes.c_uint32()
+            if not self.advapi32.QueryServiceStatusEx(handle, 0, ctypes.byref(status), ctypes.sizeof(status),
+                                                      ctypes.byref(needed)):
+                return False
+            # QUERY_SERVICE_CONFIGW: dwStartType is the second DWORD
+            self.advapi32.QueryServiceConfigW(handle, None, 0, ctypes.byref(needed))
+            if ctypes.get_last_error() != self.ERROR_INSUFFICIENT_BUFFER:
+                return False
+            buffer = ctypes.create_string_buffer(needed.value)
+            if not self.advapi32.QueryServiceConfigW(handle, buffer, needed.value, ctypes.byref(needed)):
+                return False
+            config.append(ctypes.c_uint32.from_buffer(buffer, 4).value)
+            return True
+
+        try:
+            self._call(name, self.SERVICE_QUERY_STATUS | self.SERVICE_QUERY_CONFIG, read)
+        except OSError as e:
+            if getattr(e, "winerror", None) == self.ERROR_SERVICE_DOES_NOT_EXIST:
+                return None
+            raise
+        return ServiceState(
+            self.STATUSES.get(status.dwCurrentState, "unknown"),
+            self.START_TYPES.get(config[0], "unknown"),
+            bool(status.dwControlsAccepted & self.SERVICE_ACCEPT_PAUSE_CONTINUE),
+        )
+
+    def _control(self, name: str, access: int, control: int):
+        status = SERVICE_STATUS_PROCESS()
+        self._call(name, access, lambda handle: self.advapi32.ControlService(handle, control, ctypes.byref(status)))
+
+    def start(self, name: str):
+        self._call(name, self.SERVICE_START, lambda handle: self.advapi32.StartServiceW(handle, 0, None))
+
+    def stop(self, name: str):
+        self._control(name, self.SERVICE_STOP, self.SERVICE_CONTROL_STOP)
+
+    def pause(self, name: str):
+        self._control(name, self.SERVICE_PAUSE_CONTINUE, self.SERVICE_CONTROL_PAUSE)
+
+    def resume(self, name: str):
+        self._control(name, self.SERVICE_PAUSE_CONTINUE, self.SERVICE_CONTROL_CONTINUE)
+
+    def set_start_type(self, name: str, start_type: str):
+        code = next(code for code, value in self.START_TYPES.items() if value == start_type)
+        self._call(name, self.SERVICE_CHANGE_CONFIG, lambda handle: self.advapi32.ChangeServiceConfigW(
+            handle, self.SERVICE_NO_CHANGE, code, self.SERVICE_NO_CHANGE, None, None, None, None, None, None, None))
+
+    def _task(self, path: str):
+        # (available, task); task is None if the task does not exist
+        try:
+            import win32com.client
+            import pywintypes
+        except ImportError:
+            return False, None
+        scheduler = win32com.client.Dispatch("Schedule.Service")
+        scheduler.Connect()
+        try:
+            return True, scheduler.GetFolder("\\").GetTask(path)
+        except pywintypes.com_error as e:
+            if e.hresult == self.TASK_NOT_FOUND:
+                return True, None
+            raise OSError(str(e))
+
+    def task_enabled(self, path: str) -> Optional[bool]:
+        available, task = self._task(path)
+        if available:
+            return None if task is None else bool(task.Enabled)
+        result = self.executor.run(["schtasks", "/Query", "/TN", path, "/FO", "CSV", "/NH"])
+        if result.returncode != 0:
+            # schtasks only reports a missing task through localised text
+            logger.debug(f"schtasks /Query {path}: {result.stderr.strip()}")
+            return None
+        # TaskName, Next Run Time, Status
+        rows = [row for row in csv.reader(result.stdout.splitlines()) if len(row) >= 3]
+        return bool(rows) and rows[0][2].strip().lower() != "disabled"
+
+    def set_task_enabled(self, path: str, enabled: bool):
+        available, task = self._task(path)
+        if task is not None:
+            task.Enabled = enabled
+            return
+        if available:
+            raise OSError(f"Scheduled task not found: {path}")
+        result = self.executor.run(["schtasks", "/Change", "/TN", path, "/ENABLE" if enabled else "/DISABLE"])
+        if result.returncode != 0:
+            raise OSError(result.stderr.strip() or f"schtasks exited with {result.returncode}")
+
+
+class SimulatedServiceControl(ServiceControl):
+    # Services and tasks as plain dictionaries. Stop, pause and resume go
+    # through a pending state that is left on the next query, like the SCM.
+    PENDING = {"stopped": "stop_pending", "paused": "pause_pending", "running": "start_pending"}
+
+    def __init__(self, services: Optional[Dict[str, ServiceState]] = None,
+                 tasks: Optional[Dict[str, bool]] = None):
+        self.services = dict(services or {})
+        self.tasks = dict(tasks or {})
+        self.calls = []
+        self._targets = {}
+        self._lock = threading.Lock()
+
+    def _service(self, name: str) -> ServiceState:
+        if name not in self.services:
+            raise OSError(f"The specified service does not exist: {name}")
+        return self.services[name]
+
+    def _transition(self, name: str, call: str, target: str):
+        with self._lock:
+            state = self._service(name)
+            self.calls.append((call, name))
+            self.services[name] = state._replace(status=self.PENDING[target])
+            self._targets[name] = target
+
+    def query(self, name: str) -> Optional[ServiceState]:
+        with self._lock:
+            if name not in self.services:
+                return None
+            state = self.services[name]
+            if name in self._targets:
+                state = self.services[name] = state._replace(status=self._targets.pop(name))
+            return state
+
+    def start(self, name: str):
+        if self._service(name).start_type == "disabled":
+            raise OSError(f"The service cannot be started because it is disabled: {name}")
+        self._transition(name, "start", "running")
+
+    def stop(self, name: str):
+        self._transition(name, "stop", "stopped")
+
+    def pause(self, name: str):
+        if not self._service(name).can_pause:
+            raise OSError(f"The requested control is not valid for this service: {name}")
+        self._transition(name, "pause", "paused")
+
+    def resume(self, name: str):
+        self._transition(name, "resume", "running")
+
+    def set_start_type(self, name: str, start_type: str):
+        with self._lock:
+            self.services[name] = self._service(name)._replace(start_type=start_type)
+            self.calls.append(("start_type", name, start_type))
+
+    def task_enabled(self, path: str) -> Optional[bool]:
+        return self.tasks.get(path)
+
+    def set_task_enabled(self, path: str, enabled: bool):
+        if path not in self.tasks:
+            raise OSError(f"The system cannot find the task: {path}")
+        self.tasks[path] = enabled
+        self.calls.append(("task", path, enabled))
+
+
+class ServiceManager:
+    # Stops, pauses or disables the services and disables the scheduled
+    # tasks a profile lists, recording their original state so switching to
+    # a profile that does not list them restores them exactly
+    def __init__(self, executor: Optional[CommandExecutor] = None, service_control: Optional[ServiceControl] = None):
+        self.executor = executor or get_executor()
+        self.service_control = service_control
+        if service_control is None and self.executor.allow_native and hasattr(ctypes, "windll"):
+            self.service_control = NativeServiceControl(self.executor)
+        self.store = RecordStore(Path.home() / ".battery_saver_services.json", SuspendedService)
+        self.timeout = SERVICE_TIMEOUT
+    
+    def suspended(self) -> List[SuspendedService]:
+        return self.store.load()
+    
+    def _require_control(self) -> ServiceControl:
+        if self.service_control is None:
+            raise NotSupportedError("Service control not supported on this device")
+        return self.service_control
+    
+    def _wait(self, targets: Dict[str, str]) -> Dict[str, str]:
+        # Polls until every service reaches its target status; returns the
+        # ones that did not within the timeout
+        control = self.service_control
+        targets = dict(targets)
+        deadline = time.monotonic() + self.timeout
+        while targets:
+            for name, status in list(targets.items()):
+                try:
+                    state = control.query(name)
+                    if state is None or state.status == status:
+                        del targets[name]
+                except OSError as e:
+                    logger.debug(f"Could not query service {name}: {e}")
+            if not targets or time.monotonic() >= deadline:
+                break
+            time.sleep(0.1)
+        return targets
+    
+    def apply(self, services: Iterable[Tuple[str, str]], tasks: Iterable[str]) -> Tuple[List[str], List[str]]:
+        # Restores what is no longer wanted, then suspends what is newly
+        # listed. In each phase every control request is sent before waiting
+        # on any of them, so services stop or start concurrently. Returns
+        # (changed names, errors).
+        services = dict(services)
+        tasks = list(tasks)
+        records = self.suspended()
+        if not services and not tasks and not records:
+            return [], []
+        control = self._require_control()
+        
+        wanted = {("service", name) for name in services} | {("task", path) for path in tasks}
+        keep = [record for record in records if (record.kind, record.name) in wanted and
+                (record.kind == "task" or record.action == services[record.name])]
+        changed, errors, failed, waits = self._restore([record for record in records if record not in keep])
+        # Restores finish first, a service may be suspended again below
+        for name, status in self._wait(waits).items():
+            errors.append(f"{name}: did not reach {status} within {self.timeout:.0f}s")
+        
+        kept = {(record.kind, record.name) for record in keep}
+        new = []
+        waits = {}
+        for name, action in services.items():
+            if ("service", name) in kept:
+                continue
+            try:
+                state = control.query(name)
+            except OSError as e:
+                errors.append(f"{name}: {e}")
+                continue
+            if state is None:
+                logger.debug(f"Service {name} is not installed")
+                continue
+            if action == "pause" and state.status != "running":
+                continue
+            if action == "pause" and not state.can_pause:
+                errors.append(f"{name}: does not accept pause")
+                continue
+            if state.status == "stopped" and (action == "stop" or state.start_type == "disabled"):
+                continue
+            new.append(SuspendedService("service", name, action, state.status, state.start_type))
+        for path in tasks:
+            if ("task", path) in kept:
+                continue
+            try:
+                enabled = control.task_enabled(path)
+            except OSError as e:
+                errors.append(f"{path}: {e}")
+                continue
+            if enabled is None:
+                logger.debug(f"Scheduled task {path} does not exist")
+            elif enabled:
+                new.append(SuspendedService("task", path, "disable", "enabled"))
+        
+        # Recorded before anything is touched so an interrupted switch can
+        # still be restored
+        self.store.save(failed + keep + new)
+        suspended = []
+        for record in new:
+            # A service disabled but not stopped still needs restoring
+            touched = False
+            try:
+                if record.kind == "task":
+                    control.set_task_enabled(record.name, False)
+                else:
+                    if record.action == "disable" and record.start_type != "disabled":
+                        control.set_start_type(record.name, "disabled")
+                        touched = True
+                    if record.action == "pause":
+                        control.pause(record.name)
+                        waits[record.name] = "paused"
+                    elif record.status != "stopped":
+                        control.stop(record.name)
+                        waits[record.name] = "stopped"
+            except OSError as e:
+                errors.append(f"{record.name}: {e}")
+                if not touched:
+                    continue
+            suspended.append(record)
+            changed.append(record.name)
         
-        return killed
+        for name, status in self._wait(waits).items():
+            errors.append(f"{name}: did not reach {status} within {self.timeout:.0f}s")
+        # Anything that could not be suspended was left as it was
+        self.store.save(failed + keep + suspended)
+        changed = list(dict.fromkeys(changed))
+        if changed:
+            logger.info(f"Changed services and tasks: {', '.join(changed)}")
+        return changed, errors
+    
+    def _restore(self, records: List[SuspendedService]) -> Tuple[List[str], List[str], List[SuspendedService], Dict[str, str]]:
+        # Sends the restore requests; returns (restored names, errors,
+        # records that could not be restored, services to wait on)
+        control = self.service_control
+        restored, errors, failed, waits = [], [], [], {}
+        for record in records:
+            try:
+                if record.kind == "task":
+                    control.set_task_enabled(record.name, True)
+                else:
+                    if record.action == "disable" and record.start_type != "disabled":
+                        control.set_start_type(record.name, record.start_type)
+                    state = control.query(record.name)
+                    status = state.status if state else None
+                    if record.status == "running" and status == "paused":
+                        control.resume(record.name)
+                        waits[record.name] = "running"
+                    elif record.status == "running" and status == "stopped":
+                        control.start(record.name)
+                        waits[record.name] = "running"
+            except OSError as e:
+                logger.warning(f"Could not restore {record.name}: {e}")
+                errors.append(f"{record.name}: {e}")
+                failed.append(record)
+                continue
+            restored.append(record.name)
+        return restored, errors, failed, waits
+    
+    def restore(self) -> Tuple[List[str], List[str]]:
+        return self.apply({}, [])
 
 
-class GPUManager:
+class GPUDevice:
+    # Power-limit control for one GPU; all values are in watts. NVML, the
+    # nvidia-smi fallback and SimulatedGPU implement it, so GPUManager logic
+    # can run without a GPU.
+    backend = None
+
+    def power_limits(self) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        # (min, max, default)
+        raise NotImplementedError
+
+    def get_power_limit(self) -> Optional[float]:
+        raise NotImplementedError
+
+    def power_usage(self) -> Optional[float]:
+        raise NotImplementedError
+
+    def clocks(self) -> Dict[str, int]:
+        raise NotImplementedError
+
+    def set_power_limit(self, watts: float):
+        raise NotImplementedError
+
+
+class NvmlError(OSError):
+    NOT_SUPPORTED = 3
+
+    def __init__(self, code: int, message: str):
+        super().__init__(code, message)
+        self.code = code
+
+
+class NvmlLibrary:
+    # nvml.dll stays loaded and initialised for the life of the process, so
+    # each query is a direct driver call instead of a new nvidia-smi process.
+    PATHS = [
+        "nvml.dll",
+        r"C:\Program Files\NVIDIA Corporation\NVSMI\nvml.dll",
+        "libnvidia-ml.so.1",
+    ]
+    _instance = None
+    _lock = threading.Lock()
+
     def __init__(self):
-        self.nvidia_smi_path = self._find_nvidia_smi()
+        error = None
+        for path in self.PATHS:
+            try:
+                self.dll = ctypes.CDLL(path)
+                break
+            except OSError as e:
+                error = e
+        else:
+            raise error
+        self.dll.nvmlErrorString.restype = ctypes.c_char_p
+        self.check(self.dll.nvmlInit_v2(), "nvmlInit")
+        atexit.register(self.dll.nvmlShutdown)
+
+    @classmethod
+    def get(cls) -> "NvmlLibrary":
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+    def check(self, status: int, call: str):
+        if status != 0:
+            message = self.dll.nvmlErrorString(status).decode("utf-8", "replace")
+            raise NvmlError(status, f"{call}: {message}")
+
+
+class NvmlDevice(GPUDevice):
+    backend = "nvml"
+    CLOCK_TYPES = {"graphics": 0, "sm": 1, "memory": 2}
+
+    def __init__(self, index: int = 0, library: Optional[NvmlLibrary] = None):
+        self.nvml = library or NvmlLibrary.get()
+        self.handle = ctypes.c_void_p()
+        self.nvml.check(self.nvml.dll.nvmlDeviceGetHandleByIndex_v2(index, ctypes.byref(self.handle)),
+                        "nvmlDeviceGetHandleByIndex")
+
+    def _read_milliwatts(self, function: str) -> float:
+        value = ctypes.c_uint()
+        self.nvml.check(getattr(self.nvml.dll, function)(self.handle, ctypes.byref(value)), function)
+        return value.value / 1000
+
+    def power_limits(self) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        minimum, maximum = ctypes.c_uint(), ctypes.c_uint()
+        self.nvml.check(self.nvml.dll.nvmlDeviceGetPowerManagementLimitConstraints(
+            self.handle, ctypes.byref(minimum), ctypes.byref(maximum)), "nvmlDeviceGetPowerManagementLimitConstraints")
+        default = self._read_milliwatts("nvmlDeviceGetPowerManagementDefaultLimit")
+        return minimum.value / 1000, maximum.value / 1000, default
+
+    def get_power_limit(self) -> Optional[float]:
+        return self._read_milliwatts("nvmlDeviceGetPowerManagementLimit")
+
+    def power_usage(self) -> Optional[float]:
+        return self._read_milliwatts("nvmlDeviceGetPowerUsage")
+
+    def clocks(self) -> Dict[str, int]:
+        clocks = {}
+        for name, clock_type in self.CLOCK_TYPES.items():
+            value = ctypes.c_uint()
+            if self.nvml.dll.nvmlDeviceGetClockInfo(self.handle, clock_type, ctypes.byref(value)) == 0:
+                clocks[name] = value.value
+        return clocks
+
+    def set_power_limit(self, watts: float):
+        self.nvml.check(self.nvml.dll.nvmlDeviceSetPowerManagementLimit(self.handle, int(watts * 1000)),
+                        "nvmlDeviceSetPowerManagementLimit")
+
+
+class NvidiaSmiDevice(GPUDevice):
+    backend = "nvidia-smi"
+
+    def __init__(self, path: str, executor: Optional[CommandExecutor] = None):
+        self.path = path
+        self.executor = executor or get_executor()
+
+    def _query(self, fields: str) -> List[Optional[float]]:
+        result = self.executor.run([self.path, f"--query-gpu={fields}", "--format=csv,noheader,nounits"])
+        result.check_returncode()
+        values = []
+        for value in result.stdout.strip().split('\n')[0].split(', '):
+            try:
+                values.append(float(value))
+            except ValueError:
+                # [N/A] or [Not Supported]
+                values.append(None)
+        return values
+
+    def power_limits(self) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        values = self._query("power.min_limit,power.max_limit,power.default_limit") + [None] * 3
+        return values[0], values[1], values[2]
+
+    def get_power_limit(self) -> Optional[float]:
+        return self._query("power.limit")[0]
+
+    def power_usage(self) -> Optional[float]:
+        return self._query("power.draw")[0]
+
+    def clocks(self) -> Dict[str, int]:
+        values = self._query("clocks.gr,clocks.sm,clocks.mem")
+        return {name: int(value) for name, value in zip(("graphics", "sm", "memory"), values) if value is not None}
+
+    def set_power_limit(self, watts: float):
+        result = self.executor.run([self.path, "-pl", str(int(watts))])
+        output = (result.stdout + result.stderr).strip()
+        if "not supported" in output.lower():
+            raise NvmlError(NvmlError.NOT_SUPPORTED, "GPU power limiting not supported on this device")
+        if result.returncode != 0:
+            raise RuntimeError(f"nvidia-smi -pl failed: {result.stderr.strip()}")
+
+
+class SimulatedGPU(GPUDevice):
+    # A GPU model for tests and benchmarks: power draw follows the load up
+    # to the current limit and the graphics clock scales with that draw.
+    backend = "simulated"
+
+    def __init__(self, min_limit: float = 5.0, max_limit: float = 115.0, default_limit: float = 80.0,
+                 load_watts: float = 90.0, max_clock: int = 2505):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.default_limit = default_limit
+        self.limit = default_limit
+        self.load_watts = load_watts
+        self.max_clock = max_clock
+        self.set_calls = 0
+
+    def power_limits(self) -> Tuple[Optional[float], Optional[float], Optional[float]]:
+        return self.min_limit, self.max_limit, self.default_limit
+
+    def get_power_limit(self) -> Optional[float]:
+        return self.limit
+
+    def power_usage(self) -> Optional[float]:
+        return min(self.limit, self.load_watts)
+
+    def clocks(self) -> Dict[str, int]:
+        share = self.power_usage() / self.max_limit
+        return {"graphics": int(self.max_clock * share ** 0.5), "memory": 8001}
+
+    def set_power_limit(self, watts: float):
+        if not self.min_limit <= watts <= self.max_limit:
+            raise ValueError(f"{watts}W is outside {self.min_limit}-{self.max_limit}W")
+        self.limit = float(watts)
+        self.set_calls += 1
+
+
+class GPUManager:
+    def __init__(self, executor: Optional[CommandExecutor] = None, capabilities: Optional[Dict] = None,
+                 device: Optional[GPUDevice] = None):
+        self.executor = executor or get_executor()
+        self.device = device
+        self.nvidia_smi_path = None
         self.min_power_limit = None
         self.max_power_limit = None
         self.default_power_limit = None
-        if self.nvidia_smi_path:
+        if device is not None:
             self._get_power_limits()
+        elif capabilities is not None:
+            self.nvidia_smi_path = capabilities["nvidia_smi_path"]
+            self.min_power_limit = capabilities["min_power_limit"]
+            self.max_power_limit = capabilities["max_power_limit"]
+            self.default_power_limit = capabilities["default_power_limit"]
+            self.device = self._open_device(capabilities["backend"])
+        else:
+            self.device = self._open_device()
+            if self.device:
+                self._get_power_limits()
+    
+    def get_capabilities(self) -> Dict:
+        return {
+            "backend": self.device.backend if self.device else None,
+            "nvidia_smi_path": self.nvidia_smi_path,
+            "min_power_limit": self.min_power_limit,
+            "max_power_limit": self.max_power_limit,
+            "default_power_limit": self.default_power_limit,
+        }
+    
+    def _open_device(self, backend: Optional[str] = "nvml") -> Optional[GPUDevice]:
+        # NVML first; nvidia-smi only when the library cannot be loaded
+        if backend == "nvml" and self.executor.allow_native:
+            try:
+                return NvmlDevice()
+            except OSError as e:
+                logger.info(f"NVML not available, falling back to nvidia-smi: {e}")
+        if backend is None:
+            return None
+        if not self.nvidia_smi_path:
+            self.nvidia_smi_path = self._find_nvidia_smi()
+        return NvidiaSmiDevice(self.nvidia_smi_path, self.executor) if self.nvidia_smi_path else None
     
     def _find_nvidia_smi(self) -> Optional[str]:
         common_paths = [
@@ -239,176 +2637,2595 @@ class GPUManager:
         ]
         
         for path in common_paths:
-            if os.path.exists(path):
+            if self.executor.exists(path):
                 return path
         
         try:
-            result = subprocess.run(["where", "nvidia-smi"], capture_output=True, text=True)
+            result = self.executor.run(["where", "nvidia-smi"])
             if result.returncode == 0:
                 return result.stdout.strip().split('\n')[0]
         except:
             pass
         
-        logger.warning("nvidia-smi not found. GPU power management will be limited.")
-        return None
-    
-    def _get_power_limits(self):
-        try:
-            result = subprocess.run([
-                self.nvidia_smi_path,
-                "--query-gpu=power.min_limit,power.max_limit,power.default_limit,power.limit",
-                "--format=csv,noheader,nounits"
-            ], capture_output=True, text=True, check=True)
-            
-            values = result.stdout.strip().split(', ')
-            if len(values) >= 3:
-                try:
-                    if values[0] != '[N/A]':
-                        self.min_power_limit = float(values[0])
-                    if values[1] != '[N/A]':
-                        self.max_power_limit = float(values[1])
-                    if values[2] != '[N/A]':
-                        self.default_power_limit = float(values[2])
-                    if len(values) >= 4 and values[3] != '[N/A]':
-                        current_limit = float(values[3])
-                        logger.info(f"GPU Power Limits - Min: {self.min_power_limit}W, Max: {self.max_power_limit}W, Default: {self.default_power_limit}W, Current: {current_limit}W")
-                    elif self.min_power_limit or self.max_power_limit:
-                        logger.info(f"GPU Power Limits - Min: {self.min_power_limit}W, Max: {self.max_power_limit}W, Default: {self.default_power_limit}W")
-                except ValueError:
-                    pass
-        except Exception as e:
-            logger.warning(f"Could not query GPU power limits: {e}")
+        logger.warning("nvidia-smi not found. GPU power management will be limited.")
+        return None
+    
+    def _get_power_limits(self):
+        try:
+            self.min_power_limit, self.max_power_limit, self.default_power_limit = self.device.power_limits()
+            if self.min_power_limit or self.max_power_limit:
+                logger.info(f"GPU Power Limits ({self.device.backend}) - Min: {self.min_power_limit}W, Max: {self.max_power_limit}W, Default: {self.default_power_limit}W")
+        except Exception as e:
+            logger.warning(f"Could not query GPU power limits: {e}")
+        
+        if not self.min_power_limit:
+            logger.info("GPU power limiting not supported on this device")
+            self.min_power_limit = None
+            self.max_power_limit = None
+            self.default_power_limit = None
+    
+    def get_power_limit(self) -> Optional[float]:
+        if not self.device:
+            return None
+        try:
+            return self.device.get_power_limit()
+        except Exception as e:
+            logger.debug(f"Could not read GPU power limit: {e}")
+            return None
+    
+    def power_usage(self) -> Optional[float]:
+        if not self.device:
+            return None
+        try:
+            return self.device.power_usage()
+        except Exception as e:
+            logger.debug(f"Could not read GPU power draw: {e}")
+            return None
+    
+    def clocks(self) -> Dict[str, int]:
+        if not self.device:
+            return {}
+        try:
+            return self.device.clocks()
+        except Exception as e:
+            logger.debug(f"Could not read GPU clocks: {e}")
+            return {}
+    
+    def limits(self) -> Optional[Tuple[float, float, Optional[float]]]:
+        # (min, max, default) in watts, or None when limiting is unsupported
+        if not self.min_power_limit and not self.max_power_limit:
+            return None
+        return (self.min_power_limit or 0.0, self.max_power_limit or self.min_power_limit, self.default_power_limit)
+    
+    def set_power_mode(self, power_limit: Optional[float]):
+        # Only a device without power limiting is tolerated; any other
+        # failure propagates so the profile step fails
+        if not self.device or power_limit is None or self.limits() is None:
+            raise NotSupportedError("GPU power limiting not supported on this device")
+        
+        try:
+            self.device.set_power_limit(int(power_limit))
+        except NvmlError as e:
+            if e.code == NvmlError.NOT_SUPPORTED:
+                raise NotSupportedError("GPU power limiting not supported on this device") from e
+            raise
+        logger.info(f"Set GPU power limit to {power_limit}W")
+    
+    def set_power_limit(self, watts: float):
+        if not self.device:
+            raise RuntimeError("No GPU power control available")
+        self.device.set_power_limit(int(watts))
+        logger.info(f"Set GPU power limit to {int(watts)}W")
+
+
+class TuneSample(NamedTuple):
+    limit: float
+    # Mean GPU draw and work units per second at this limit
+    watts: float
+    throughput: float
+    # Work per watt of GPU draw plus the rest of the system's draw
+    efficiency: float
+
+
+# Assumed draw of everything but the GPU while tuning. Without it the most
+# efficient GPU limit would always be the minimum; with it, the optimum is
+# the knee where extra GPU watts stop paying for themselves.
+TUNE_SYSTEM_WATTS = 15.0
+
+
+def find_power_knee(measure: Callable[[float], TuneSample], low: float, high: float,
+                    grid_points: int = 5, tolerance: float = 2.0) -> Tuple[TuneSample, List[TuneSample]]:
+    # A coarse grid over [low, high] brackets the most efficient limit, then
+    # a golden-section search narrows the bracket to `tolerance` watts.
+    # Limits are whole watts and each is measured once. Returns the most
+    # efficient sample (the lowest limit on a tie) and every sample in the
+    # order it was measured.
+    if high < low:
+        raise ValueError("high must not be below low")
+    if tolerance <= 0 or grid_points < 2:
+        raise ValueError("tolerance must be positive and grid_points at least 2")
+    cache: Dict[int, TuneSample] = {}
+    measured = []
+    
+    def sample(limit: float) -> TuneSample:
+        watts = int(round(max(low, min(high, limit))))
+        if watts not in cache:
+            cache[watts] = measure(watts)
+            measured.append(cache[watts])
+        return cache[watts]
+    
+    points = sorted({int(round(low + (high - low) * i / (grid_points - 1))) for i in range(grid_points)})
+    best = max(range(len(points)), key=lambda i: (sample(points[i]).efficiency, -points[i]))
+    a, b = points[max(0, best - 1)], points[min(len(points) - 1, best + 1)]
+    
+    ratio = (5 ** 0.5 - 1) / 2
+    while b - a > tolerance:
+        c, d = b - ratio * (b - a), a + ratio * (b - a)
+        if sample(c).efficiency >= sample(d).efficiency:
+            b = d
+        else:
+            a = c
+    return max(measured, key=lambda s: (s.efficiency, -s.limit)), measured
+
+
+class Throughput:
+    # Cumulative work done by the tuning workload, in whatever unit it
+    # reports (frames, iterations, ...)
+    def units(self) -> float:
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ClockThroughput(Throughput):
+    # The graphics clock integrated over time (MHz x s), a stand-in for work
+    # done when the workload cannot report its own progress. With
+    # SimulatedGPU this makes the tuner testable without hardware.
+    def __init__(self, gpu_manager: "GPUManager"):
+        self.gpu_manager = gpu_manager
+        self._total = 0.0
+        self._last = time.perf_counter()
+
+    def units(self) -> float:
+        now = time.perf_counter()
+        self._total += self.gpu_manager.clocks().get("graphics", 0) * (now - self._last)
+        self._last = now
+        return self._total
+
+
+class CommandWorkload(Throughput):
+    # Runs the user's workload for the length of the tuning. Every line it
+    # prints is one unit of work, or that many units if the line is a number.
+    def __init__(self, args: List[str]):
+        self.args = args
+        self.process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                        stdin=subprocess.DEVNULL, text=True, bufsize=1)
+        self._units = 0.0
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read, name="tune-workload", daemon=True)
+        self._reader.start()
+
+    def _read(self):
+        for line in self.process.stdout:
+            try:
+                value = float(line.strip())
+            except ValueError:
+                value = 1.0
+            with self._lock:
+                self._units += value
+
+    def units(self) -> float:
+        if self.process.poll() is not None:
+            raise RuntimeError(f"Workload exited with {self.process.returncode} before tuning finished")
+        with self._lock:
+            return self._units
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+class GPUTuner:
+    # Measures draw and throughput at each candidate GPU power limit while a
+    # workload runs and finds the most efficient one. The original limit is
+    # restored afterwards.
+    def __init__(self, gpu_manager: "GPUManager", throughput: Throughput,
+                 system_watts: float = TUNE_SYSTEM_WATTS, settle: float = 3.0, duration: float = 10.0,
+                 sample_interval: float = 0.5):
+        self.gpu_manager = gpu_manager
+        self.throughput = throughput
+        self.system_watts = system_watts
+        # Seconds to let clocks settle after a limit change, then seconds
+        # to measure for
+        self.settle = settle
+        self.duration = duration
+        self.sample_interval = sample_interval
+
+    def measure(self, limit: float) -> TuneSample:
+        self.gpu_manager.set_power_limit(limit)
+        time.sleep(self.settle)
+        start_units = self.throughput.units()
+        start = time.perf_counter()
+        draws = []
+        while True:
+            draw = self.gpu_manager.power_usage()
+            if draw is not None:
+                draws.append(draw)
+            units = self.throughput.units()
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.duration:
+                break
+            time.sleep(min(self.sample_interval, self.duration - elapsed))
+        watts = sum(draws) / len(draws) if draws else float(limit)
+        rate = (units - start_units) / elapsed if elapsed > 0 else 0.0
+        sample = TuneSample(float(limit), watts, rate, rate / (watts + self.system_watts))
+        logger.info(f"GPU limit {limit:.0f}W: {watts:.1f}W drawn, {rate:.1f} units/s, {sample.efficiency:.3f} per W")
+        return sample
+
+    def tune(self, grid_points: int = 5, tolerance: float = 2.0) -> Tuple[TuneSample, List[TuneSample]]:
+        limits = self.gpu_manager.limits()
+        if limits is None:
+            raise RuntimeError("GPU power limiting not supported on this device")
+        original = self.gpu_manager.get_power_limit()
+        try:
+            best, samples = find_power_knee(self.measure, limits[0], limits[1], grid_points, tolerance)
+        finally:
+            if original is not None:
+                self.gpu_manager.set_power_limit(original)
+        if not any(sample.throughput for sample in samples):
+            raise RuntimeError("The workload reported no progress")
+        logger.info(f"Most efficient GPU power limit: {best.limit:.0f}W")
+        return best, samples
+
+
+# RyzenAdj limit names; power limits are in watts, tctl_temp in °C
+CPU_LIMITS = ("stapm_limit", "fast_limit", "slow_limit", "tctl_temp")
+CPU_POWER_RANGE = (5.0, 120.0)
+CPU_TEMP_RANGE = (60.0, 100.0)
+
+
+class RyzenAdjDevice:
+    # SMU limit control for one AMD APU. The libryzenadj binding, the
+    # ryzenadj CLI and SimulatedRyzenAdj implement it, so CPUManager logic
+    # can run without the hardware.
+    backend = None
+
+    def read_limits(self) -> Dict[str, Optional[float]]:
+        raise NotImplementedError
+
+    def set_limits(self, limits: Dict[str, float]):
+        raise NotImplementedError
+
+
+class RyzenAdjLibrary(RyzenAdjDevice):
+    # libryzenadj stays loaded with one SMU handle for the life of the
+    # process; reads need refresh_table() to update the PM table first.
+    backend = "library"
+    PATHS = ["libryzenadj.dll", r"C:\Program Files\RyzenAdj\libryzenadj.dll", "libryzenadj.so"]
+
+    def __init__(self):
+        error = None
+        for path in self.PATHS:
+            try:
+                self.dll = ctypes.CDLL(path)
+                break
+            except OSError as e:
+                error = e
+        else:
+            raise error
+        self.dll.init_ryzenadj.restype = ctypes.c_void_p
+        self.dll.cleanup_ryzenadj.argtypes = [ctypes.c_void_p]
+        self.dll.refresh_table.argtypes = [ctypes.c_void_p]
+        for name in CPU_LIMITS:
+            getter = getattr(self.dll, f"get_{name}")
+            getter.argtypes = [ctypes.c_void_p]
+            getter.restype = ctypes.c_float
+            getattr(self.dll, f"set_{name}").argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+        self.handle = self.dll.init_ryzenadj()
+        if not self.handle:
+            raise OSError("init_ryzenadj failed (unsupported CPU or missing driver access)")
+        atexit.register(self.dll.cleanup_ryzenadj, self.handle)
+
+    def read_limits(self) -> Dict[str, Optional[float]]:
+        if self.dll.refresh_table(self.handle) != 0:
+            raise OSError("refresh_table failed")
+        limits = {}
+        for name in CPU_LIMITS:
+            value = getattr(self.dll, f"get_{name}")(self.handle)
+            # NaN when the PM table has no such field
+            limits[name] = None if value != value else round(value, 3)
+        return limits
+
+    def set_limits(self, limits: Dict[str, float]):
+        for name, value in limits.items():
+            raw = int(value) if name == "tctl_temp" else int(value * 1000)
+            status = getattr(self.dll, f"set_{name}")(self.handle, raw)
+            if status != 0:
+                raise OSError(f"set_{name} failed with status {status}")
+
+
+class RyzenAdjCLI(RyzenAdjDevice):
+    backend = "cli"
+
+    def __init__(self, path: str, executor: Optional[CommandExecutor] = None):
+        self.path = path
+        self.executor = executor or get_executor()
+
+    @staticmethod
+    def parse_info(output: str) -> Dict[str, Optional[float]]:
+        # `ryzenadj --info` prints a table of | Name | Value | Parameter |
+        limits = dict.fromkeys(CPU_LIMITS)
+        for line in output.splitlines():
+            cells = [cell.strip() for cell in line.strip().strip('|').split('|')]
+            if len(cells) == 3 and cells[2].replace('-', '_') in limits:
+                try:
+                    limits[cells[2].replace('-', '_')] = float(cells[1])
+                except ValueError:
+                    pass
+        return limits
+
+    def read_limits(self) -> Dict[str, Optional[float]]:
+        result = self.executor.run([self.path, "--info"])
+        result.check_returncode()
+        return self.parse_info(result.stdout)
+
+    def set_limits(self, limits: Dict[str, float]):
+        # Every limit in one invocation
+        args = [self.path]
+        for name, value in limits.items():
+            raw = int(value) if name == "tctl_temp" else int(value * 1000)
+            args.append(f"--{name.replace('_', '-')}={raw}")
+        result = self.executor.run(args)
+        if result.returncode != 0:
+            raise RuntimeError(f"ryzenadj failed: {(result.stderr or result.stdout).strip()}")
+
+
+class SimulatedRyzenAdj(RyzenAdjDevice):
+    # Stock limits of a Ryzen AI 9 HX 370 laptop; counts set_limits calls
+    backend = "simulated"
+
+    def __init__(self, stapm_limit: float = 28.0, fast_limit: float = 54.0, slow_limit: float = 35.0,
+                 tctl_temp: float = 100.0):
+        self.limits = {"stapm_limit": stapm_limit, "fast_limit": fast_limit,
+                       "slow_limit": slow_limit, "tctl_temp": tctl_temp}
+        self.set_calls = []
+
+    def read_limits(self) -> Dict[str, Optional[float]]:
+        return dict(self.limits)
+
+    def set_limits(self, limits: Dict[str, float]):
+        self.limits.update({name: float(value) for name, value in limits.items()})
+        self.set_calls.append(dict(limits))
+
+
+class CPUManager:
+    # Stock limits are read once and cached with the other capabilities;
+    # "default" in a profile refers to them.
+    def __init__(self, executor: Optional[CommandExecutor] = None, capabilities: Optional[Dict] = None,
+                 device: Optional[RyzenAdjDevice] = None):
+        self.executor = executor or get_executor()
+        self.device = device
+        self.ryzenadj_path = None
+        self.stock_limits: Dict[str, Optional[float]] = {}
+        if device is not None:
+            self._read_stock_limits()
+        elif capabilities is not None:
+            self.ryzenadj_path = capabilities["ryzenadj_path"]
+            self.stock_limits = dict(capabilities["stock_limits"])
+            # The cold probe already looked for the CLI; a cached None means
+            # it is not installed
+            self.device = self._open_device(capabilities["backend"], search=False)
+        else:
+            self.device = self._open_device()
+            if self.device:
+                self._read_stock_limits()
+    
+    def get_capabilities(self) -> Dict:
+        return {
+            "backend": self.device.backend if self.device else None,
+            "ryzenadj_path": self.ryzenadj_path,
+            "stock_limits": dict(self.stock_limits),
+        }
+    
+    def _open_device(self, backend: Optional[str] = "library", search: bool = True) -> Optional[RyzenAdjDevice]:
+        # The CLI path is looked up even when the library loads, so the
+        # batched profile script can call it
+        if backend is not None and search and not self.ryzenadj_path:
+            self.ryzenadj_path = self._find_ryzenadj()
+        if backend == "library" and self.executor.allow_native:
+            try:
+                return RyzenAdjLibrary()
+            except (OSError, AttributeError) as e:
+                logger.info(f"libryzenadj not available, falling back to the ryzenadj CLI: {e}")
+        if backend is None:
+            return None
+        return RyzenAdjCLI(self.ryzenadj_path, self.executor) if self.ryzenadj_path else None
+    
+    def _find_ryzenadj(self) -> Optional[str]:
+        for path in (r"C:\Program Files\RyzenAdj\ryzenadj.exe", r"C:\Tools\RyzenAdj\ryzenadj.exe"):
+            if self.executor.exists(path):
+                return path
+        try:
+            result = self.executor.run(["where", "ryzenadj"])
+            if result.returncode == 0:
+                return result.stdout.strip().split('\n')[0]
+        except (subprocess.SubprocessError, OSError):
+            pass
+        logger.info("RyzenAdj not found. CPU power limiting is unavailable.")
+        return None
+    
+    def _read_stock_limits(self):
+        try:
+            self.stock_limits = self.device.read_limits()
+            logger.info(f"CPU limits ({self.device.backend}): " + ", ".join(
+                f"{name}={value}" for name, value in self.stock_limits.items()))
+        except Exception as e:
+            logger.warning(f"Could not read CPU limits: {e}")
+            self.device = None
+            self.stock_limits = {}
+    
+    @property
+    def supported(self) -> bool:
+        return self.device is not None and any(value is not None for value in self.stock_limits.values())
+    
+    def get_limits(self) -> Dict[str, Optional[float]]:
+        if not self.device:
+            return {}
+        try:
+            return self.device.read_limits()
+        except Exception as e:
+            logger.debug(f"Could not read CPU limits: {e}")
+            return {}
+    
+    def set_limits(self, targets: Dict[str, float], force: bool = False,
+                   current: Optional[Dict[str, Optional[float]]] = None) -> List[str]:
+        # Writes only the limits that differ from what the SMU reports (or
+        # from `current`, when the caller has just read them) and returns
+        # their names
+        if not self.supported:
+            raise NotSupportedError("CPU power limiting not supported on this device")
+        if force:
+            current = {}
+        elif current is None:
+            current = self.get_limits()
+        changed = {
+            name: value for name, value in targets.items()
+            if current.get(name) is None or abs(current[name] - value) >= 0.5
+        }
+        if changed:
+            self.device.set_limits(changed)
+            logger.info("Set CPU limits: " + ", ".join(f"{name}={value}" for name, value in changed.items()))
+        return list(changed)
+
+
+STEP_TIMEOUT = 30.0
+STEP_WORKERS = 4
+
+# Returned by a step function when the hardware is already in the target state
+SKIPPED = "skipped"
+
+
+_com_state = threading.local()
+
+
+def run_with_com(func: Callable):
+    # WMI calls need COM initialised on the calling thread. It is left
+    # initialised afterwards so per-thread WMI connections cached by the
+    # managers stay valid on long-lived worker threads.
+    if not getattr(_com_state, "initialized", False):
+        try:
+            import pythoncom
+        except ImportError:
+            return func()
+        pythoncom.CoInitialize()
+        _com_state.initialized = True
+    return func()
+
+
+class ProfileStep:
+    def __init__(self, name: str, func: Callable[[], Optional[str]], depends_on: Iterable[str] = (),
+                 timeout: Optional[float] = STEP_TIMEOUT, needs_com: bool = False):
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+        self.timeout = timeout
+        self.needs_com = needs_com
+
+
+class SwitchCancelled(Exception):
+    pass
+
+
+class NotSupportedError(Exception):
+    # The hardware lacks the feature. The step is reported but does not
+    # fail the apply.
+    pass
+
+
+class StepResult:
+    def __init__(self, name: str, success: Optional[str] = None, error: Optional[BaseException] = None,
+                 elapsed: float = 0.0, skipped: bool = False, unsupported: bool = False):
+        self.name = name
+        self.success = success
+        self.error = error
+        self.elapsed = elapsed
+        self.skipped = skipped
+        self.unsupported = unsupported
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class StepRunner:
+    # Runs profile steps on a bounded thread pool. A step starts as soon as all
+    # of its dependencies have succeeded; a step whose dependency failed is not
+    # run. A step that overruns its timeout is reported as failed, although its
+    # worker thread is left to finish in the background.
+    def __init__(self, max_workers: int = STEP_WORKERS):
+        self.max_workers = max_workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="profile-step")
+            return self._pool
+
+    @staticmethod
+    def _execute(step: ProfileStep, metric: Optional[str], cancel: Optional[threading.Event] = None) -> StepResult:
+        # A step still queued for a worker when `cancel` is set never starts
+        if cancel is not None and cancel.is_set():
+            return StepResult(step.name, error=SwitchCancelled("cancelled"))
+        start = time.perf_counter()
+        try:
+            success = run_with_com(step.func) if step.needs_com else step.func()
+            if success is SKIPPED:
+                result = StepResult(step.name, elapsed=time.perf_counter() - start, skipped=True)
+            else:
+                result = StepResult(step.name, success=success, elapsed=time.perf_counter() - start)
+        except NotSupportedError as e:
+            result = StepResult(step.name, error=e, elapsed=time.perf_counter() - start, unsupported=True)
+        except Exception as e:
+            result = StepResult(step.name, error=e, elapsed=time.perf_counter() - start)
+        if metric:
+            outcome = "skipped" if result.skipped else "ok" if result.ok else "error"
+            metrics.observe(metric, result.elapsed, step=step.name, outcome=outcome)
+        return result
+
+    def run(self, steps: List[ProfileStep], metric: Optional[str] = "battery_saver_step_seconds",
+            cancel: Optional[threading.Event] = None,
+            on_result: Optional[Callable[[StepResult], None]] = None) -> Dict[str, StepResult]:
+        # Each executed step is timed into the `metric` histogram. Once
+        # `cancel` is set no further steps start; running ones finish.
+        from concurrent.futures import FIRST_COMPLETED, wait
+        names = {step.name for step in steps}
+        for step in steps:
+            unknown = set(step.depends_on) - names
+            if unknown:
+                raise ValueError(f"Step {step.name} depends on unknown steps: {', '.join(sorted(unknown))}")
+
+        pool = self._get_pool()
+        pending = list(steps)
+        running = {}
+        results = {}
+
+        def finish(result: StepResult):
+            results[result.name] = result
+            if on_result:
+                on_result(result)
+
+        while pending or running:
+            for step in list(pending):
+                if cancel is not None and cancel.is_set():
+                    pending.remove(step)
+                    finish(StepResult(step.name, error=SwitchCancelled("cancelled")))
+                    continue
+                if not all(dep in results for dep in step.depends_on):
+                    continue
+                pending.remove(step)
+                failed = [dep for dep in step.depends_on if not results[dep].ok]
+                if failed:
+                    finish(StepResult(step.name, error=RuntimeError(f"skipped because {', '.join(failed)} failed")))
+                    continue
+                deadline = time.monotonic() + step.timeout if step.timeout else None
+                running[pool.submit(self._execute, step, metric, cancel)] = (step, deadline)
+
+            if not running:
+                if pending:
+                    for step in pending:
+                        finish(StepResult(step.name, error=RuntimeError("dependency cycle")))
+                    pending = []
+                continue
+
+            deadlines = [deadline for _, deadline in running.values() if deadline is not None]
+            timeout = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, _ = running.pop(future)
+                finish(future.result())
+
+            now = time.monotonic()
+            for future, (step, deadline) in list(running.items()):
+                if deadline is not None and now >= deadline:
+                    del running[future]
+                    future.cancel()
+                    finish(StepResult(step.name, error=TimeoutError(f"timed out after {step.timeout:g}s"),
+                                      elapsed=step.timeout))
+                    logger.warning(f"Profile step {step.name} timed out after {step.timeout:g}s")
+
+        return results
+
+    def submit(self, steps: List[ProfileStep]):
+        # run() in the background; returns a Future of its results. The
+        # coordinator gets its own thread: queued on the pool, it could wait
+        # forever behind workers still held by timed-out steps.
+        from concurrent.futures import Future
+        future = Future()
+        
+        def coordinate():
+            try:
+                future.set_result(self.run(steps))
+            except BaseException as e:
+                future.set_exception(e)
+        
+        threading.Thread(target=coordinate, name="profile-steps", daemon=True).start()
+        return future
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+
+TELEMETRY_INTERVAL = 1.0
+TELEMETRY_CAPACITY = 7 * 24 * 3600
+
+
+class TelemetrySample(NamedTuple):
+    time: float
+    battery_percent: Optional[int]
+    on_ac: Optional[bool]
+    discharge_watts: Optional[float]
+    gpu_watts: Optional[float]
+    cpu_load: Optional[int]
+    profile: Optional[str]
+
+
+class TelemetryBuffer:
+    # Fixed-size ring buffer with one typed array per field, about 12 bytes
+    # per sample (a week of 1 Hz samples is roughly 7 MB). Times are stored
+    # as centiseconds since the buffer was created, watts as centiwatts, and
+    # the all-ones value of each column marks a missing reading.
+    COLUMNS = (
+        ("time", "I"),
+        ("battery_percent", "B"),
+        ("on_ac", "B"),
+        ("discharge_watts", "H"),
+        ("gpu_watts", "H"),
+        ("cpu_load", "B"),
+        ("profile", "B"),
+    )
+    MISSING = {"B": 0xFF, "H": 0xFFFF, "I": 0xFFFFFFFF}
+
+    def __init__(self, capacity: int = TELEMETRY_CAPACITY, start: Optional[float] = None):
+        self.capacity = capacity
+        self.start = time.time() if start is None else start
+        self._columns = {name: array(code, [0]) * capacity for name, code in self.COLUMNS}
+        self._profiles: List[str] = []
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.itemsize * len(column) for column in self._columns.values())
+
+    def _encode(self, code: str, value, scale: float = 1) -> int:
+        if value is None:
+            return self.MISSING[code]
+        return max(0, min(self.MISSING[code] - 1, round(value * scale)))
+
+    def _decode(self, code: str, value: int, scale: float = 1):
+        return None if value == self.MISSING[code] else value / scale
+
+    def append(self, sample: TelemetrySample):
+        with self._lock:
+            if sample.profile is None:
+                profile = self.MISSING["B"]
+            elif sample.profile in self._profiles:
+                profile = self._profiles.index(sample.profile)
+            else:
+                self._profiles.append(sample.profile)
+                profile = len(self._profiles) - 1
+            i = self._next
+            columns = self._columns
+            columns["time"][i] = self._encode("I", sample.time - self.start, 100)
+            columns["battery_percent"][i] = self._encode("B", sample.battery_percent)
+            columns["on_ac"][i] = self._encode("B", None if sample.on_ac is None else int(sample.on_ac))
+            columns["discharge_watts"][i] = self._encode("H", sample.discharge_watts, 100)
+            columns["gpu_watts"][i] = self._encode("H", sample.gpu_watts, 100)
+            columns["cpu_load"][i] = self._encode("B", sample.cpu_load)
+            columns["profile"][i] = profile
+            self._next = (i + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def _row(self, i: int) -> TelemetrySample:
+        columns = self._columns
+        on_ac = self._decode("B", columns["on_ac"][i])
+        battery = self._decode("B", columns["battery_percent"][i])
+        cpu = self._decode("B", columns["cpu_load"][i])
+        profile = columns["profile"][i]
+        return TelemetrySample(
+            self.start + columns["time"][i] / 100,
+            None if battery is None else int(battery),
+            None if on_ac is None else bool(on_ac),
+            self._decode("H", columns["discharge_watts"][i], 100),
+            self._decode("H", columns["gpu_watts"][i], 100),
+            None if cpu is None else int(cpu),
+            None if profile == self.MISSING["B"] else self._profiles[profile],
+        )
+
+    def samples(self, since: Optional[float] = None) -> List[TelemetrySample]:
+        with self._lock:
+            oldest = (self._next - self._count) % self.capacity
+            first = 0
+            if since is not None:
+                # Times increase along the ring, so binary search the window start
+                target = (since - self.start) * 100
+                low, high = 0, self._count
+                while low < high:
+                    middle = (low + high) // 2
+                    if self._columns["time"][(oldest + middle) % self.capacity] < target:
+                        low = middle + 1
+                    else:
+                        high = middle
+                first = low
+            return [self._row((oldest + i) % self.capacity) for i in range(first, self._count)]
+
+
+class TelemetrySource:
+    def read(self) -> TelemetrySample:
+        raise NotImplementedError
+
+
+class SYSTEM_BATTERY_STATE(ctypes.Structure):
+    _fields_ = [
+        ("AcOnLine", ctypes.c_ubyte),
+        ("BatteryPresent", ctypes.c_ubyte),
+        ("Charging", ctypes.c_ubyte),
+        ("Discharging", ctypes.c_ubyte),
+        ("Spare1", ctypes.c_ubyte * 3),
+        ("Tag", ctypes.c_ubyte),
+        ("MaxCapacity", ctypes.c_ulong),
+        ("RemainingCapacity", ctypes.c_ulong),
+        ("Rate", ctypes.c_long),
+        ("EstimatedTime", ctypes.c_ulong),
+        ("DefaultAlert1", ctypes.c_ulong),
+        ("DefaultAlert2", ctypes.c_ulong),
+    ]
+
+
+class WindowsTelemetrySource(TelemetrySource):
+    # Battery state from CallNtPowerInformation and CPU load from
+    # GetSystemTimes, both plain ctypes calls. GPU draw is only read when NVML
+    # is available, since the nvidia-smi fallback would spawn a process per
+    # sample.
+    SYSTEM_BATTERY_STATE = 5
+
+    def __init__(self, gpu_manager: Optional[GPUManager] = None):
+        self.gpu_manager = gpu_manager
+        self._last_times = None
+
+    def _battery(self) -> Tuple[Optional[int], Optional[bool], Optional[float]]:
+        state = SYSTEM_BATTERY_STATE()
+        status = ctypes.windll.powrprof.CallNtPowerInformation(
+            self.SYSTEM_BATTERY_STATE, None, 0, ctypes.byref(state), ctypes.sizeof(state))
+        if status != 0 or not state.BatteryPresent:
+            return None, None, None
+        percent = round(state.RemainingCapacity * 100 / state.MaxCapacity) if state.MaxCapacity else None
+        # Rate is in mW and negative while discharging
+        discharge = max(0, -state.Rate) / 1000
+        return percent, bool(state.AcOnLine), discharge
+
+    def _cpu_load(self) -> Optional[int]:
+        idle, kernel, user = ctypes.c_ulonglong(), ctypes.c_ulonglong(), ctypes.c_ulonglong()
+        if not ctypes.windll.kernel32.GetSystemTimes(ctypes.byref(idle), ctypes.byref(kernel), ctypes.byref(user)):
+            return None
+        times = (idle.value, kernel.value + user.value)
+        previous, self._last_times = self._last_times, times
+        if previous is None or times[1] == previous[1]:
+            return None
+        # Kernel time includes idle time
+        busy = 1 - (times[0] - previous[0]) / (times[1] - previous[1])
+        return round(max(0.0, min(1.0, busy)) * 100)
+
+    def read(self) -> TelemetrySample:
+        percent, on_ac, discharge = self._battery()
+        gpu_watts = None
+        if self.gpu_manager and self.gpu_manager.device and self.gpu_manager.device.backend == "nvml":
+            gpu_watts = self.gpu_manager.power_usage()
+        return TelemetrySample(time.time(), percent, on_ac, discharge, gpu_watts, self._cpu_load(), None)
+
+
+class TelemetrySampler:
+    # Samples a TelemetrySource on a background thread into a TelemetryBuffer,
+    # tagging each sample with the profile that was active at the time.
+    def __init__(self, source: TelemetrySource, profile_getter: Callable[[], Optional[str]] = lambda: None,
+                 interval: float = TELEMETRY_INTERVAL, capacity: int = TELEMETRY_CAPACITY):
+        self.source = source
+        self.profile_getter = profile_getter
+        self.interval = interval
+        self.buffer = TelemetryBuffer(capacity)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        try:
+            sample = self.source.read()
+        except Exception as e:
+            logger.debug(f"Telemetry sample failed: {e}")
+            return
+        self.buffer.append(sample._replace(profile=self.profile_getter()))
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.sample()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval + 1)
+            self._thread = None
+
+    def summary(self, window: Optional[float] = None) -> Dict[str, Dict]:
+        # Per-profile aggregates over the last `window` seconds (or all data).
+        # Energy integrates discharge power over the gap to the previous
+        # sample, capped at two intervals so pauses in sampling don't count.
+        since = time.time() - window if window else None
+        totals = {}
+        previous = None
+        for sample in self.buffer.samples(since):
+            name = sample.profile or "unknown"
+            entry = totals.setdefault(name, {
+                "samples": 0, "seconds": 0.0, "energy_wh": 0.0,
+                "_watts": [0.0, 0], "_gpu": [0.0, 0], "_cpu": [0.0, 0],
+            })
+            entry["samples"] += 1
+            for key, value in (("_watts", sample.discharge_watts), ("_gpu", sample.gpu_watts), ("_cpu", sample.cpu_load)):
+                if value is not None:
+                    entry[key][0] += value
+                    entry[key][1] += 1
+            if previous is not None and previous.profile == sample.profile:
+                elapsed = min(sample.time - previous.time, 2 * self.interval)
+                entry["seconds"] += elapsed
+                if sample.discharge_watts is not None:
+                    entry["energy_wh"] += sample.discharge_watts * elapsed / 3600
+            previous = sample
+        
+        for entry in totals.values():
+            for key, name in (("_watts", "mean_watts"), ("_gpu", "mean_gpu_watts"), ("_cpu", "mean_cpu_load")):
+                total, count = entry.pop(key)
+                entry[name] = total / count if count else None
+        return totals
+
+
+def hardware_fingerprint() -> str:
+    # Cheap identity of the machine and its drivers, read without spawning
+    # any processes. A BIOS update, GPU driver update or OS build change
+    # produces a new fingerprint and so invalidates the capability cache.
+    import hashlib
+    import platform
+    parts = [platform.system(), platform.release(), platform.version(), platform.machine(), platform.node()]
+    try:
+        import winreg
+        with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"HARDWARE\DESCRIPTION\System\BIOS") as key:
+            for value in ("SystemProductName", "BIOSVersion"):
+                parts.append(str(winreg.QueryValueEx(key, value)[0]))
+        display_class = r"SYSTEM\CurrentControlSet\Control\Class\{4d36e968-e325-11ce-bfc1-08002be10318}"
+        with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, display_class) as adapters:
+            index = 0
+            while True:
+                try:
+                    name = winreg.EnumKey(adapters, index)
+                except OSError:
+                    break
+                index += 1
+                try:
+                    with winreg.OpenKey(adapters, name) as adapter:
+                        for value in ("DriverDesc", "DriverVersion"):
+                            parts.append(str(winreg.QueryValueEx(adapter, value)[0]))
+                except OSError:
+                    continue
+    except (ImportError, OSError):
+        pass
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:32]
+
+
+class CapabilityCache:
+    VERSION = 6
+
+    def __init__(self, path: Path, fingerprint: Optional[str] = None):
+        self.path = path
+        self.fingerprint = fingerprint or hardware_fingerprint()
+        self._lock = threading.Lock()
+
+    def load(self) -> Dict[str, Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != self.VERSION or data.get("fingerprint") != self.fingerprint:
+            logger.info("Hardware fingerprint changed, ignoring capability cache")
+            return {}
+        return data.get("managers", {})
+
+    def save(self, managers: Dict[str, Dict]):
+        data = {"version": self.VERSION, "fingerprint": self.fingerprint, "managers": managers}
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with self._lock:
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, indent=2)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write capability cache: {e}")
+
+    def clear(self):
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+
+
+class ProfileError(ValueError):
+    pass
+
+
+# Every field a profile must end up with after inheritance
+PROFILE_FIELDS = ("power_plan", "power_settings", "brightness", "refresh_rate", "kill_bloatware",
+                  "throttle_processes", "services", "scheduled_tasks", "gpu_power_limit") + tuple(
+    f"cpu_{name}" for name in CPU_LIMITS)
+
+# Used by profiles that neither inherit nor override a built-in profile
+PROFILE_DEFAULTS = {
+    "power_plan": "balanced",
+    "power_settings": {},
+    "refresh_rate": None,
+    "kill_bloatware": False,
+    "throttle_processes": None,
+    "services": {},
+    "scheduled_tasks": [],
+    "gpu_power_limit": None,
+    "cpu_stapm_limit": None,
+    "cpu_fast_limit": None,
+    "cpu_slow_limit": None,
+    "cpu_tctl_temp": None,
+}
+
+# gpu_power_limit may name a hardware limit instead of a wattage
+GPU_LIMIT_PRESETS = ("min", "max", "default")
+
+BUILTIN_PROFILES = {
+    PowerProfile.BATTERY_SAVER.value: {
+        "power_plan": "saver",
+        "power_settings": {"boost_mode": {"dc": "disabled"}, "pcie_aspm": "maximum"},
+        "brightness": 40,
+        "refresh_rate": 60,
+        "kill_bloatware": True,
+        "throttle_processes": None,
+        "services": {},
+        "scheduled_tasks": [],
+        "gpu_power_limit": "min",
+        "cpu_stapm_limit": 15,
+        "cpu_fast_limit": 20,
+        "cpu_slow_limit": 15,
+        "cpu_tctl_temp": 85,
+    },
+    PowerProfile.PERFORMANCE.value: {
+        "power_plan": "performance",
+        "power_settings": {"boost_mode": "aggressive", "pcie_aspm": "off"},
+        "brightness": 80,
+        "refresh_rate": 240,
+        "kill_bloatware": False,
+        "throttle_processes": None,
+        "services": {},
+        "scheduled_tasks": [],
+        "gpu_power_limit": "max",
+        "cpu_stapm_limit": "default",
+        "cpu_fast_limit": "default",
+        "cpu_slow_limit": "default",
+        "cpu_tctl_temp": "default",
+    },
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _power_setting_value(profile: str, name: str, value) -> Optional[int]:
+    setting = POWER_SETTINGS[name]
+    if value is None:
+        return None
+    if isinstance(value, str) and setting.choices and value in setting.choices:
+        return setting.choices[value]
+    if _is_number(value) and setting.low <= value <= setting.high and value == int(value):
+        return int(value)
+    allowed = f"an integer from {setting.low} to {setting.high}"
+    if setting.choices:
+        allowed = f"one of {', '.join(setting.choices)} or {allowed}"
+    raise ProfileError(f"{profile}: power_settings.{name} must be {allowed}")
+
+
+def validate_power_settings(profile: str, value) -> Dict[str, Optional[Dict[str, Optional[int]]]]:
+    # Normalises {name: value} or {name: {"ac": value, "dc": value}} to
+    # {name: {"ac": index, "dc": index}}; a None entry removes a setting
+    # inherited from the base profile
+    if not isinstance(value, dict):
+        raise ProfileError(f"{profile}: power_settings must be an object")
+    settings = {}
+    for name, entry in value.items():
+        if name not in POWER_SETTINGS:
+            raise ProfileError(f"{profile}: unknown power setting '{name}' (known: {', '.join(POWER_SETTINGS)})")
+        if entry is None:
+            settings[name] = None
+            continue
+        sides = entry if isinstance(entry, dict) else {"ac": entry, "dc": entry}
+        unknown = set(sides) - {"ac", "dc"}
+        if unknown:
+            raise ProfileError(f"{profile}: power_settings.{name} only takes ac and dc values")
+        settings[name] = {side: _power_setting_value(profile, name, sides.get(side)) for side in ("ac", "dc")}
+    return settings
+
+
+def validate_profile_field(profile: str, field: str, value):
+    if field == "power_plan":
+        if value in PLAN_SCHEME_GUIDS:
+            return value
+        if isinstance(value, str) and GUID_PATTERN.fullmatch(value):
+            return value.lower()
+        raise ProfileError(f"{profile}: power_plan must be one of {', '.join(PLAN_SCHEME_GUIDS)} or a scheme GUID")
+    if field == "power_settings":
+        return validate_power_settings(profile, value)
+    if field == "brightness":
+        if not _is_number(value):
+            raise ProfileError(f"{profile}: brightness must be a number")
+        return int(value)
+    if field == "refresh_rate":
+        if value is not None and (not _is_number(value) or value <= 0):
+            raise ProfileError(f"{profile}: refresh_rate must be a positive number or null")
+        return None if value is None else int(value)
+    if field == "kill_bloatware":
+        if not isinstance(value, bool):
+            raise ProfileError(f"{profile}: kill_bloatware must be true or false")
+        return value
+    if field == "throttle_processes":
+        if value is not None and value not in THROTTLE_MODES:
+            raise ProfileError(f"{profile}: throttle_processes must be one of {', '.join(THROTTLE_MODES)} or null")
+        return value
+    if field == "services":
+        # A list of names is shorthand for stopping each of them
+        if isinstance(value, list):
+            value = {name: "stop" for name in value}
+        if not isinstance(value, dict) or not all(isinstance(name, str) and name for name in value):
+            raise ProfileError(f"{profile}: services must be a list of service names or an object of name: action")
+        for name, action in value.items():
+            if action not in SERVICE_ACTIONS:
+                raise ProfileError(f"{profile}: services.{name} must be one of {', '.join(SERVICE_ACTIONS)}")
+        return dict(value)
+    if field == "scheduled_tasks":
+        if not isinstance(value, list) or not all(isinstance(path, str) and path.strip("\\") for path in value):
+            raise ProfileError(f"{profile}: scheduled_tasks must be a list of task paths")
+        return ["\\" + path.lstrip("\\") for path in value]
+    if field == "gpu_power_limit":
+        if value is None or value in GPU_LIMIT_PRESETS:
+            return value
+        if not _is_number(value) or value <= 0:
+            raise ProfileError(f"{profile}: gpu_power_limit must be watts, one of {', '.join(GPU_LIMIT_PRESETS)} or null")
+        return float(value)
+    if field in PROFILE_FIELDS and field.startswith("cpu_"):
+        if value is None or value == "default":
+            return value
+        if not _is_number(value) or value <= 0:
+            raise ProfileError(f"{profile}: {field} must be a number, default or null")
+        return float(value)
+    raise ProfileError(f"{profile}: unknown setting '{field}'")
+
+
+def resolve_profiles(definitions: Dict) -> Dict[str, Dict]:
+    # Validates user definitions and resolves "inherits" chains. A user
+    # profile named like a built-in one overrides it field by field.
+    if not isinstance(definitions, dict):
+        raise ProfileError("the profile config must be a JSON object")
+    names = set(BUILTIN_PROFILES) | set(definitions)
+    resolved = {}
+    
+    def resolve(name: str, chain: List[str]) -> Dict:
+        if name in resolved:
+            return resolved[name]
+        if name in chain:
+            raise ProfileError(f"inheritance cycle: {' -> '.join(chain + [name])}")
+        if name not in names:
+            raise ProfileError(f"{chain[-1]}: unknown base profile '{name}'")
+        definition = definitions.get(name, {})
+        if not isinstance(definition, dict):
+            raise ProfileError(f"{name}: a profile must be a JSON object")
+        
+        if "inherits" in definition:
+            base = definition["inherits"]
+            if not isinstance(base, str) or not base.strip():
+                raise ProfileError(f"{name}: inherits must be the name of another profile, got {base!r}")
+            settings = dict(resolve(base, chain + [name]))
+        else:
+            settings = dict(BUILTIN_PROFILES.get(name, PROFILE_DEFAULTS))
+            settings["power_settings"] = validate_power_settings(name, settings["power_settings"])
+        for field, value in definition.items():
+            if field == "power_settings":
+                # Merged per setting, so a profile can change one of its
+                # base's settings without repeating the rest
+                merged = dict(settings.get(field, {}), **validate_power_settings(name, value))
+                settings[field] = {key: sides for key, sides in merged.items() if sides is not None}
+            elif field != "inherits":
+                settings[field] = validate_profile_field(name, field, value)
+        missing = [field for field in PROFILE_FIELDS if field not in settings]
+        if missing:
+            raise ProfileError(f"{name}: missing {', '.join(missing)}")
+        resolved[name] = settings
+        return settings
+    
+    for name in sorted(names):
+        if not isinstance(name, str) or not name.strip():
+            raise ProfileError(f"invalid profile name {name!r}")
+        resolve(name, [])
+    return resolved
+
+
+class ProfileSettings:
+    # One profile compiled for this machine: validated, inheritance resolved
+    # and clamped to the detected hardware limits. Immutable, so compiled
+    # profiles can be shared between threads and used as cache keys.
+    __slots__ = ("name",) + PROFILE_FIELDS
+
+    def __init__(self, name: str, **settings):
+        object.__setattr__(self, "name", name)
+        for field in PROFILE_FIELDS:
+            object.__setattr__(self, field, settings.pop(field))
+        if settings:
+            raise TypeError(f"unknown profile settings: {', '.join(settings)}")
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __eq__(self, other):
+        return isinstance(other, ProfileSettings) and self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __repr__(self):
+        fields = ", ".join(f"{slot}={getattr(self, slot)!r}" for slot in self.__slots__)
+        return f"ProfileSettings({fields})"
+
+    def as_tuple(self) -> Tuple:
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def as_dict(self) -> Dict:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+    @property
+    def cpu_limits(self) -> Dict[str, float]:
+        # The CPU limits this profile sets, keyed by RyzenAdj limit name
+        return {name: getattr(self, f"cpu_{name}") for name in CPU_LIMITS
+                if getattr(self, f"cpu_{name}") is not None}
+
+    @classmethod
+    def compile(cls, name: str, settings: Dict,
+                gpu_limits: Optional[Tuple[float, float, Optional[float]]] = None,
+                cpu_limits: Optional[Dict[str, Optional[float]]] = None,
+                refresh_rates: Iterable[int] = ()) -> "ProfileSettings":
+        # gpu_limits is (min, max, default) from GPUManager.limits(),
+        # cpu_limits the stock CPU limits and refresh_rates the panel's
+        # supported rates; a setting the hardware does not report is left
+        # unchanged
+        compiled = dict(settings, brightness=max(0, min(100, settings["brightness"])), gpu_power_limit=None)
+        # Sorted tuples so the compiled profile stays immutable and hashable
+        compiled["power_settings"] = tuple(sorted(
+            (name, sides["ac"], sides["dc"]) for name, sides in settings["power_settings"].items()
+        ))
+        compiled["services"] = tuple(sorted(settings["services"].items()))
+        compiled["scheduled_tasks"] = tuple(sorted(set(settings["scheduled_tasks"])))
+        if settings["refresh_rate"] is not None:
+            compiled["refresh_rate"] = closest_refresh_rate(refresh_rates, settings["refresh_rate"])
+        if settings["gpu_power_limit"] is not None and gpu_limits:
+            low, high, default = gpu_limits
+            watts = {"min": low, "max": high, "default": default}.get(settings["gpu_power_limit"],
+                                                                       settings["gpu_power_limit"])
+            if watts is not None:
+                compiled["gpu_power_limit"] = float(int(max(low, min(high, watts))))
+        for limit in CPU_LIMITS:
+            field = f"cpu_{limit}"
+            value = settings[field]
+            stock = (cpu_limits or {}).get(limit)
+            if value == "default":
+                value = stock
+            if value is None or stock is None:
+                compiled[field] = None
+            else:
+                low, high = CPU_TEMP_RANGE if limit == "tctl_temp" else CPU_POWER_RANGE
+                compiled[field] = float(max(low, min(high, value)))
+        return cls(name, **compiled)
+
+
+class ProfileConfig:
+    # The user's profile definitions, re-read only when the file's mtime
+    # changes. An invalid file is reported and the last good set is kept.
+    def __init__(self, path: Path):
+        self.path = path
+        self.definitions: Dict[str, Dict] = {}
+        self.resolved: Dict[str, Dict] = resolve_profiles({})
+        # Bumped whenever `resolved` changes
+        self.version = 0
+        self._mtime = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def refresh(self) -> bool:
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if self._loaded and mtime == self._mtime:
+                return False
+            self._loaded = True
+            self._mtime = mtime
+            definitions = {}
+            if mtime is not None:
+                try:
+                    with open(self.path, 'r', encoding='utf-8') as f:
+                        definitions = json.load(f)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Could not read profile config {self.path}: {e}")
+                    return False
+            try:
+                resolved = resolve_profiles(definitions)
+            except ProfileError as e:
+                logger.error(f"Invalid profile config {self.path}: {e}")
+                return False
+            self.definitions = definitions
+            self.resolved = resolved
+            self.version += 1
+            return True
+
+    def save(self, definitions: Dict[str, Dict]):
+        # Validated first, then written to a temporary file and renamed over
+        # the config so readers never see a partial file
+        resolve_profiles(definitions)
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(definitions, f, indent=2)
+        os.replace(temp_path, self.path)
+        self.refresh()
+
+
+class StateSnapshot(NamedTuple):
+    # The hardware settings a profile changes; None means unknown/unsupported
+    power_scheme: Optional[str] = None
+    brightness: Optional[int] = None
+    gpu_power_limit: Optional[float] = None
+    refresh_rate: Optional[int] = None
+    cpu_stapm_limit: Optional[float] = None
+    cpu_fast_limit: Optional[float] = None
+    cpu_slow_limit: Optional[float] = None
+    cpu_tctl_temp: Optional[float] = None
+    
+    def changed_fields(self, other: "StateSnapshot") -> List[str]:
+        # Fields known in both snapshots whose values differ
+        return [
+            field for field in self._fields
+            if getattr(self, field) is not None and getattr(other, field) is not None
+            and getattr(self, field) != getattr(other, field)
+        ]
+
+
+class StateStore:
+    # Last known-good hardware state on disk. "pending" names the profile
+    # being applied; if it is still set on startup the previous run died
+    # mid-apply and the good state should be restored.
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self) -> Tuple[Optional[StateSnapshot], Optional[str]]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return StateSnapshot(**data["good"]), data.get("pending")
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, None
+
+    def save(self, good: StateSnapshot, pending: Optional[str] = None):
+        data = {"good": good._asdict(), "pending": pending}
+        temp_path = self.path.with_name(self.path.name + ".tmp")
+        with self._lock:
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write state snapshot: {e}")
+
+
+def _ps_quote(value) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class CompiledProfile:
+    # A whole profile as one PowerShell script block. Each step reports a
+    # JSON line {"step", "status", "message"} where status is ok, skipped,
+    # unsupported or error. The script takes a -Force switch instead of
+    # baking it in, so one compiled plan serves both modes.
+    def __init__(self, key: Tuple, script: str, steps: List[str]):
+        self.key = key
+        self.script = script
+        self.steps = steps
+
+    def command(self, force: bool = False) -> str:
+        return "& {" + self.script + "}" + (" -Force" if force else "")
+
+    def parse(self, output: str) -> Dict[str, StepResult]:
+        results = {}
+        for line in output.splitlines():
+            line = line.strip()
+            if not line.startswith("{"):
+                continue
+            try:
+                report = json.loads(line)
+            except ValueError:
+                continue
+            name, status, message = report.get("step"), report.get("status"), report.get("message") or None
+            if status == "skipped":
+                results[name] = StepResult(name, skipped=True)
+            elif status == "error":
+                results[name] = StepResult(name, error=RuntimeError(message or "failed"))
+            elif status == "unsupported":
+                results[name] = StepResult(name, error=NotSupportedError(message or "not supported"),
+                                           unsupported=True)
+            else:
+                results[name] = StepResult(name, success=message if status == "ok" else None)
+        for name in self.steps:
+            if name not in results:
+                results[name] = StepResult(name, error=RuntimeError("no result reported by the batch script"))
+        return results
+
+
+class ProfileCompiler:
+    # Compiles profiles ahead of time into CompiledProfile scripts, cached by
+    # the profile settings and the version of the detected capabilities.
+    PRELUDE = (
+        "param([switch]$Force)\n"
+        "function Report($step, $status, $message) {\n"
+        "    [Console]::Out.WriteLine((ConvertTo-Json -Compress @{step = $step; status = $status; message = \"$message\"}))\n"
+        "}\n"
+    )
+
+    def __init__(self):
+        self._cache: Dict[str, CompiledProfile] = {}
+
+    @staticmethod
+    def cache_key(settings: ProfileSettings, manager: "ProfileManager", bloatware: List[str]) -> Tuple:
+        return settings, manager.capabilities_version, tuple(bloatware)
+
+    def compile(self, settings: ProfileSettings, manager: "ProfileManager") -> CompiledProfile:
+        # Uses the managers' capabilities as loaded; nothing is probed here
+        # unless a manager is needed for the first time
+        bloatware = list(manager.process_manager.bloatware_processes)
+        key = self.cache_key(settings, manager, bloatware)
+        compiled = self._cache.get(key)
+        if compiled is None:
+            compiled = self._build(key, settings, manager, bloatware)
+            # Building may have probed a manager for the first time. Plans
+            # compiled against older capabilities can never match again.
+            key = self.cache_key(settings, manager, bloatware)
+            self._cache = {cached: plan for cached, plan in self._cache.items() if cached[1] == key[1]}
+            self._cache[key] = compiled
+            logger.info(f"Compiled {settings.name} profile into a batch plan ({len(compiled.steps)} steps)")
+        return compiled
+
+    def _build(self, key: Tuple, settings: ProfileSettings, manager: "ProfileManager",
+               bloatware: List[str]) -> CompiledProfile:
+        parts = [self.PRELUDE]
+        steps = ["power_plan"]
+        
+        power = manager.power_manager
+        guids = list(dict.fromkeys(guid for guid in (power.scheme_guid(settings.power_plan), power._fallback_plan_guid(settings.power_plan)) if guid))
+        parts.append(
+            "try {\n"
+            "    $active = powercfg /getactivescheme | Out-String\n"
+            f"    if (-not $Force -and $active -match {_ps_quote(power.target_scheme_guid(settings.power_plan))}) {{ Report 'power_plan' 'skipped' }}\n"
+            "    else {\n"
+            f"        foreach ($guid in @({', '.join(_ps_quote(guid) for guid in guids)})) {{\n"
+            "            powercfg /setactive $guid\n"
+            "            if ($LASTEXITCODE -eq 0) { break }\n"
+            "        }\n"
+            "        if ($LASTEXITCODE) { throw \"powercfg /setactive exited with $LASTEXITCODE\" }\n"
+            "        Report 'power_plan' 'ok' 'Power plan'\n"
+            "    }\n"
+            "} catch { Report 'power_plan' 'error' $_ }\n"
+        )
+        
+        if settings.power_settings:
+            steps.append("power_settings")
+            entries = ", ".join(
+                f"@({_ps_quote(POWER_SETTINGS[name].subgroup)}, {_ps_quote(POWER_SETTINGS[name].guid)}, "
+                f"{'$null' if ac is None else ac}, {'$null' if dc is None else dc})"
+                for name, ac, dc in settings.power_settings
+            )
+            # The AC and DC indexes are the last two hex values powercfg
+            # prints for a setting; settings missing on this system are
+            # skipped
+            parts.append(
+                "try {\n"
+                "    if (-not ((powercfg /getactivescheme | Out-String) -match '[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}')) { throw 'No active power scheme' }\n"
+                "    $scheme = $Matches[0]\n"
+                "    $written = 0\n"
+                f"    foreach ($s in @({entries})) {{\n"
+                "        $m = [regex]::Matches((powercfg /q $scheme $s[0] $s[1] | Out-String), '0x([0-9a-fA-F]{8})')\n"
+                "        if ($m.Count -lt 2) { continue }\n"
+                "        $current = @([Convert]::ToInt32($m[$m.Count - 2].Groups[1].Value, 16), [Convert]::ToInt32($m[$m.Count - 1].Groups[1].Value, 16))\n"
+                "        if ($null -ne $s[2] -and ($Force -or $current[0] -ne $s[2])) { powercfg /setacvalueindex $scheme $s[0] $s[1] $s[2]; $written++ }\n"
+                "        if ($null -ne $s[3] -and ($Force -or $current[1] -ne $s[3])) { powercfg /setdcvalueindex $scheme $s[0] $s[1] $s[3]; $written++ }\n"
+                "    }\n"
+                "    if (-not $written) { Report 'power_settings' 'skipped' }\n"
+                "    else {\n"
+                "        powercfg /setactive $scheme\n"
+                "        Report 'power_settings' 'ok' 'Power settings'\n"
+                "    }\n"
+                "} catch { Report 'power_settings' 'error' $_ }\n"
+            )
         
-        if not self.min_power_limit:
-            logger.info("GPU power limiting not supported on this device")
-            self.min_power_limit = None
-            self.max_power_limit = None
-            self.default_power_limit = None
-    
-    def set_power_mode(self, profile: PowerProfile):
-        if not self.nvidia_smi_path:
-            return
+        # Only WMI brightness has a PowerShell equivalent; the monitor
+        # configuration API (DDC/CI) is left to the native step
+        brightness = settings.brightness
+        if manager.display_manager.brightness_backend == "wmi":
+            steps.append("brightness")
+            parts.append(
+                "try {\n"
+                "    $monitor = Get-CimInstance -Namespace root/WMI -ClassName WmiMonitorBrightness -ErrorAction Stop | Select-Object -First 1\n"
+                f"    if (-not $Force -and $monitor.CurrentBrightness -eq {brightness}) {{ Report 'brightness' 'skipped' }}\n"
+                "    else {\n"
+                "        Get-CimInstance -Namespace root/WMI -ClassName WmiMonitorBrightnessMethods -ErrorAction Stop |\n"
+                f"            Invoke-CimMethod -MethodName WmiSetBrightness -Arguments @{{Timeout = [uint32]0; Brightness = [byte]{brightness}}} -ErrorAction Stop | Out-Null\n"
+                "        Report 'brightness' 'ok' 'Brightness'\n"
+                "    }\n"
+                "} catch { Report 'brightness' 'error' $_ }\n"
+            )
         
-        if not self.min_power_limit and not self.max_power_limit:
-            logger.info("GPU power limiting not supported - skipping")
-            return
+        if settings.kill_bloatware:
+            steps.append("processes")
+            names = ", ".join(_ps_quote(os.path.splitext(name)[0]) for name in bloatware)
+            parts.append(
+                "try {\n"
+                f"    $targets = @(Get-Process -Name @({names}) -ErrorAction SilentlyContinue)\n"
+                "    if (-not $targets) { Report 'processes' 'skipped' }\n"
+                "    else {\n"
+                "        $killed = 0\n"
+                "        foreach ($process in $targets) { try { Stop-Process -Id $process.Id -Force -ErrorAction Stop; $killed++ } catch { } }\n"
+                "        if ($killed) { Report 'processes' 'ok' \"Killed $killed processes\" } else { Report 'processes' 'ok' '' }\n"
+                "    }\n"
+                "} catch { Report 'processes' 'error' $_ }\n"
+            )
         
-        if profile == PowerProfile.BATTERY_SAVER:
-            power_limit = self.min_power_limit or 60
+        steps.append("gpu")
+        gpu = manager.gpu_manager
+        target = settings.gpu_power_limit
+        if gpu.device is None or target is None:
+            parts.append("Report 'gpu' 'unsupported'\n")
         else:
-            power_limit = self.max_power_limit or 105
+            smi = _ps_quote(gpu.nvidia_smi_path or "nvidia-smi")
+            parts.append(
+                "try {\n"
+                f"    $current = & {smi} --query-gpu=power.limit --format=csv,noheader,nounits | Select-Object -First 1\n"
+                f"    if (-not $Force -and [int][double]$current -eq {int(target)}) {{ Report 'gpu' 'skipped' }}\n"
+                "    else {\n"
+                f"        $output = & {smi} -pl {int(target)} 2>&1 | Out-String\n"
+                "        if ($output -match 'not supported') { Report 'gpu' 'unsupported' }\n"
+                "        elseif ($LASTEXITCODE) { throw $output.Trim() }\n"
+                "        else { Report 'gpu' 'ok' 'GPU power' }\n"
+                "    }\n"
+                "} catch { Report 'gpu' 'error' $_ }\n"
+            )
         
-        try:
-            result = subprocess.run([
-                self.nvidia_smi_path,
-                "-pl", str(int(power_limit))
-            ], capture_output=True, text=True)
-            
-            if "not supported" in result.stderr.lower() or "not supported" in result.stdout.lower():
-                logger.info("GPU power limiting not supported on this device")
-            elif result.returncode == 0:
-                logger.info(f"Set GPU power limit to {power_limit}W")
-            else:
-                logger.warning(f"Could not set GPU power limit: {result.stderr}")
-        except Exception as e:
-            logger.error(f"Failed to set GPU power mode: {e}")
+        # Without the RyzenAdj CLI (libryzenadj only) the cpu step runs natively
+        ryzenadj = manager.cpu_manager.ryzenadj_path
+        if settings.cpu_limits and ryzenadj:
+            steps.append("cpu")
+            # The SMU accepts repeated writes, so the batch skips the readback
+            flags = " ".join(
+                f"--{name.replace('_', '-')}={int(value) if name == 'tctl_temp' else int(value * 1000)}"
+                for name, value in settings.cpu_limits.items()
+            )
+            parts.append(
+                "try {\n"
+                f"    $output = & {_ps_quote(ryzenadj)} {flags} 2>&1 | Out-String\n"
+                "    if ($LASTEXITCODE) { throw $output.Trim() }\n"
+                "    Report 'cpu' 'ok' 'CPU power'\n"
+                "} catch { Report 'cpu' 'error' $_ }\n"
+            )
+        
+        return CompiledProfile(key, "".join(parts), steps)
 
 
 class ProfileManager:
-    def __init__(self):
+    # Managers are built on first use. Their probe results are cached on disk,
+    # keyed by hardware_fingerprint(), so a warm start runs no probes at all.
+    MANAGER_TYPES = {
+        "power": PowerManager,
+        "display": DisplayManager,
+        "process": ProcessManager,
+        "gpu": GPUManager,
+        "cpu": CPUManager,
+        "service": ServiceManager,
+    }
+    
+    def __init__(self, executor: Optional[CommandExecutor] = None, use_cache: bool = True):
         self.config_file = Path.home() / ".battery_saver_config.json"
-        self.profiles = self._load_profiles()
-        self.current_profile = PowerProfile.PERFORMANCE
+        self.profile_config = ProfileConfig(self.config_file)
+        self._compiled_profiles: Dict[str, ProfileSettings] = {}
+        self._compiled_key = None
+        self.current_profile = PowerProfile.PERFORMANCE.value
         self.last_errors = []
+        self.last_skipped = []
+        
+        self.executor = executor or get_executor()
+        self.step_runner = StepRunner()
+        self.capability_cache = CapabilityCache(Path.home() / ".battery_saver_cache.json") if use_cache else None
+        self._capabilities = self.capability_cache.load() if self.capability_cache else {}
+        self._managers = {}
+        self._manager_locks = {key: threading.Lock() for key in self.MANAGER_TYPES}
+        # Bumped whenever capabilities are probed, so compiled batch plans
+        # built against older ones are not reused
+        self.capabilities_version = 0
+        self.telemetry: Optional[TelemetrySampler] = None
+        # Apply a whole profile as one compiled PowerShell script instead of
+        # individual steps
+        self.batched = False
+        self.compiler = ProfileCompiler()
+        # Roll back to the prior state when a step fails
+        self.transactional = True
+        self.state_store = StateStore(Path.home() / ".battery_saver_state.json")
+        self.last_rollback: List[str] = []
+    
+    def _manager(self, key: str):
+        manager = self._managers.get(key)
+        if manager is not None:
+            return manager
+        with self._manager_locks[key]:
+            if key not in self._managers:
+                manager_type = self.MANAGER_TYPES[key]
+                if hasattr(manager_type, "get_capabilities"):
+                    cached = self._capabilities.get(key)
+                    with metrics.span("battery_saver_probe_seconds", manager=key, cached=cached is not None):
+                        manager = manager_type(self.executor, cached)
+                    if cached is None:
+                        self._store_capabilities(key, manager.get_capabilities())
+                else:
+                    manager = manager_type(self.executor)
+                self._managers[key] = manager
+            return self._managers[key]
+    
+    def _build_manager(self, key: str) -> None:
+        self._manager(key)
+    
+    def _store_capabilities(self, key: str, capabilities: Dict):
+        self._capabilities[key] = capabilities
+        self.capabilities_version += 1
+        if self.capability_cache:
+            self.capability_cache.save(dict(self._capabilities))
+    
+    @property
+    def power_manager(self) -> PowerManager:
+        return self._manager("power")
+    
+    @property
+    def display_manager(self) -> DisplayManager:
+        return self._manager("display")
+    
+    @property
+    def process_manager(self) -> ProcessManager:
+        return self._manager("process")
+    
+    @property
+    def gpu_manager(self) -> GPUManager:
+        return self._manager("gpu")
+    
+    @property
+    def cpu_manager(self) -> CPUManager:
+        return self._manager("cpu")
+    
+    @property
+    def service_manager(self) -> ServiceManager:
+        return self._manager("service")
+    
+    def start_telemetry(self, interval: float = TELEMETRY_INTERVAL,
+                        source: Optional[TelemetrySource] = None) -> TelemetrySampler:
+        if self.telemetry is None:
+            source = source or WindowsTelemetrySource(self.gpu_manager)
+            self.telemetry = TelemetrySampler(source, lambda: self.current_profile, interval)
+            self.telemetry.start()
+        return self.telemetry
+    
+    def probe(self, force: bool = False) -> Dict[str, Dict]:
+        # Builds every manager at once, running the hardware probes in parallel
+        if force:
+            self._managers = {}
+            self._capabilities = {}
+            self.capabilities_version += 1
+            if self.capability_cache:
+                self.capability_cache.clear()
         
-        self.power_manager = PowerManager()
-        self.display_manager = DisplayManager()
-        self.process_manager = ProcessManager()
-        self.gpu_manager = GPUManager()
-    
-    def _load_profiles(self) -> Dict:
-        default_profiles = {
-            PowerProfile.BATTERY_SAVER.value: {
-                "brightness": 40,
-                "refresh_rate": 60,
-                "kill_bloatware": True,
-                "gpu_power_limit": 60
-            },
-            PowerProfile.PERFORMANCE.value: {
-                "brightness": 80,
-                "refresh_rate": 240,
-                "kill_bloatware": False,
-                "gpu_power_limit": 105
+        steps = [
+            ProfileStep(key, lambda key=key: self._build_manager(key), needs_com=(key == "display"))
+            for key in self.MANAGER_TYPES
+        ]
+        # Probes are timed per manager in _manager()
+        for name, result in self.step_runner.run(steps, metric=None).items():
+            if not result.ok:
+                logger.warning(f"Probing {name} failed: {result.error}")
+        return dict(self._capabilities)
+    
+    @property
+    def profiles(self) -> Dict[str, ProfileSettings]:
+        # Profiles compiled against the current hardware limits; recompiled
+        # only when the config file or the limits change
+        self.profile_config.refresh()
+        gpu_limits = self.gpu_manager.limits()
+        cpu_limits = self.cpu_manager.stock_limits if self.cpu_manager.supported else None
+        refresh_rates = tuple(self.display_manager.refresh_rates)
+        key = (self.profile_config.version, gpu_limits, json.dumps(cpu_limits, sort_keys=True), refresh_rates)
+        if key != self._compiled_key:
+            self._compiled_profiles = {
+                name: ProfileSettings.compile(name, settings, gpu_limits, cpu_limits, refresh_rates)
+                for name, settings in self.profile_config.resolved.items()
             }
+            self._compiled_key = key
+        return self._compiled_profiles
+    
+    def get_profile(self, profile) -> ProfileSettings:
+        name = profile_name(profile)
+        profiles = self.profiles
+        if name not in profiles:
+            raise ProfileError(f"Unknown profile '{name}' (available: {', '.join(sorted(profiles))})")
+        return profiles[name]
+    
+    def save_profiles(self):
+        self.profile_config.save(self.profile_config.definitions)
+    
+    def update_profile(self, profile, **settings):
+        # Overrides fields in the user's definition of a profile and saves
+        definitions = json.loads(json.dumps(self.profile_config.definitions))
+        definitions.setdefault(profile_name(profile), {}).update(settings)
+        self.profile_config.save(definitions)
+    
+    def tune_gpu(self, profile, throughput: Throughput, save: bool = True, grid_points: int = 5,
+                 tolerance: float = 2.0, **options) -> Tuple[TuneSample, List[TuneSample]]:
+        # Finds the most efficient GPU power limit for the running workload
+        # and stores it as the profile's gpu_power_limit. options go to
+        # GPUTuner (system_watts, settle, duration, sample_interval).
+        name = self.get_profile(profile).name
+        best, samples = GPUTuner(self.gpu_manager, throughput, **options).tune(grid_points, tolerance)
+        if save:
+            self.update_profile(name, gpu_power_limit=int(best.limit))
+            logger.info(f"Saved {best.limit:.0f}W as the {name} profile's GPU power limit")
+        return best, samples
+    
+    # Each step reads the current hardware state first and returns SKIPPED
+    # when it already matches, unless force is set. A transactional apply
+    # has just read the state into `prior`, so known fields are not read
+    # again.
+    @staticmethod
+    def _current(prior: Optional[StateSnapshot], field: str, read: Callable):
+        value = getattr(prior, field) if prior is not None else None
+        return read() if value is None else value
+    
+    def _apply_power_plan(self, settings: ProfileSettings, force: bool = False,
+                          prior: Optional[StateSnapshot] = None) -> str:
+        if not force and self._current(prior, "power_scheme", self.power_manager.get_active_scheme) \
+                == self.power_manager.target_scheme_guid(settings.power_plan):
+            return SKIPPED
+        self.power_manager.set_power_plan(settings.power_plan)
+        return "Power plan"
+    
+    def _apply_power_settings(self, settings: ProfileSettings, force: bool = False) -> str:
+        if not self.power_manager.set_power_settings(settings.power_settings, force):
+            return SKIPPED
+        return "Power settings"
+    
+    def _apply_brightness(self, settings: ProfileSettings, force: bool = False,
+                          prior: Optional[StateSnapshot] = None) -> str:
+        if not force and self._current(prior, "brightness", self.display_manager.get_brightness) == settings.brightness:
+            return SKIPPED
+        self.display_manager.set_brightness(settings.brightness)
+        return "Brightness"
+    
+    def _apply_refresh_rate(self, settings: ProfileSettings, force: bool = False,
+                            prior: Optional[StateSnapshot] = None) -> str:
+        if not force and self._current(prior, "refresh_rate",
+                                       self.display_manager.get_refresh_rate) == settings.refresh_rate:
+            return SKIPPED
+        if self.display_manager.set_refresh_rate(settings.refresh_rate) is None:
+            return SKIPPED
+        return "Refresh rate"
+    
+    def _apply_kill_bloatware(self) -> Optional[str]:
+        report = self.process_manager.kill_bloatware()
+        if not report.results:
+            return SKIPPED
+        if report.killed:
+            return f"Killed {len(report.killed)} processes"
+        return None
+    
+    def _apply_throttle(self, settings: ProfileSettings) -> str:
+        # Profiles without throttling resume whatever an earlier profile
+        # throttled
+        mode = settings.throttle_processes
+        if mode:
+            throttled = self.process_manager.throttle(mode)
+            if not throttled:
+                return SKIPPED
+            return f"{'Suspended' if mode == 'suspend' else 'Throttled'} {len(throttled)} processes"
+        resumed = self.process_manager.resume_throttled()
+        if not resumed:
+            return SKIPPED
+        return f"Resumed {len(resumed)} processes"
+    
+    def _throttle_step(self, settings: ProfileSettings) -> Optional[ProfileStep]:
+        if not settings.throttle_processes and not self.process_manager.throttled():
+            return None
+        return ProfileStep("throttle", lambda: self._apply_throttle(settings))
+    
+    def _apply_services(self, settings: ProfileSettings) -> str:
+        # Profiles that list no services or tasks restore the ones an
+        # earlier profile suspended
+        changed, errors = self.service_manager.apply(settings.services, settings.scheduled_tasks)
+        for error in errors:
+            logger.warning(f"Service control: {error}")
+        if errors and not changed:
+            raise RuntimeError("; ".join(errors))
+        if not changed:
+            return SKIPPED
+        return f"Services ({len(changed)} changed)"
+    
+    def _services_step(self, settings: ProfileSettings) -> Optional[ProfileStep]:
+        if not settings.services and not settings.scheduled_tasks and not self.service_manager.suspended():
+            return None
+        # Scheduled tasks are reached through COM
+        return ProfileStep("services", lambda: self._apply_services(settings), timeout=STEP_TIMEOUT + SERVICE_TIMEOUT,
+                           needs_com=True)
+    
+    def _apply_gpu(self, settings: ProfileSettings, force: bool = False,
+                   prior: Optional[StateSnapshot] = None) -> Optional[str]:
+        target = settings.gpu_power_limit
+        if target is None:
+            return None
+        if not force and self._current(prior, "gpu_power_limit", self.gpu_manager.get_power_limit) == target:
+            return SKIPPED
+        self.gpu_manager.set_power_mode(target)
+        return "GPU power"
+    
+    def _apply_cpu(self, settings: ProfileSettings, force: bool = False,
+                   prior: Optional[StateSnapshot] = None) -> Optional[str]:
+        current = None
+        if prior is not None and all(getattr(prior, f"cpu_{name}") is not None for name in settings.cpu_limits):
+            current = {name: getattr(prior, f"cpu_{name}") for name in settings.cpu_limits}
+        if not self.cpu_manager.set_limits(settings.cpu_limits, force, current):
+            return SKIPPED
+        return "CPU power"
+    
+    def _build_steps(self, settings: ProfileSettings, force: bool = False,
+                     prior: Optional[StateSnapshot] = None) -> List[ProfileStep]:
+        steps = [
+            ProfileStep("power_plan", lambda: self._apply_power_plan(settings, force, prior)),
+            ProfileStep("brightness", lambda: self._apply_brightness(settings, force, prior), needs_com=True),
+        ]
+        if settings.power_settings:
+            # Written to whichever scheme the power_plan step activated
+            steps.append(ProfileStep("power_settings", lambda: self._apply_power_settings(settings, force),
+                                     depends_on=("power_plan",)))
+        if settings.refresh_rate is not None:
+            steps.append(ProfileStep("refresh_rate", lambda: self._apply_refresh_rate(settings, force, prior)))
+        if settings.kill_bloatware:
+            steps.append(ProfileStep("processes", self._apply_kill_bloatware))
+        for step in (self._throttle_step(settings), self._services_step(settings)):
+            if step:
+                steps.append(step)
+        steps.append(ProfileStep("gpu", lambda: self._apply_gpu(settings, force, prior)))
+        if settings.cpu_limits:
+            steps.append(ProfileStep("cpu", lambda: self._apply_cpu(settings, force, prior)))
+        return steps
+    
+    @staticmethod
+    def _describe_error(step: str, error: BaseException) -> Optional[str]:
+        error_msg = str(error)
+        if step == "power_plan":
+            logger.error(f"Failed to set power plan: {error}")
+            return f"Power plan: {error_msg}"
+        if step == "brightness":
+            if "0x8004100c" in error_msg or "WMI" in error_msg:
+                return "Brightness: Not supported on this display"
+            return f"Brightness: {error_msg}"
+        if step == "processes":
+            return f"Process management: {error_msg}"
+        if step == "throttle":
+            return f"Process throttling: {error_msg}"
+        if step == "power_settings":
+            return f"Power settings: {error_msg}"
+        if step == "services":
+            return f"Services: {error_msg}"
+        if step == "gpu":
+            if "not supported" in error_msg.lower():
+                return None
+            return f"GPU: {error_msg}"
+        if step == "cpu":
+            return f"CPU: {error_msg}"
+        if step == "refresh_rate":
+            return f"Refresh rate: {error_msg}"
+        return f"{step}: {error_msg}"
+    
+    def capture_state(self) -> StateSnapshot:
+        # The reads run in parallel on the step runner's long-lived threads,
+        # which keep COM initialised and their WMI connection open between
+        # applies. A read that fails or times out leaves its field unknown.
+        state = {}
+        reads = {
+            "power_scheme": self.power_manager.get_active_scheme,
+            "brightness": self.display_manager.get_brightness,
+            "gpu_power_limit": self.gpu_manager.get_power_limit,
+            "refresh_rate": self.display_manager.get_refresh_rate,
         }
-        
-        if self.config_file.exists():
+        steps = [
+            ProfileStep(field, lambda field=field, read=read: state.__setitem__(field, read()),
+                        needs_com=(field == "brightness"))
+            for field, read in reads.items()
+        ]
+        steps.append(ProfileStep("cpu", lambda: state.update(
+            (f"cpu_{name}", value) for name, value in self.cpu_manager.get_limits().items())))
+        for name, result in self.step_runner.run(steps, metric=None).items():
+            if not result.ok:
+                logger.debug(f"Could not read {name} state: {result.error}")
+        return StateSnapshot(**{field: state.get(field) for field in StateSnapshot._fields})
+    
+    def restore_state(self, snapshot: StateSnapshot, current: Optional[StateSnapshot] = None) -> List[str]:
+        # Restores only the fields that differ from the snapshot
+        current = current or self.capture_state()
+        restored = []
+        for field in snapshot.changed_fields(current):
+            value = getattr(snapshot, field)
             try:
-                with open(self.config_file, 'r') as f:
-                    return json.load(f)
-            except:
-                pass
-        
-        return default_profiles
+                if field == "power_scheme":
+                    self.power_manager.activate_scheme(value)
+                elif field == "brightness":
+                    run_with_com(lambda: self.display_manager.set_brightness(value))
+                elif field == "gpu_power_limit":
+                    self.gpu_manager.set_power_limit(value)
+                elif field == "refresh_rate":
+                    self.display_manager.set_refresh_rate(value)
+                elif field.startswith("cpu_"):
+                    self.cpu_manager.set_limits({field[len("cpu_"):]: value})
+                restored.append(field)
+            except Exception as e:
+                logger.error(f"Could not restore {field}: {e}")
+        if restored:
+            logger.info(f"Restored {', '.join(restored)}")
+        return restored
     
-    def save_profiles(self):
-        with open(self.config_file, 'w') as f:
-            json.dump(self.profiles, f, indent=2)
+    def recover(self) -> List[str]:
+        # Called on startup: undo a profile apply that never finished
+        good, pending = self.state_store.load()
+        if good is None or pending is None:
+            return []
+        logger.warning(f"Applying {pending} did not finish, restoring the last good state")
+        restored = self.restore_state(good)
+        self.state_store.save(good)
+        return restored
     
-    def apply_profile(self, profile: PowerProfile):
-        settings = self.profiles[profile.value]
+    def restore_last_good(self) -> List[str]:
+        good, _ = self.state_store.load()
+        if good is None:
+            raise RuntimeError("No saved state to restore")
+        restored = self.restore_state(good)
+        self.state_store.save(good)
+        return restored
+    
+    def _expected_state(self, prior: StateSnapshot, settings: ProfileSettings, applied: List[str]) -> StateSnapshot:
+        # The state after a successful apply, derived without reading the
+        # hardware again
+        state = prior._asdict()
+        if "power_plan" in applied:
+            state["power_scheme"] = self.power_manager.get_active_scheme()
+        if "brightness" in applied and prior.brightness is not None:
+            state["brightness"] = settings.brightness
+        if "gpu" in applied and prior.gpu_power_limit is not None and settings.gpu_power_limit is not None:
+            state["gpu_power_limit"] = settings.gpu_power_limit
+        if "cpu" in applied:
+            for name, value in settings.cpu_limits.items():
+                if prior._asdict()[f"cpu_{name}"] is not None:
+                    state[f"cpu_{name}"] = value
+        return StateSnapshot(**state)
+    
+    def _run_batched(self, settings: ProfileSettings, force: bool,
+                     prior: Optional[StateSnapshot] = None) -> Tuple[List[str], Dict[str, StepResult]]:
+        compiled = self.compiler.compile(settings, self)
+        # The display mode, process throttling and service control APIs have
+        # no PowerShell equivalent, so those steps run natively while the
+        # script runs, as do brightness and cpu when the script cannot set them
+        native = []
+        if "brightness" not in compiled.steps:
+            native.append(ProfileStep("brightness", lambda: self._apply_brightness(settings, force, prior),
+                                      needs_com=True))
+        if settings.cpu_limits and "cpu" not in compiled.steps:
+            native.append(ProfileStep("cpu", lambda: self._apply_cpu(settings, force, prior)))
+        if settings.refresh_rate is not None:
+            native.append(ProfileStep("refresh_rate", lambda: self._apply_refresh_rate(settings, force, prior)))
+        for step in (self._throttle_step(settings), self._services_step(settings)):
+            if step:
+                native.append(step)
+        if native:
+            native_results = self.step_runner.submit(native)
+            native_deadline = time.monotonic() + max(step.timeout or STEP_TIMEOUT for step in native)
+        try:
+            result = self.executor.run_powershell(compiled.command(force), timeout=STEP_TIMEOUT)
+            results = compiled.parse(result.stdout)
+        except (subprocess.SubprocessError, OSError) as e:
+            results = {name: StepResult(name, error=e) for name in compiled.steps}
+        if native:
+            from concurrent.futures import TimeoutError as FutureTimeout
+            try:
+                results.update(native_results.result(timeout=max(0.0, native_deadline - time.monotonic()) + 1.0))
+            except FutureTimeout:
+                for step in native:
+                    timeout = step.timeout or STEP_TIMEOUT
+                    results[step.name] = StepResult(step.name, error=TimeoutError(f"timed out after {timeout:g}s"))
+                logger.warning("Native profile steps did not finish in time")
+        return compiled.steps + [step.name for step in native], results
+    
+    def apply_profile(self, profile, force: bool = False, batched: Optional[bool] = None,
+                      cancel: Optional[threading.Event] = None,
+                      progress: Optional[Callable[[str, int, int], None]] = None):
+        # profile is a PowerProfile or the name of any configured profile.
+        # progress(step, done, total) is called as steps finish; setting
+        # `cancel` stops steps that have not started, rolls back and raises
+        # SwitchCancelled.
+        with metrics.span("battery_saver_apply_seconds", profile=profile_name(profile),
+                          mode="batched" if (self.batched if batched is None else batched) else "steps"):
+            return self._apply_profile(profile, force, batched, cancel, progress)
+    
+    def _apply_profile(self, profile, force: bool, batched: Optional[bool],
+                       cancel: Optional[threading.Event], progress: Optional[Callable[[str, int, int], None]]):
+        settings = self.get_profile(profile)
         self.last_errors = []
+        self.last_skipped = []
+        self.last_rollback = []
         successes = []
+        applied = []
+        failed = False
         
-        try:
-            self.power_manager.set_power_plan(profile)
-            successes.append("Power plan")
-        except Exception as e:
-            self.last_errors.append(f"Power plan: {str(e)}")
-            logger.error(f"Failed to set power plan: {e}")
+        prior = None
+        if self.transactional:
+            prior = self.capture_state()
+            self.state_store.save(prior, pending=settings.name)
         
-        try:
-            self.display_manager.set_brightness(settings["brightness"])
-            successes.append("Brightness")
-        except Exception as e:
-            error_msg = str(e)
-            if "0x8004100c" in error_msg or "WMI" in error_msg:
-                self.last_errors.append("Brightness: Not supported on this display")
-            else:
-                self.last_errors.append(f"Brightness: {error_msg}")
+        if cancel is not None and cancel.is_set():
+            names, results = [], {}
+        elif self.batched if batched is None else batched:
+            names, results = self._run_batched(settings, force, prior)
+            for done, name in enumerate(names, 1):
+                if progress:
+                    progress(name, done, len(names))
+        else:
+            # Steps are independent, so they run concurrently; results are
+            # still reported in step order.
+            steps = self._build_steps(settings, force, prior)
+            names = [step.name for step in steps]
+            finished = []
+            
+            def on_result(result: StepResult):
+                finished.append(result.name)
+                if progress:
+                    progress(result.name, len(finished), len(steps))
+            
+            results = self.step_runner.run(steps, cancel=cancel, on_result=on_result)
         
-        if settings.get("kill_bloatware", False):
-            try:
-                killed = self.process_manager.kill_bloatware()
-                if killed:
-                    successes.append(f"Killed {len(killed)} processes")
-            except Exception as e:
-                self.last_errors.append(f"Process management: {str(e)}")
+        if cancel is not None and cancel.is_set():
+            if prior is not None:
+                self.last_rollback = self.restore_state(prior)
+                self.state_store.save(prior)
+            logger.info(f"Switch to {settings.name} cancelled")
+            raise SwitchCancelled(f"Switch to {settings.name} cancelled")
         
-        try:
-            self.gpu_manager.set_power_mode(profile)
-            if self.gpu_manager.min_power_limit or self.gpu_manager.max_power_limit:
-                successes.append("GPU power")
-        except Exception as e:
-            if "not supported" not in str(e).lower():
-                self.last_errors.append(f"GPU: {str(e)}")
+        for name in names:
+            result = results[name]
+            if result.skipped:
+                self.last_skipped.append(name)
+            elif result.ok:
+                applied.append(name)
+                if result.success:
+                    successes.append(result.success)
+            else:
+                # Settings the hardware does not support are reported but
+                # do not fail the transaction
+                failed = failed or not result.unsupported
+                error = self._describe_error(name, result.error)
+                if error:
+                    self.last_errors.append(error)
         
-        self.current_profile = profile
+        if prior is not None:
+            if failed:
+                # Killed processes cannot be brought back; everything else
+                # returns to where it was before this apply
+                self.last_rollback = self.restore_state(prior)
+                self.state_store.save(prior)
+                logger.warning(f"Rolled back {settings.name} profile")
+                return successes, self.last_errors
+            self.state_store.save(self._expected_state(prior, settings, applied))
         
+        self.current_profile = settings.name
+        
+        if self.last_skipped:
+            logger.info(f"Already satisfied, skipped: {', '.join(self.last_skipped)}")
         if self.last_errors:
-            logger.warning(f"Applied {profile.value} profile with errors: {', '.join(self.last_errors)}")
+            logger.warning(f"Applied {settings.name} profile with errors: {', '.join(self.last_errors)}")
         else:
-            logger.info(f"Successfully applied {profile.value} profile")
+            logger.info(f"Successfully applied {settings.name} profile")
         
         return successes, self.last_errors
 
 
+def benchmark_profile_switch(transcript, profile: PowerProfile = PowerProfile.BATTERY_SAVER,
+                             repeat: int = 5, realtime: bool = True) -> Dict[str, float]:
+    # Replays a recorded transcript so startup probes and apply_profile can be
+    # timed without the target hardware.
+    executor = ReplayExecutor(transcript, realtime=realtime)
+    start = time.perf_counter()
+    manager = ProfileManager(executor, use_cache=False)
+    manager.probe()
+    startup = time.perf_counter() - start
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        manager.apply_profile(profile)
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "startup": startup,
+        "apply_min": min(timings),
+        "apply_mean": sum(timings) / len(timings),
+        "apply_max": max(timings),
+    }
+
+
+AUTO_SWITCH_DEBOUNCE = 5.0
+AUTO_SWITCH_MIN_DWELL = 60.0
+
+
+class PowerEventSource:
+    # Delivers AC/DC transitions by calling callback(on_ac) from any thread
+    def start(self, callback: Callable[[bool], None]):
+        raise NotImplementedError
+
+    def stop(self):
+        raise NotImplementedError
+
+
+class SyntheticPowerSource(PowerEventSource):
+    # Event source driven by hand, for exercising AutoSwitchEngine off Windows
+    def __init__(self):
+        self.callback = None
+
+    def start(self, callback: Callable[[bool], None]):
+        self.callback = callback
+
+    def stop(self):
+        self.callback = None
+
+    def emit(self, on_ac: bool):
+        if self.callback:
+            self.callback(on_ac)
+
+
+class POWERBROADCAST_SETTING(ctypes.Structure):
+    _fields_ = [("PowerSetting", GUID), ("DataLength", ctypes.c_ulong), ("Data", ctypes.c_ubyte * 4)]
+
+
+class WindowsPowerEventSource(PowerEventSource):
+    # Listens for GUID_ACDC_POWER_SOURCE through RegisterPowerSettingNotification
+    # on a hidden message-only window. Windows posts the current state right
+    # after registration and then once per transition; nothing is polled.
+    GUID_ACDC_POWER_SOURCE = "5d3e9a59-e9d5-4b00-a6bd-ff34ff516548"
+    WM_CLOSE = 0x0010
+    WM_DESTROY = 0x0002
+    WM_POWERBROADCAST = 0x0218
+    PBT_POWERSETTINGCHANGE = 0x8013
+    HWND_MESSAGE = -3
+
+    def __init__(self):
+        self._thread = None
+        self._hwnd = None
+        self._ready = threading.Event()
+
+    def start(self, callback: Callable[[bool], None]):
+        self._thread = threading.Thread(target=self._run, args=(callback,), name="power-events", daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+
+    def _run(self, callback: Callable[[bool], None]):
+        from ctypes import wintypes
+        user32 = ctypes.windll.user32
+        LRESULT = ctypes.c_ssize_t
+        WNDPROC = ctypes.WINFUNCTYPE(LRESULT, wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM)
+        user32.DefWindowProcW.argtypes = [wintypes.HWND, wintypes.UINT, wintypes.WPARAM, wintypes.LPARAM]
+        user32.DefWindowProcW.restype = LRESULT
+        user32.CreateWindowExW.restype = wintypes.HWND
+        user32.RegisterPowerSettingNotification.restype = ctypes.c_void_p
+
+        class WNDCLASSW(ctypes.Structure):
+            _fields_ = [
+                ("style", wintypes.UINT), ("lpfnWndProc", WNDPROC), ("cbClsExtra", ctypes.c_int),
+                ("cbWndExtra", ctypes.c_int), ("hInstance", wintypes.HINSTANCE), ("hIcon", wintypes.HICON),
+                ("hCursor", wintypes.HANDLE), ("hbrBackground", wintypes.HBRUSH),
+                ("lpszMenuName", wintypes.LPCWSTR), ("lpszClassName", wintypes.LPCWSTR),
+            ]
+
+        def window_proc(hwnd, message, wparam, lparam):
+            if message == self.WM_POWERBROADCAST and wparam == self.PBT_POWERSETTINGCHANGE:
+                setting = ctypes.cast(lparam, ctypes.POINTER(POWERBROADCAST_SETTING)).contents
+                if str(setting.PowerSetting) == self.GUID_ACDC_POWER_SOURCE:
+                    # 0 = AC, 1 = battery, 2 = short-term source such as a UPS
+                    try:
+                        callback(setting.Data[0] == 0)
+                    except Exception as e:
+                        logger.error(f"Power event handler failed: {e}")
+                return 1
+            if message == self.WM_CLOSE:
+                user32.DestroyWindow(hwnd)
+                return 0
+            if message == self.WM_DESTROY:
+                user32.PostQuitMessage(0)
+                return 0
+            return user32.DefWindowProcW(hwnd, message, wparam, lparam)
+
+        procedure = WNDPROC(window_proc)
+        instance = ctypes.windll.kernel32.GetModuleHandleW(None)
+        window_class = WNDCLASSW(lpfnWndProc=procedure, hInstance=instance, lpszClassName="BatterySaverPowerEvents")
+        user32.RegisterClassW(ctypes.byref(window_class))
+        self._hwnd = user32.CreateWindowExW(0, window_class.lpszClassName, "Battery Saver", 0, 0, 0, 0, 0,
+                                            self.HWND_MESSAGE, None, instance, None)
+        acdc = GUID.from_string(self.GUID_ACDC_POWER_SOURCE)
+        notification = user32.RegisterPowerSettingNotification(self._hwnd, ctypes.byref(acdc), 0)
+        self._ready.set()
+
+        message = wintypes.MSG()
+        while user32.GetMessageW(ctypes.byref(message), None, 0, 0) > 0:
+            user32.TranslateMessage(ctypes.byref(message))
+            user32.DispatchMessageW(ctypes.byref(message))
+
+        if notification:
+            user32.UnregisterPowerSettingNotification(ctypes.c_void_p(notification))
+        user32.UnregisterClassW(window_class.lpszClassName, instance)
+        self._hwnd = None
+
+    def stop(self):
+        if self._hwnd:
+            ctypes.windll.user32.PostMessageW(self._hwnd, self.WM_CLOSE, 0, 0)
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+class AutoSwitchEngine:
+    # Turns AC/DC events into profile switches. A new power state must hold
+    # for `debounce` seconds before it is acted on (a loose plug can flap
+    # several times a second), and two switches are at least `min_dwell`
+    # seconds apart; a switch held back by either is applied once it is due
+    # if the state still calls for it. handle_event() and poll() take an
+    # explicit time so the state machine can be driven by synthetic events.
+    def __init__(self, apply: Callable[[PowerProfile], object], source: Optional[PowerEventSource] = None,
+                 debounce: float = AUTO_SWITCH_DEBOUNCE, min_dwell: float = AUTO_SWITCH_MIN_DWELL,
+                 ac_profile: PowerProfile = PowerProfile.PERFORMANCE,
+                 dc_profile: PowerProfile = PowerProfile.BATTERY_SAVER,
+                 clock: Callable[[], float] = time.monotonic):
+        self.apply = apply
+        self.source = source
+        self.debounce = debounce
+        self.min_dwell = min_dwell
+        self.ac_profile = ac_profile
+        self.dc_profile = dc_profile
+        self.clock = clock
+        self.applied: Optional[PowerProfile] = None
+        self.pending: Optional[PowerProfile] = None
+        self.pending_since = 0.0
+        self.last_switch: Optional[float] = None
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def handle_event(self, on_ac: bool, now: Optional[float] = None):
+        now = self.clock() if now is None else now
+        target = self.ac_profile if on_ac else self.dc_profile
+        with self._condition:
+            if target == self.applied:
+                self.pending = None
+            elif target != self.pending:
+                self.pending = target
+                self.pending_since = now
+            self._condition.notify()
+
+    def due_at(self) -> Optional[float]:
+        if self.pending is None:
+            return None
+        due = self.pending_since + self.debounce
+        if self.last_switch is not None:
+            due = max(due, self.last_switch + self.min_dwell)
+        return due
+
+    def poll(self, now: Optional[float] = None) -> Optional[PowerProfile]:
+        now = self.clock() if now is None else now
+        with self._condition:
+            due = self.due_at()
+            if due is None or now < due:
+                return None
+            profile, self.pending = self.pending, None
+            self.applied = profile
+            self.last_switch = now
+        logger.info(f"Power source changed, switching to {profile_name(profile)}")
+        try:
+            self.apply(profile)
+        except Exception as e:
+            logger.error(f"Automatic switch to {profile_name(profile)} failed: {e}")
+        return profile
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                due = self.due_at()
+                timeout = None if due is None else max(0.0, due - self.clock())
+                if timeout is None or timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+            self.poll()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="auto-switch", daemon=True)
+        self._thread.start()
+        if self.source:
+            self.source.start(self.handle_event)
+
+    def stop(self):
+        if self.source:
+            self.source.stop()
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+DAEMON_TIMEOUT = 60.0
+
+
+def default_daemon_address() -> str:
+    if sys.platform == "win32":
+        return r"\\.\pipe\battery-saver"
+    return str(Path.home() / ".battery_saver.sock")
+
+
+def read_status(manager: "ProfileManager") -> Dict:
+    return {
+        "profile": manager.current_profile,
+        "power_scheme": manager.power_manager.get_active_scheme(),
+        "brightness": run_with_com(manager.display_manager.get_brightness),
+        "refresh_rate": manager.display_manager.get_refresh_rate(),
+        "gpu_power_limit": manager.gpu_manager.get_power_limit(),
+        "cpu_limits": manager.cpu_manager.get_limits() or None,
+    }
+
+
+def handle_request(manager: "ProfileManager", request: Dict) -> Dict:
+    # One JSON request in, one JSON response out; shared by the daemon and
+    # by the CLI when no daemon is running.
+    try:
+        command = request.get("command")
+        if command == "ping":
+            result = "pong"
+        elif command == "apply":
+            profile = manager.get_profile(request["profile"])
+            successes, errors = manager.apply_profile(profile.name, force=bool(request.get("force", False)),
+                                                      batched=request.get("batched"))
+            result = {
+                "profile": profile.name,
+                "successes": successes,
+                "errors": errors,
+                "skipped": list(manager.last_skipped),
+                "rolled_back": list(manager.last_rollback),
+            }
+        elif command == "status":
+            result = read_status(manager)
+        elif command == "stats":
+            result = metrics.to_prometheus() if request.get("format") == "prometheus" else metrics.stats()
+            if request.get("reset"):
+                metrics.reset()
+        elif command == "profiles":
+            result = {name: settings.as_dict() for name, settings in manager.profiles.items()}
+        elif command == "restore":
+            result = manager.restore_last_good()
+        elif command == "probe":
+            result = manager.probe(force=bool(request.get("refresh", False)))
+        elif command == "telemetry":
+            if manager.telemetry is None:
+                raise RuntimeError("Telemetry is only collected while the daemon is running")
+            result = manager.telemetry.summary(request.get("window"))
+        else:
+            raise ValueError(f"Unknown command: {command}")
+        return {"ok": True, "result": result}
+    except Exception as e:
+        logger.error(f"Request {request.get('command')} failed: {e}")
+        return {"ok": False, "error": str(e)}
+
+
+class ProfileDaemon:
+    # Keeps a ProfileManager (and with it the shell pool, step threads and
+    # WMI connections) warm between requests. Clients connect over a named
+    # pipe on Windows or a Unix socket elsewhere and exchange JSON messages.
+    def __init__(self, profile_manager: Optional["ProfileManager"] = None, address: Optional[str] = None,
+                 telemetry_interval: Optional[float] = TELEMETRY_INTERVAL,
+                 power_events: Optional[PowerEventSource] = None,
+                 ac_profile=PowerProfile.PERFORMANCE, dc_profile=PowerProfile.BATTERY_SAVER):
+        self.profile_manager = profile_manager or ProfileManager()
+        self.address = address or default_daemon_address()
+        self.telemetry_interval = telemetry_interval
+        self.auto_switch = None
+        if power_events:
+            self.auto_switch = AutoSwitchEngine(self._apply, power_events, ac_profile=ac_profile, dc_profile=dc_profile)
+        self._listener = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    def _listen(self):
+        from multiprocessing.connection import Listener
+        is_pipe = self.address.startswith(r"\\.\pipe")
+        if not is_pipe and os.path.exists(self.address):
+            if DaemonClient(self.address, timeout=1.0).ping():
+                raise RuntimeError(f"A daemon is already listening on {self.address}")
+            os.unlink(self.address)
+        if is_pipe:
+            # The default pipe DACL only lets the owner, SYSTEM and
+            # administrators open it for writing
+            return Listener(self.address)
+        # Created owner-only from the start; a chmod after bind would leave
+        # a window in which other local users could connect
+        umask = os.umask(0o177)
+        try:
+            return Listener(self.address)
+        finally:
+            os.umask(umask)
+
+    def _apply(self, profile):
+        with self._lock:
+            return self.profile_manager.apply_profile(profile)
+
+    def serve_forever(self):
+        self.profile_manager.probe()
+        self.profile_manager.recover()
+        if self.telemetry_interval:
+            self.profile_manager.start_telemetry(self.telemetry_interval)
+        self._listener = self._listen()
+        if self.auto_switch:
+            self.auto_switch.start()
+        logger.info(f"Daemon listening on {self.address}")
+        try:
+            while not self._stopping.is_set():
+                try:
+                    connection = self._listener.accept()
+                except OSError:
+                    if self._stopping.is_set():
+                        break
+                    raise
+                threading.Thread(target=self._serve_connection, args=(connection,), daemon=True).start()
+        finally:
+            self._listener.close()
+            if self.auto_switch:
+                self.auto_switch.stop()
+            if self.profile_manager.telemetry:
+                self.profile_manager.telemetry.stop()
+            logger.info("Daemon stopped")
+
+    def _serve_connection(self, connection):
+        with connection:
+            while True:
+                try:
+                    request = json.loads(connection.recv_bytes().decode("utf-8"))
+                except (EOFError, OSError):
+                    return
+                except ValueError as e:
+                    request = {}
+                    response = {"ok": False, "error": f"Malformed request: {e}"}
+                else:
+                    if request.get("command") == "shutdown":
+                        response = {"ok": True, "result": "stopping"}
+                    else:
+                        with self._lock:
+                            response = handle_request(self.profile_manager, request)
+                connection.send_bytes(json.dumps(response).encode("utf-8"))
+                if request.get("command") == "shutdown":
+                    self.shutdown()
+                    return
+
+    def shutdown(self):
+        self._stopping.set()
+        if self._listener is not None:
+            # accept() does not return when the listener is closed on every
+            # platform, so wake it with a throwaway connection first
+            try:
+                from multiprocessing.connection import Client
+                Client(self.address).close()
+            except OSError:
+                pass
+
+
+class DaemonClient:
+    def __init__(self, address: Optional[str] = None, timeout: float = DAEMON_TIMEOUT):
+        self.address = address or default_daemon_address()
+        self.timeout = timeout
+
+    def request(self, command: str, **params):
+        from multiprocessing.connection import Client
+        try:
+            connection = Client(self.address)
+        except OSError as e:
+            raise ConnectionError(f"No daemon listening on {self.address}: {e}")
+        with connection:
+            connection.send_bytes(json.dumps(dict(params, command=command)).encode("utf-8"))
+            if not connection.poll(self.timeout):
+                raise TimeoutError(f"Daemon did not answer {command} within {self.timeout:g}s")
+            response = json.loads(connection.recv_bytes().decode("utf-8"))
+        if not response.get("ok"):
+            raise RuntimeError(response.get("error", "unknown daemon error"))
+        return response["result"]
+
+    def ping(self) -> bool:
+        try:
+            return self.request("ping") == "pong"
+        except (ConnectionError, TimeoutError, RuntimeError, EOFError, OSError):
+            return False
+
+
+SWITCH_POLL_MS = 50
+
+
+class SwitchWorker:
+    # One long-lived thread (with COM initialised once) applies profile
+    # switches. Only the latest request is kept: a request made while another
+    # is waiting replaces it, and cancel() stops the running switch. Progress
+    # is reported as tuples on `events` for the caller to poll:
+    #   ("started", profile), ("progress", profile, step, done, total),
+    #   ("applied", profile, successes, errors), ("cancelled", profile),
+    #   ("dropped", profile), ("error", profile, message)
+    def __init__(self, apply: Callable[[str, threading.Event, Callable[[str, int, int], None]], Tuple[List[str], List[str]]],
+                 events: Optional[queue.Queue] = None):
+        self.apply = apply
+        self.events = events or queue.Queue()
+        self._condition = threading.Condition()
+        self._pending: Optional[str] = None
+        self._cancel: Optional[threading.Event] = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="profile-switch", daemon=True)
+        self._thread.start()
+
+    def submit(self, profile):
+        with self._condition:
+            if self._pending is not None:
+                self.events.put(("dropped", self._pending))
+            self._pending = profile_name(profile)
+            self._condition.notify()
+
+    def cancel(self) -> bool:
+        # Drops the waiting request and cancels the running one
+        with self._condition:
+            dropped, self._pending = self._pending, None
+            if dropped is not None:
+                self.events.put(("dropped", dropped))
+            if self._cancel is not None:
+                self._cancel.set()
+                return True
+        return dropped is not None
+
+    def close(self, timeout: float = 5.0):
+        with self._condition:
+            self._running = False
+            if self._cancel is not None:
+                self._cancel.set()
+            self._condition.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                profile, self._pending = self._pending, None
+                cancel = self._cancel = threading.Event()
+            self.events.put(("started", profile))
+            try:
+                successes, errors = run_with_com(lambda: self.apply(
+                    profile, cancel, lambda step, done, total: self.events.put(("progress", profile, step, done, total))
+                ))
+                self.events.put(("applied", profile, successes, errors))
+            except SwitchCancelled:
+                self.events.put(("cancelled", profile))
+            except Exception as e:
+                self.events.put(("error", profile, str(e)))
+            finally:
+                with self._condition:
+                    self._cancel = None
+
+
+def load_tkinter():
+    global tk, ttk, messagebox
+    import tkinter as tk
+    from tkinter import ttk, messagebox
+
+
 class BatterySaverApp:
     def __init__(self):
+        load_tkinter()
+        self.daemon_client = DaemonClient()
         self.profile_manager = ProfileManager()
+        self.switch_worker = SwitchWorker(self._apply_switch)
         self.root = tk.Tk()
         self.setup_ui()
+        # A cold probe can take seconds, so the window comes up first and the
+        # profile buttons are enabled once it finishes
+        threading.Thread(target=self._probe, name="probe", daemon=True).start()
         self.check_admin()
+        self.root.after(SWITCH_POLL_MS, self._poll_switch_events)
+    
+    def _probe(self):
+        try:
+            self.profile_manager.probe()
+        except Exception as e:
+            logger.error(f"Hardware probe failed: {e}")
+        finally:
+            self.switch_worker.events.put(("probed", None))
     
     def check_admin(self):
         try:
@@ -437,7 +5254,7 @@ class BatterySaverApp:
         # Configure grid weights for expansion
         self.root.rowconfigure(0, weight=1)
         self.root.columnconfigure(0, weight=1)
-        main_frame.rowconfigure(4, weight=1)
+        main_frame.rowconfigure(5, weight=1)
         
         title_label = ttk.Label(
             main_frame,
@@ -448,16 +5265,18 @@ class BatterySaverApp:
         
         self.status_label = ttk.Label(
             main_frame,
-            text=f"Current Profile: {self.profile_manager.current_profile.value.upper()}",
+            text=f"Current Profile: {self.profile_manager.current_profile.upper()}",
             font=('Segoe UI', 11)
         )
         self.status_label.grid(row=1, column=0, columnspan=2, pady=10)
         
+        # Disabled until the hardware probe finishes
         battery_button = ttk.Button(
             main_frame,
             text="🔋 Battery Saver",
             command=lambda: self.switch_profile(PowerProfile.BATTERY_SAVER),
-            width=20
+            width=20,
+            state='disabled'
         )
         battery_button.grid(row=2, column=0, padx=5, pady=10)
         
@@ -465,127 +5284,461 @@ class BatterySaverApp:
             main_frame,
             text="⚡ Performance",
             command=lambda: self.switch_profile(PowerProfile.PERFORMANCE),
-            width=20
+            width=20,
+            state='disabled'
         )
         performance_button.grid(row=2, column=1, padx=5, pady=10)
+        self.main_frame = main_frame
+        self.profile_buttons = [battery_button, performance_button]
         
         ttk.Separator(main_frame, orient='horizontal').grid(
-            row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=10
+            row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=10
         )
         
         details_frame = ttk.LabelFrame(main_frame, text="Profile Settings", padding="10")
-        details_frame.grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
+        details_frame.grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=10)
         
-        self.details_text = tk.Text(details_frame, height=8, width=50, state='disabled')
+        self.details_text = tk.Text(details_frame, height=8, width=50)
+        self.details_text.insert(1.0, "Detecting hardware...")
+        self.details_text.config(state='disabled')
         self.details_text.pack(fill=tk.BOTH, expand=True)
         
-        self.update_details()
-        
         self.progress_bar = ttk.Progressbar(
             main_frame,
-            mode='indeterminate',
-            length=360
+            mode='determinate',
+            length=260
         )
-        self.progress_bar.grid(row=5, column=0, columnspan=2, pady=10)
+        self.progress_bar.grid(row=6, column=0, pady=10)
         self.progress_bar.grid_remove()
+        
+        self.cancel_button = ttk.Button(
+            main_frame,
+            text="Cancel",
+            command=self.switch_worker.cancel,
+            width=12
+        )
+        self.cancel_button.grid(row=6, column=1, pady=10)
+        self.cancel_button.grid_remove()
+    
+    def on_probed(self):
+        # User-defined profiles from the config file
+        custom_profiles = [name for name in sorted(self.profile_manager.profiles) if name not in BUILTIN_PROFILES]
+        if custom_profiles:
+            self.custom_profile = tk.StringVar(value=custom_profiles[0])
+            ttk.Combobox(
+                self.main_frame,
+                textvariable=self.custom_profile,
+                values=custom_profiles,
+                state='readonly',
+                width=18
+            ).grid(row=3, column=0, padx=5, pady=5)
+            apply_button = ttk.Button(
+                self.main_frame,
+                text="Apply Profile",
+                command=lambda: self.switch_profile(self.custom_profile.get()),
+                width=20
+            )
+            apply_button.grid(row=3, column=1, padx=5, pady=5)
+            self.profile_buttons.append(apply_button)
+            self.root.geometry("450x440")
+        
+        self.update_details()
+        for button in self.profile_buttons:
+            button.config(state='normal')
     
     def update_details(self):
-        profile = self.profile_manager.current_profile
-        settings = self.profile_manager.profiles[profile.value]
+        settings = self.profile_manager.get_profile(self.profile_manager.current_profile)
         
         gpu_manager = self.profile_manager.gpu_manager
         display_manager = self.profile_manager.display_manager
         
         # Brightness display
         if display_manager.brightness_supported:
-            brightness_text = f"{settings['brightness']}%"
+            brightness_text = f"{settings.brightness}%"
         else:
             brightness_text = "N/A (Not supported)"
         
         # GPU power limit display
-        if gpu_manager.min_power_limit or gpu_manager.max_power_limit:
-            if profile == PowerProfile.BATTERY_SAVER:
-                gpu_limit_text = f"{gpu_manager.min_power_limit}W"
-            else:
-                gpu_limit_text = f"{gpu_manager.max_power_limit}W"
+        if settings.gpu_power_limit is not None:
+            gpu_limit_text = f"{settings.gpu_power_limit}W"
             gpu_range_text = f"\n(GPU Range: {gpu_manager.min_power_limit}W - {gpu_manager.max_power_limit}W)"
         else:
             gpu_limit_text = "N/A (Not supported)"
             gpu_range_text = ""
         
         # Refresh rate display
-        if display_manager.refresh_rates:
-            refresh_text = f"{settings['refresh_rate']}Hz (Current: {display_manager.refresh_rates[0]}Hz)"
+        if settings.refresh_rate is None:
+            refresh_text = "Unchanged"
+        elif display_manager.get_refresh_rate():
+            refresh_text = f"{settings.refresh_rate}Hz (Current: {display_manager.get_refresh_rate()}Hz)"
         else:
-            refresh_text = f"{settings['refresh_rate']}Hz"
+            refresh_text = f"{settings.refresh_rate}Hz"
         
         details = f"""Brightness: {brightness_text}
 Target Refresh Rate: {refresh_text}
-Kill Bloatware: {'Yes' if settings['kill_bloatware'] else 'No'}
+Kill Bloatware: {'Yes' if settings.kill_bloatware else 'No'}
+Throttle Processes: {(settings.throttle_processes or 'no').title()}
 GPU Power Limit: {gpu_limit_text}"""
         
         if gpu_range_text:
             details += gpu_range_text
         
+        cpu_limits = settings.cpu_limits
+        if "stapm_limit" in cpu_limits:
+            details += f"\nCPU Power Limit: {cpu_limits['stapm_limit']:.0f}W"
+            if "fast_limit" in cpu_limits:
+                details += f" (boost {cpu_limits['fast_limit']:.0f}W)"
+        
         self.details_text.config(state='normal')
         self.details_text.delete(1.0, tk.END)
         self.details_text.insert(1.0, details)
         self.details_text.config(state='disabled')
     
-    def switch_profile(self, profile: PowerProfile):
-        self.progress_bar.grid()
-        self.progress_bar.start()
-        
-        def apply():
+    def switch_profile(self, profile):
+        # Queued on the switch worker; clicks made while a switch is running
+        # replace each other so only the last one is applied
+        self.switch_worker.submit(profile)
+    
+    def _apply_switch(self, profile: str, cancel: threading.Event, progress: Callable[[str, int, int], None]):
+        # Runs on the switch worker thread
+        if self.daemon_client.ping():
+            result = self.daemon_client.request("apply", profile=profile)
+            self.profile_manager.current_profile = profile
+            return result["successes"], result["errors"]
+        return self.profile_manager.apply_profile(profile, cancel=cancel, progress=progress)
+    
+    def _poll_switch_events(self):
+        # Drains worker events on the Tk thread, then polls again
+        while True:
             try:
-                import pythoncom
-                pythoncom.CoInitialize()
-                
-                successes, errors = self.profile_manager.apply_profile(profile)
-                self.root.after(0, self.on_profile_applied, profile, successes, errors)
-                
-                pythoncom.CoUninitialize()
-            except Exception as e:
-                self.root.after(0, self.on_profile_error, str(e))
-        
-        thread = threading.Thread(target=apply)
-        thread.daemon = True
-        thread.start()
+                event = self.switch_worker.events.get_nowait()
+            except queue.Empty:
+                break
+            kind, profile = event[0], event[1]
+            if kind == "started":
+                self.progress_bar.config(value=0, maximum=1)
+                self.progress_bar.grid()
+                self.cancel_button.grid()
+                self.status_label.config(text=f"Switching to {profile.upper()}...")
+            elif kind == "progress":
+                step, done, total = event[2:]
+                self.progress_bar.config(value=done, maximum=total)
+                self.status_label.config(text=f"Switching to {profile.upper()}: {step.replace('_', ' ')} ({done}/{total})")
+            elif kind == "applied":
+                self.on_profile_applied(profile, *event[2:])
+            elif kind == "cancelled":
+                self._hide_progress()
+                self.status_label.config(text=f"Current Profile: {self.profile_manager.current_profile.upper()}")
+            elif kind == "error":
+                self.on_profile_error(event[2])
+            elif kind == "probed":
+                self.on_probed()
+        self.root.after(SWITCH_POLL_MS, self._poll_switch_events)
     
-    def on_profile_applied(self, profile: PowerProfile, successes: List[str], errors: List[str]):
-        self.progress_bar.stop()
+    def _hide_progress(self):
+        # A queued switch shows it again from its "started" event
         self.progress_bar.grid_remove()
-        self.status_label.config(text=f"Current Profile: {profile.value.upper()}")
+        self.cancel_button.grid_remove()
+    
+    def on_profile_applied(self, profile: str, successes: List[str], errors: List[str]):
+        self._hide_progress()
+        self.status_label.config(text=f"Current Profile: {profile.upper()}")
         self.update_details()
         
         if errors:
             title = "Partial Success"
             icon = messagebox.WARNING
-            message = f"{profile.value.title()} profile partially applied.\n\n"
+            message = f"{profile.title()} profile partially applied.\n\n"
             if successes:
                 message += f"✓ Succeeded: {', '.join(successes)}\n\n"
             message += f"✗ Failed:\n" + "\n".join(f"  • {error}" for error in errors)
             messagebox.showwarning(title, message)
         else:
-            messagebox.showinfo("Success", f"{profile.value.title()} profile applied successfully!\n\n✓ " + "\n✓ ".join(successes))
+            messagebox.showinfo("Success", f"{profile.title()} profile applied successfully!\n\n✓ " + "\n✓ ".join(successes))
     
     def on_profile_error(self, error_msg: str):
-        self.progress_bar.stop()
-        self.progress_bar.grid_remove()
+        self._hide_progress()
         messagebox.showerror("Error", f"Failed to apply profile: {error_msg}")
     
     def run(self):
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.switch_worker.close()
 
 
-def main():
-    if sys.platform != "win32":
-        print("This application only works on Windows.")
-        sys.exit(1)
-    
+def measure_import_time() -> Tuple[float, List[Tuple[float, str]]]:
+    # Runs `python -X importtime -c "import battery_saver"` in a fresh
+    # interpreter and returns the cumulative import time in ms plus the
+    # self time of every module it pulled in, slowest first.
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import battery_saver"],
+        capture_output=True,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    total = 0.0
+    modules = []
+    nested = []
+    for line in result.stderr.splitlines():
+        fields = line[len("import time:"):].split("|") if line.startswith("import time:") else []
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        self_ms, cumulative_ms, name = int(fields[0]) / 1000, int(fields[1]) / 1000, fields[2][1:].rstrip()
+        nested.append((self_ms, name.strip()))
+        # Modules are listed after their own imports; an unindented name
+        # closes a top-level import.
+        if not name.startswith(" "):
+            if name == "battery_saver":
+                total, modules = cumulative_ms, nested
+            nested = []
+    return total, sorted(modules, reverse=True)
+
+
+def _parse_profile(name: str) -> str:
+    # Built-in profiles also accept dashes (battery-saver); other names are
+    # checked against the profile config by whoever applies them
+    builtin = name.replace("-", "_")
+    return builtin if builtin in BUILTIN_PROFILES else name
+
+
+def _cmd_gui(args) -> int:
     app = BatterySaverApp()
     app.run()
+    return 0
+
+
+def _request(args, command: str, **params):
+    # Prefer a running daemon; otherwise do the work in this process
+    if not args.no_daemon:
+        try:
+            return DaemonClient().request(command, **params)
+        except ConnectionError:
+            pass
+    response = handle_request(ProfileManager(), dict(params, command=command))
+    if not response["ok"]:
+        raise RuntimeError(response["error"])
+    return response["result"]
+
+
+def _cmd_apply(args) -> int:
+    result = _request(args, "apply", profile=args.profile, force=args.force, batched=args.batched or None)
+    for success in result["successes"]:
+        print(f"ok      {success}")
+    for skipped in result["skipped"]:
+        print(f"skipped {skipped}")
+    for error in result["errors"]:
+        print(f"failed  {error}")
+    if result["rolled_back"]:
+        print(f"rolled back {', '.join(result['rolled_back'])}")
+    return 1 if result["errors"] else 0
+
+
+def _cmd_restore(args) -> int:
+    restored = _request(args, "restore")
+    print(f"restored {', '.join(restored)}" if restored else "already in the last good state")
+    return 0
+
+
+def _cmd_profiles(args) -> int:
+    profiles = _request(args, "profiles")
+    if args.json:
+        print(json.dumps(profiles, indent=2))
+        return 0
+    for name, settings in profiles.items():
+        gpu = "unchanged" if settings["gpu_power_limit"] is None else f"{settings['gpu_power_limit']:.0f} W"
+        print(f"{name}: plan {settings['power_plan']}"
+              f"{' (' + str(len(settings['power_settings'])) + ' sub-settings)' if settings['power_settings'] else ''}"
+              f", brightness {settings['brightness']}%, GPU {gpu}"
+              f"{', kills bloatware' if settings['kill_bloatware'] else ''}"
+              f"{', throttles processes (' + settings['throttle_processes'] + ')' if settings['throttle_processes'] else ''}"
+              f"{', suspends ' + str(len(settings['services']) + len(settings['scheduled_tasks'])) + ' services/tasks' if settings['services'] or settings['scheduled_tasks'] else ''}")
+    return 0
+
+
+def _cmd_stats(args) -> int:
+    # Latency metrics of the daemon, or of this process with --no-daemon
+    result = _request(args, "stats", format="prometheus" if args.prometheus else "json", reset=args.reset)
+    if args.prometheus:
+        sys.stdout.write(result)
+    elif args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for series, entry in result.items():
+            print(f"{series}: n={entry['count']} mean={entry['mean'] * 1000:.1f}ms "
+                  f"p50={entry['p50'] * 1000:.1f}ms p95={entry['p95'] * 1000:.1f}ms max={entry['max'] * 1000:.1f}ms")
+    return 0
+
+
+def _cmd_status(args) -> int:
+    status = _request(args, "status")
+    if args.json:
+        print(json.dumps(status, indent=2))
+    else:
+        for key, value in status.items():
+            print(f"{key}: {'N/A' if value is None else value}")
+    return 0
+
+
+def _cmd_probe(args) -> int:
+    print(json.dumps(_request(args, "probe", refresh=args.refresh), indent=2))
+    return 0
+
+
+def _cmd_telemetry(args) -> int:
+    try:
+        summary = DaemonClient().request("telemetry", window=args.window)
+    except ConnectionError:
+        print("Telemetry is collected by the daemon; start it with `battery-saver daemon`.")
+        return 1
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return 0
+    for profile, entry in summary.items():
+        mean_watts = "N/A" if entry["mean_watts"] is None else f"{entry['mean_watts']:.1f} W"
+        print(f"{profile}: {mean_watts} average, {entry['energy_wh']:.2f} Wh over {entry['seconds'] / 60:.0f} min")
+    return 0
+
+
+def _cmd_daemon(args) -> int:
+    if args.stop:
+        try:
+            DaemonClient().request("shutdown")
+        except ConnectionError:
+            print("No daemon is running.")
+            return 1
+        return 0
+    power_events = WindowsPowerEventSource() if args.auto_switch else None
+    daemon = ProfileDaemon(telemetry_interval=args.sample_interval, power_events=power_events,
+                           ac_profile=args.ac_profile, dc_profile=args.dc_profile)
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _cmd_tune(args) -> int:
+    # Runs in this process: the tuner needs the GPU for the whole sweep
+    manager = ProfileManager()
+    workload = CommandWorkload(args.workload) if args.workload else None
+    throughput = workload if workload and not args.clock else ClockThroughput(manager.gpu_manager)
+    try:
+        best, samples = manager.tune_gpu(
+            args.profile, throughput, save=not args.dry_run, grid_points=args.grid, tolerance=args.tolerance,
+            system_watts=args.system_watts, settle=args.settle, duration=args.duration,
+        )
+    finally:
+        if workload:
+            workload.close()
+    for sample in sorted(samples):
+        marker = "  <- knee" if sample is best else ""
+        print(f"{sample.limit:5.0f} W limit  {sample.watts:6.1f} W drawn  {sample.throughput:10.1f}/s  "
+              f"{sample.efficiency:8.3f}/W{marker}")
+    print(f"{args.profile}: gpu_power_limit {best.limit:.0f} W" + (" (not saved)" if args.dry_run else " saved"))
+    return 0
+
+
+def _cmd_importtime(args) -> int:
+    total, modules = measure_import_time()
+    for self_ms, name in modules[:args.top]:
+        print(f"{self_ms:8.1f} ms  {name}")
+    print(f"Total: {total:.1f} ms (budget {args.budget} ms)")
+    return 0 if total <= args.budget else 1
+
+
+def build_parser() -> "argparse.ArgumentParser":
+    import argparse
+    parser = argparse.ArgumentParser(prog="battery-saver", description="One-click battery optimization for ASUS Zephyrus G16")
+    parser.add_argument("--no-daemon", action="store_true", help="do not hand requests to a running daemon")
+    commands = parser.add_subparsers(dest="command")
+    
+    commands.add_parser("gui", help="open the profile switcher window (default)").set_defaults(func=_cmd_gui)
+    
+    apply_parser = commands.add_parser("apply", help="apply a profile without opening the GUI")
+    apply_parser.add_argument("profile", type=_parse_profile, help="battery_saver, performance or a profile from the config")
+    apply_parser.add_argument("--force", action="store_true", help="re-issue every setting even if already applied")
+    apply_parser.add_argument("--batched", action="store_true", help="apply the whole profile as one compiled script")
+    apply_parser.set_defaults(func=_cmd_apply)
+    
+    status_parser = commands.add_parser("status", help="show the current power scheme, brightness and GPU limit")
+    status_parser.add_argument("--json", action="store_true", help="print machine-readable output")
+    status_parser.set_defaults(func=_cmd_status)
+    
+    stats_parser = commands.add_parser("stats", help="show latency histograms for steps, commands and probes")
+    stats_parser.add_argument("--json", action="store_true", help="print machine-readable output")
+    stats_parser.add_argument("--prometheus", action="store_true", help="print the Prometheus text format")
+    stats_parser.add_argument("--reset", action="store_true", help="clear the histograms after reading them")
+    stats_parser.set_defaults(func=_cmd_stats)
+    
+    profiles_parser = commands.add_parser("profiles", help="list the configured profiles as compiled for this machine")
+    profiles_parser.add_argument("--json", action="store_true", help="print machine-readable output")
+    profiles_parser.set_defaults(func=_cmd_profiles)
+    
+    commands.add_parser("restore", help="return to the last successfully applied state").set_defaults(func=_cmd_restore)
+    
+    probe_parser = commands.add_parser("probe", help="print detected hardware capabilities")
+    probe_parser.add_argument("--refresh", action="store_true", help="ignore the capability cache and probe again")
+    probe_parser.set_defaults(func=_cmd_probe)
+    
+    daemon_parser = commands.add_parser("daemon", help="keep hardware state warm and serve other clients")
+    daemon_parser.add_argument("--stop", action="store_true", help="stop the running daemon")
+    daemon_parser.add_argument("--sample-interval", type=float, default=TELEMETRY_INTERVAL,
+                               help="seconds between power telemetry samples (0 disables sampling)")
+    daemon_parser.add_argument("--auto-switch", action="store_true",
+                               help="apply Battery Saver on unplug and Performance on plug-in")
+    daemon_parser.add_argument("--ac-profile", type=_parse_profile, default=PowerProfile.PERFORMANCE.value,
+                               help="profile --auto-switch applies on AC power")
+    daemon_parser.add_argument("--dc-profile", type=_parse_profile, default=PowerProfile.BATTERY_SAVER.value,
+                               help="profile --auto-switch applies on battery")
+    daemon_parser.set_defaults(func=_cmd_daemon)
+    
+    telemetry_parser = commands.add_parser("telemetry", help="show measured power use per profile (needs the daemon)")
+    telemetry_parser.add_argument("--window", type=float, help="only include the last N seconds")
+    telemetry_parser.add_argument("--json", action="store_true", help="print machine-readable output")
+    telemetry_parser.set_defaults(func=_cmd_telemetry)
+    
+    tune_parser = commands.add_parser("tune", help="find the most efficient GPU power limit for a workload",
+                                      usage="%(prog)s [options] profile [-- workload command ...]")
+    tune_parser.add_argument("profile", type=_parse_profile, help="profile to store the limit in")
+    tune_parser.add_argument("--grid", type=int, default=5, help="limits in the initial sweep")
+    tune_parser.add_argument("--tolerance", type=float, default=2.0, help="stop refining within this many watts")
+    tune_parser.add_argument("--duration", type=float, default=10.0, help="seconds to measure at each limit")
+    tune_parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait after each limit change")
+    tune_parser.add_argument("--system-watts", type=float, default=TUNE_SYSTEM_WATTS,
+                             help="draw of everything but the GPU, added to each measurement")
+    tune_parser.add_argument("--clock", action="store_true",
+                             help="measure throughput by the graphics clock instead of the workload's output")
+    tune_parser.add_argument("--dry-run", action="store_true", help="report the limit without saving it")
+    # The workload command follows "--" and is split off by main()
+    tune_parser.set_defaults(func=_cmd_tune, workload=[])
+    
+    importtime_parser = commands.add_parser("importtime", help="check module import time against the budget")
+    importtime_parser.add_argument("--budget", type=float, default=IMPORT_BUDGET_MS, help="budget in milliseconds")
+    importtime_parser.add_argument("--top", type=int, default=10, help="number of slowest modules to list")
+    importtime_parser.set_defaults(func=_cmd_importtime)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # Everything after "--" is the workload for `tune`
+    workload = argv[argv.index("--") + 1:] if "--" in argv else []
+    parser = build_parser()
+    args = parser.parse_args(argv[:len(argv) - len(workload) - 1] if "--" in argv else argv)
+    func = getattr(args, "func", _cmd_gui)
+    if workload and func is not _cmd_tune:
+        parser.error(f"unrecognized arguments: {' '.join(workload)}")
+    args.workload = workload
+    
+    # A replayed transcript stands in for the hardware, so allow it anywhere
+    if func is not _cmd_importtime and sys.platform != "win32" and not os.environ.get("BATTERY_SAVER_REPLAY"):
+        print("This application only works on Windows.")
+        return 1
+    
+    configure_logging()
+    return func(args)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(main())
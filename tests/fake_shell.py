@@ -0,0 +1,56 @@
+# Stands in for `powershell -Command -` in tests. It reads the same framed
+# lines PowerShellSession writes, decodes the base64 command and runs it as a
+# tiny script, one statement per line:
+#   echo TEXT    write TEXT to stdout
+#   warn TEXT    write TEXT to stderr
+#   exit N       finish with exit code N
+#   sleep S      wait S seconds
+#   crash        kill the shell without replying
+#   pid          write the shell's process id
+# Lines without a framed command (the prelude) are ignored.
+import base64
+import os
+import re
+import sys
+import time
+
+FRAME = re.compile(r"FromBase64String\('([^']*)'\).*WriteLine\('(__battery_saver_[0-9a-f]+__) '")
+
+
+def run(command):
+    status = 0
+    for statement in command.splitlines():
+        op, _, arg = statement.partition(" ")
+        if op == "echo":
+            sys.stdout.write(arg + "\n")
+        elif op == "warn":
+            sys.stderr.write(arg + "\n")
+        elif op == "exit":
+            status = int(arg)
+        elif op == "sleep":
+            time.sleep(float(arg))
+        elif op == "crash":
+            sys.stdout.flush()
+            os._exit(3)
+        elif op == "pid":
+            sys.stdout.write(f"{os.getpid()}\n")
+    return status
+
+
+def main():
+    sys.stdout.reconfigure(encoding="utf-8")
+    sys.stderr.reconfigure(encoding="utf-8")
+    for line in sys.stdin:
+        match = FRAME.search(line)
+        if not match:
+            continue
+        encoded, marker = match.groups()
+        status = run(base64.b64decode(encoded).decode("utf-8"))
+        sys.stdout.write(f"{marker} {status}\n")
+        sys.stdout.flush()
+        sys.stderr.write(f"{marker}\n")
+        sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import re
+import subprocess
+
+import battery_saver as bs
+
+BALANCED = "381b4222-f694-41f0-9685-ff5bb260df2e"
+SAVER = "a1841308-3541-4fab-bc81-f71556f20b4a"
+HIGH_PERFORMANCE = "8c5e7fda-e8bf-4a96-9a85-a6e23a8c635c"
+SCHEME_NAMES = {BALANCED: "Balanced", SAVER: "Power saver", HIGH_PERFORMANCE: "High performance"}
+PROCESSOR = "54533251-82be-4824-96c1-47b60b740d00"
+PCIEXPRESS = "501a4d13-42af-4429-9fd1-a8218c268e20"
+# The power settings this laptop has, (subgroup, setting) -> (name, default
+# AC index, default DC index). It has no NVMe power settings.
+POWER_SETTINGS = {
+    (PROCESSOR, "be337238-0d82-4146-a960-4f3749d470c7"): ("Processor performance boost mode", 2, 2),
+    (PROCESSOR, "bc5038f7-23e0-4960-96da-33abaf5935ec"): ("Maximum processor state", 100, 100),
+    (PROCESSOR, "36687f9e-e3a5-4dbf-b1dc-15eb381c6863"): ("Processor energy performance preference policy", 33, 50),
+    (PCIEXPRESS, "ee12f906-d277-404b-b6da-e5fa1a576df5"): ("Link State Power Management", 0, 2),
+}
+SETTING_MISSING = "The power scheme, subgroup or setting specified does not exist.\n"
+SCHEME_ALIASES = {"SCHEME_BALANCED": BALANCED, "SCHEME_MAX": SAVER, "SCHEME_MIN": HIGH_PERFORMANCE}
+
+
+class FakeHardware(bs.CommandExecutor):
+    # Answers the commands the managers issue the way a laptop with an
+    # NVIDIA GPU, no RyzenAdj and no brightness control would, and keeps
+    # the state they change
+    allow_native = False
+
+    def __init__(self):
+        self.scheme = BALANCED
+        self.schemes = dict(SCHEME_NAMES)
+        self.gpu_limit = 80.0
+        self.processes = {1234: "Discord.exe", 1240: "Discord.exe", 99: "explorer.exe"}
+        self.calls = []
+        # (scheme, subgroup, setting) -> [AC, DC] index, once written
+        self.settings = {}
+        self.setting_writes = []
+        # Status each step of a compiled profile script reports; ok otherwise
+        self.script_status = {}
+
+    @staticmethod
+    def _ok(args, stdout=""):
+        return subprocess.CompletedProcess(args, 0, stdout, "")
+
+    def run(self, args, timeout=None):
+        self.calls.append(list(args))
+        if args[:2] == ["where", "nvidia-smi"]:
+            return self._ok(args, "C:\\nvidia\\nvidia-smi.exe\n")
+        if args[0].endswith("nvidia-smi.exe"):
+            if "--query-gpu=power.min_limit,power.max_limit,power.default_limit" in args:
+                return self._ok(args, "5.00, 115.00, 80.00\n")
+            if "--query-gpu=power.limit" in args:
+                return self._ok(args, f"{self.gpu_limit:.2f}\n")
+            if "--query-gpu=power.draw" in args:
+                return self._ok(args, f"{min(self.gpu_limit, 60.0):.2f}\n")
+            if "-pl" in args:
+                self.gpu_limit = float(args[args.index("-pl") + 1])
+                return self._ok(args, f"Power limit set to {self.gpu_limit:.2f} W\n")
+        if args[:2] == ["powercfg", "/setactive"]:
+            return self._set_active(args, args[2])
+        if args[0] == "tasklist":
+            return self._ok(args, "".join(
+                f'"{name}","{pid}","Console","1","10,000 K"\n' for pid, name in sorted(self.processes.items())
+            ))
+        if args[0] == "taskkill":
+            pids = [int(args[i + 1]) for i, arg in enumerate(args) if arg == "/PID"]
+            for pid in pids:
+                self.processes.pop(pid, None)
+            return self._ok(args, "".join(f"SUCCESS: The process with PID {pid} has been terminated.\n" for pid in pids))
+        raise FileNotFoundError(args[0])
+
+    def run_powershell(self, command, timeout=None):
+        self.calls.append(command)
+        if command.startswith("& {"):
+            steps = dict.fromkeys(re.findall(r"Report '(\w+)'", command))
+            return self._ok(command, "".join(
+                f'{{"step": "{step}", "status": "{self.script_status.get(step, "ok")}", "message": ""}}\n'
+                for step in steps
+            ))
+        # Chained commands run one by one; like powershell -Command, the
+        # exit code is that of the last one
+        results = [self._run_one(part.strip()) for part in command.split(";")]
+        return subprocess.CompletedProcess(command, results[-1].returncode,
+                                           "".join(result.stdout for result in results),
+                                           "".join(result.stderr for result in results))
+
+    def _run_one(self, command):
+        if command == "Write-Output '--'":
+            return self._ok(command, "--\n")
+        if command == "powercfg /list":
+            return self._ok(command, "".join(
+                f"Power Scheme GUID: {guid}  ({name}){' *' if guid == self.scheme else ''}\n"
+                for guid, name in self.schemes.items()
+            ))
+        if command == "powercfg /getactivescheme":
+            return self._ok(command, f"Power Scheme GUID: {self.scheme}  ({self.schemes[self.scheme]})")
+        if command.startswith("powercfg /setactive "):
+            return self._set_active(command, command.split()[-1])
+        if command.startswith("powercfg /q "):
+            scheme, subgroup, setting = command.split()[2:]
+            values = self._setting(scheme, subgroup, setting)
+            if values is None:
+                return subprocess.CompletedProcess(command, 1, "", SETTING_MISSING)
+            return self._ok(command, (
+                f"Power Setting GUID: {setting}  ({POWER_SETTINGS[(subgroup, setting)][0]})\n"
+                f"    Current AC Power Setting Index: 0x{values[0]:08x}\n"
+                f"    Current DC Power Setting Index: 0x{values[1]:08x}\n"
+            ))
+        if command.startswith(("powercfg /setacvalueindex ", "powercfg /setdcvalueindex ")):
+            verb, scheme, subgroup, setting, value = command.split()[1:]
+            values = self._setting(scheme, subgroup, setting)
+            if values is None:
+                return subprocess.CompletedProcess(command, 1, "", SETTING_MISSING)
+            values[0 if verb == "/setacvalueindex" else 1] = int(value)
+            self.setting_writes.append(command)
+            return self._ok(command)
+        return subprocess.CompletedProcess(command, 1, "", "not supported by the fake hardware")
+
+    def _setting(self, scheme, subgroup, setting):
+        # Every scheme starts from the defaults in POWER_SETTINGS
+        if scheme not in self.schemes or (subgroup, setting) not in POWER_SETTINGS:
+            return None
+        return self.settings.setdefault((scheme, subgroup, setting), list(POWER_SETTINGS[(subgroup, setting)][1:]))
+
+    def _set_active(self, args, scheme):
+        # Like powercfg, fails for a scheme (or alias) this system lacks
+        guid = SCHEME_ALIASES.get(scheme, scheme)
+        if guid not in self.schemes:
+            return subprocess.CompletedProcess(args, 1, "", "Invalid Parameters -- try \"/?\" for help")
+        self.scheme = guid
+        return self._ok(args)
+
+    def exists(self, path):
+        self.calls.append(path)
+        return False
@@ -0,0 +1,94 @@
+import threading
+
+import battery_saver as bs
+
+AC, DC = bs.PowerProfile.PERFORMANCE, bs.PowerProfile.BATTERY_SAVER
+
+
+def engine(applied, **options):
+    return bs.AutoSwitchEngine(applied.append, debounce=5.0, min_dwell=60.0, clock=lambda: 0.0, **options)
+
+
+def test_switch_waits_for_the_debounce():
+    applied = []
+    auto = engine(applied)
+    auto.handle_event(False, now=0.0)
+    assert auto.poll(now=4.9) is None
+    assert auto.poll(now=5.0) == DC
+    assert applied == [DC]
+
+
+def test_flapping_plug_restarts_the_debounce_and_settles_on_the_last_state():
+    applied = []
+    auto = engine(applied)
+    for now, on_ac in ((0.0, False), (1.0, True), (2.0, False), (3.0, True)):
+        auto.handle_event(on_ac, now=now)
+        auto.poll(now=now)
+    assert auto.poll(now=7.9) is None
+    assert auto.poll(now=8.0) == AC
+    assert applied == [AC]
+
+
+def test_returning_to_the_applied_state_cancels_the_pending_switch():
+    applied = []
+    auto = engine(applied)
+    auto.handle_event(False, now=0.0)
+    auto.poll(now=5.0)
+    auto.handle_event(True, now=100.0)
+    auto.handle_event(False, now=101.0)
+    assert auto.due_at() is None
+    assert auto.poll(now=200.0) is None
+    assert applied == [DC]
+
+
+def test_switches_are_at_least_min_dwell_apart():
+    applied = []
+    auto = engine(applied)
+    auto.handle_event(False, now=0.0)
+    auto.poll(now=5.0)
+    auto.handle_event(True, now=10.0)
+    assert auto.due_at() == 65.0
+    assert auto.poll(now=64.0) is None
+    assert auto.poll(now=65.0) == AC
+    assert applied == [DC, AC]
+
+
+def test_failed_apply_does_not_stop_the_engine():
+    def apply(profile):
+        raise RuntimeError("boom")
+    auto = bs.AutoSwitchEngine(apply, debounce=0.0, min_dwell=0.0)
+    auto.handle_event(False, now=0.0)
+    assert auto.poll(now=0.0) == DC
+    assert auto.applied == DC
+
+
+class FakeEventSource(bs.PowerEventSource):
+    def __init__(self):
+        self.callback = None
+        self.stopped = False
+
+    def start(self, callback):
+        self.callback = callback
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_engine_thread_applies_events_from_the_source():
+    source = FakeEventSource()
+    switched = threading.Event()
+    applied = []
+
+    def apply(profile):
+        applied.append(profile)
+        switched.set()
+
+    auto = bs.AutoSwitchEngine(apply, source, debounce=0.05, min_dwell=0.0)
+    auto.start()
+    try:
+        source.callback(False)
+        assert switched.wait(5)
+    finally:
+        auto.stop()
+    assert applied == [DC]
+    assert source.stopped
@@ -0,0 +1,116 @@
+import json
+import subprocess
+
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware
+
+RYZENADJ = r"C:\Tools\RyzenAdj\ryzenadj.exe"
+
+
+@pytest.fixture
+def hardware():
+    return FakeHardware()
+
+
+@pytest.fixture
+def manager(hardware):
+    manager = bs.ProfileManager(hardware, use_cache=False)
+    manager._managers["cpu"] = bs.CPUManager(hardware, device=bs.SimulatedRyzenAdj())
+    return manager
+
+
+def report(step, status, message=""):
+    return json.dumps({"step": step, "status": status, "message": message})
+
+
+def test_parse_maps_each_status():
+    compiled = bs.CompiledProfile((), "", ["power_plan", "brightness", "gpu", "cpu"])
+    results = compiled.parse("\n".join([
+        "powercfg noise",
+        report("power_plan", "ok", "Power plan"),
+        report("brightness", "skipped"),
+        report("gpu", "unsupported"),
+        report("cpu", "error", "SMU rejected the limit"),
+    ]))
+    assert results["power_plan"].ok and results["power_plan"].success == "Power plan"
+    assert results["brightness"].skipped
+    assert results["gpu"].unsupported and not results["gpu"].ok
+    assert not results["cpu"].ok and not results["cpu"].unsupported
+    assert str(results["cpu"].error) == "SMU rejected the limit"
+
+
+def test_parse_fails_steps_without_a_report():
+    compiled = bs.CompiledProfile((), "", ["power_plan", "gpu"])
+    results = compiled.parse(report("power_plan", "ok") + "\n{not json\n")
+    assert results["power_plan"].ok
+    assert "no result reported" in str(results["gpu"].error)
+
+
+def test_force_is_a_switch_on_the_compiled_script(manager):
+    compiled = manager.compiler.compile(manager.get_profile(bs.PowerProfile.BATTERY_SAVER), manager)
+    assert compiled.command().endswith("}")
+    assert compiled.command(force=True).endswith("} -Force")
+    assert compiled.script.startswith("param([switch]$Force)")
+    assert "if (-not $Force -and $active -match" in compiled.script
+
+
+def test_every_scripted_step_reports_its_failure(manager):
+    compiled = manager.compiler.compile(manager.get_profile(bs.PowerProfile.BATTERY_SAVER), manager)
+    assert compiled.steps == ["power_plan", "power_settings", "processes", "gpu"]
+    for step in compiled.steps:
+        assert f"catch {{ Report '{step}' 'error' $_ }}" in compiled.script
+
+
+def test_cpu_limits_are_scripted_through_the_cli(manager):
+    manager.cpu_manager.ryzenadj_path = RYZENADJ
+    compiled = manager.compiler.compile(manager.get_profile(bs.PowerProfile.BATTERY_SAVER), manager)
+    assert compiled.steps[-1] == "cpu"
+    assert "--stapm-limit=15000" in compiled.script
+    assert "--tctl-temp=85" in compiled.script
+
+
+def test_plans_are_cached_for_the_current_capabilities_only(manager):
+    settings = manager.get_profile(bs.PowerProfile.BATTERY_SAVER)
+    compiled = manager.compiler.compile(settings, manager)
+    assert manager.compiler.compile(settings, manager) is compiled
+
+    manager.capabilities_version += 1
+    recompiled = manager.compiler.compile(settings, manager)
+    assert recompiled is not compiled
+    assert list(manager.compiler._cache.values()) == [recompiled]
+
+
+def test_cpu_runs_natively_without_the_cli(manager, hardware):
+    settings = manager.get_profile(bs.PowerProfile.BATTERY_SAVER)
+    names, results = manager._run_batched(settings, force=False)
+    assert "RyzenAdj" not in manager.compiler.compile(settings, manager).script
+    assert "cpu" in names and results["cpu"].success == "CPU power"
+    assert manager.cpu_manager.device.set_calls[-1]["stapm_limit"] == 15.0
+    assert results["gpu"].ok
+    # Display control is unsupported on the fake, natively or not
+    assert results["brightness"].unsupported
+
+
+def test_script_step_errors_are_reported(manager, hardware):
+    hardware.script_status = {"gpu": "error", "processes": "skipped"}
+    settings = manager.get_profile(bs.PowerProfile.BATTERY_SAVER)
+    names, results = manager._run_batched(settings, force=True)
+    assert any(isinstance(call, str) and call.endswith("} -Force") for call in hardware.calls)
+    assert not results["gpu"].ok and not results["gpu"].unsupported
+    assert results["processes"].skipped
+    assert results["power_plan"].ok
+
+
+def test_a_failed_script_fails_every_scripted_step(manager, hardware, monkeypatch):
+    def run_powershell(command, timeout=None):
+        raise subprocess.TimeoutExpired(command, timeout)
+
+    settings = manager.get_profile(bs.PowerProfile.BATTERY_SAVER)
+    compiled = manager.compiler.compile(settings, manager)
+    monkeypatch.setattr(hardware, "run_powershell", run_powershell)
+    names, results = manager._run_batched(settings, force=False)
+    for step in compiled.steps:
+        assert isinstance(results[step].error, subprocess.TimeoutExpired)
+    assert results["cpu"].ok
@@ -0,0 +1,44 @@
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware
+
+
+@pytest.fixture
+def device():
+    return bs.SimulatedRyzenAdj()
+
+
+@pytest.fixture
+def cpu(device):
+    return bs.CPUManager(FakeHardware(), device=device)
+
+
+def test_stock_limits_are_read_once(cpu):
+    assert cpu.supported
+    assert cpu.stock_limits == {"stapm_limit": 28.0, "fast_limit": 54.0, "slow_limit": 35.0, "tctl_temp": 100.0}
+
+
+def test_only_differing_limits_are_written(cpu, device):
+    assert cpu.set_limits({"stapm_limit": 15.0, "fast_limit": 54.0}) == ["stapm_limit"]
+    assert device.set_calls == [{"stapm_limit": 15.0}]
+    assert cpu.set_limits({"stapm_limit": 15.0, "fast_limit": 54.0}) == []
+    assert len(device.set_calls) == 1
+
+
+def test_force_writes_every_limit(cpu, device):
+    assert sorted(cpu.set_limits({"stapm_limit": 28.0, "tctl_temp": 100.0}, force=True)) == ["stapm_limit", "tctl_temp"]
+    assert len(device.set_calls) == 1
+
+
+def test_unsupported_device_raises():
+    cpu = bs.CPUManager(FakeHardware(), {"backend": None, "ryzenadj_path": None, "stock_limits": {}})
+    assert not cpu.supported
+    with pytest.raises(bs.NotSupportedError, match="not supported"):
+        cpu.set_limits({"stapm_limit": 15.0})
+
+
+def test_warm_start_does_not_search_for_the_cli_again():
+    hardware = FakeHardware()
+    bs.CPUManager(hardware, {"backend": "library", "ryzenadj_path": None, "stock_limits": {}})
+    assert hardware.calls == []
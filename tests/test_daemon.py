@@ -0,0 +1,77 @@
+import os
+import stat
+import sys
+import threading
+
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware, SAVER
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="uses a Unix socket")
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    hardware = FakeHardware()
+    manager = bs.ProfileManager(hardware, use_cache=False)
+    address = str(tmp_path / "daemon.sock")
+    daemon = bs.ProfileDaemon(manager, address=address, telemetry_interval=None)
+    thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+    thread.start()
+    client = bs.DaemonClient(address, timeout=10.0)
+    for _ in range(100):
+        if client.ping():
+            break
+        threading.Event().wait(0.05)
+    else:
+        pytest.fail("daemon did not start")
+    yield daemon, client, hardware
+    daemon.shutdown()
+    thread.join(5)
+
+
+def test_socket_is_private_to_the_owner(daemon):
+    daemon, _, _ = daemon
+    assert stat.S_IMODE(os.stat(daemon.address).st_mode) == 0o600
+
+
+def test_apply_and_status(daemon):
+    _, client, hardware = daemon
+    result = client.request("apply", profile="battery_saver")
+    assert result["profile"] == "battery_saver"
+    assert "Power plan" in result["successes"]
+    assert hardware.scheme == SAVER
+    assert hardware.gpu_limit == 5.0
+
+    status = client.request("status")
+    assert status["profile"] == "battery_saver"
+    assert status["power_scheme"] == SAVER
+    assert status["gpu_power_limit"] == 5.0
+
+
+def test_unknown_profile_is_reported_not_fatal(daemon):
+    _, client, _ = daemon
+    with pytest.raises(RuntimeError, match="Unknown profile"):
+        client.request("apply", profile="nope")
+    assert client.ping()
+
+
+def test_stats_include_applied_steps(daemon):
+    _, client, _ = daemon
+    client.request("apply", profile="performance")
+    stats = client.request("stats")
+    series = [name for name in stats if name.startswith("battery_saver_step_seconds{")]
+    assert any('step="power_plan"' in name for name in series)
+    assert all(stats[name]["count"] >= 1 for name in series)
+    assert "battery_saver_step_seconds" in client.request("stats", format="prometheus")
+
+
+def test_shutdown_stops_the_daemon(daemon):
+    daemon, client, _ = daemon
+    assert client.request("shutdown") == "stopping"
+    assert daemon._stopping.wait(5)
+    with pytest.raises(ConnectionError):
+        for _ in range(50):
+            client.request("ping")
+            threading.Event().wait(0.05)
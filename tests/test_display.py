@@ -0,0 +1,58 @@
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware
+
+
+def test_closest_refresh_rate():
+    assert bs.closest_refresh_rate([60, 120, 240], 144) == 120
+    assert bs.closest_refresh_rate([60, 240], 300) == 240
+    # Ties go to the higher rate
+    assert bs.closest_refresh_rate([60, 120], 90) == 120
+    assert bs.closest_refresh_rate([], 60) is None
+
+
+@pytest.fixture
+def modes():
+    return bs.SimulatedDisplayModes(rates=(60, 120, 240), refresh_rate=240)
+
+
+@pytest.fixture
+def display(modes):
+    return bs.DisplayManager(FakeHardware(), display_modes=modes)
+
+
+def test_refresh_rates_are_enumerated_for_the_current_resolution(display):
+    assert display.refresh_rates == [60, 120, 240]
+    assert display.get_capabilities()["refresh_resolution"] == [2560, 1600]
+
+
+def test_set_refresh_rate_switches_to_the_closest_supported_rate(display, modes):
+    assert display.set_refresh_rate(100) == 120
+    assert display.get_refresh_rate() == 120
+    assert modes.apply_calls == 1
+
+
+def test_matching_refresh_rate_is_left_alone(display, modes):
+    assert display.set_refresh_rate(240) is None
+    assert modes.apply_calls == 0
+
+
+def test_refresh_rate_unsupported_without_display_modes():
+    display = bs.DisplayManager(FakeHardware())
+    assert display.get_refresh_rate() is None
+    with pytest.raises(Exception, match="not supported"):
+        display.set_refresh_rate(60)
+
+
+def test_profile_refresh_rate_step_skips_when_already_set(modes):
+    manager = bs.ProfileManager(FakeHardware(), use_cache=False)
+    manager._managers["display"] = bs.DisplayManager(manager.executor, display_modes=modes)
+
+    successes, _ = manager.apply_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert "Refresh rate" in successes
+    assert modes.current().refresh_rate == 60
+
+    manager.apply_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert "refresh_rate" in manager.last_skipped
+    assert modes.apply_calls == 1
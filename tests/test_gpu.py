@@ -0,0 +1,80 @@
+import pytest
+
+import battery_saver as bs
+import fakes
+from fakes import FakeHardware
+
+
+@pytest.fixture
+def gpu():
+    return bs.GPUManager(FakeHardware(), device=bs.SimulatedGPU())
+
+
+def test_limits_come_from_the_device(gpu):
+    assert gpu.limits() == (5.0, 115.0, 80.0)
+    assert gpu.get_capabilities()["backend"] == "simulated"
+
+
+def test_draw_and_clock_follow_the_limit(gpu):
+    gpu.set_power_limit(30)
+    low_draw, low_clock = gpu.power_usage(), gpu.clocks()["graphics"]
+    gpu.set_power_limit(115)
+    assert low_draw == 30.0
+    # The simulated load only draws 90 W, however high the limit
+    assert gpu.power_usage() == 90.0
+    assert gpu.clocks()["graphics"] > low_clock
+
+
+def test_out_of_range_limit_is_rejected(gpu):
+    with pytest.raises(ValueError):
+        gpu.set_power_limit(200)
+    assert gpu.get_power_limit() == 80.0
+
+
+def test_profile_step_skips_a_limit_that_already_matches():
+    manager = bs.ProfileManager(FakeHardware(), use_cache=False)
+    device = bs.SimulatedGPU()
+    manager._managers["gpu"] = bs.GPUManager(manager.executor, device=device)
+
+    successes, _ = manager.apply_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert "GPU power" in successes
+    assert device.get_power_limit() == 5.0
+    assert device.set_calls == 1
+
+    manager.apply_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert "gpu" in manager.last_skipped
+    assert device.set_calls == 1
+
+
+class FailingGPU(bs.SimulatedGPU):
+    def __init__(self, code):
+        super().__init__()
+        self.code = code
+
+    def set_power_limit(self, watts):
+        raise bs.NvmlError(self.code, "GPU write failed")
+
+
+def test_failed_gpu_write_rolls_back_the_earlier_steps():
+    hardware = FakeHardware()
+    manager = bs.ProfileManager(hardware, use_cache=False)
+    manager._managers["gpu"] = bs.GPUManager(hardware, device=FailingGPU(999))
+
+    successes, errors = manager.apply_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert "GPU power" not in successes
+    assert any(error.startswith("GPU:") for error in errors)
+    assert manager.last_rollback
+    assert hardware.scheme == fakes.BALANCED
+    good, pending = manager.state_store.load()
+    assert good.power_scheme == fakes.BALANCED
+    assert pending is None
+
+
+def test_unsupported_gpu_write_keeps_the_profile():
+    hardware = FakeHardware()
+    manager = bs.ProfileManager(hardware, use_cache=False)
+    manager._managers["gpu"] = bs.GPUManager(hardware, device=FailingGPU(bs.NvmlError.NOT_SUPPORTED))
+
+    manager.apply_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert not manager.last_rollback
+    assert hardware.scheme == fakes.SAVER
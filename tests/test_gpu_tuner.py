@@ -0,0 +1,116 @@
+import sys
+
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware
+
+
+def peaked_curve(optimum):
+    # Efficiency rises to a single peak at `optimum` watts and falls after
+    calls = []
+
+    def measure(limit):
+        calls.append(limit)
+        efficiency = 100.0 - (limit - optimum) ** 2 / 50.0
+        return bs.TuneSample(float(limit), float(limit), efficiency * limit, efficiency)
+    return measure, calls
+
+
+@pytest.mark.parametrize("optimum", [5, 18, 37.5, 61, 94, 115])
+def test_find_power_knee_lands_within_one_step_of_the_optimum(optimum):
+    measure, calls = peaked_curve(optimum)
+    best, samples = bs.find_power_knee(measure, 5, 115, grid_points=5, tolerance=2.0)
+    assert abs(best.limit - optimum) <= 2.0
+    # Every limit is measured at most once, far fewer than a full sweep
+    assert len(calls) == len(set(calls)) == len(samples)
+    assert len(calls) < 20
+
+
+def test_find_power_knee_prefers_the_lower_limit_on_a_tie():
+    def flat(limit):
+        return bs.TuneSample(float(limit), float(limit), 1.0, 1.0)
+    best, _ = bs.find_power_knee(flat, 10, 50)
+    assert best.limit == 10
+
+
+def test_find_power_knee_rejects_bad_arguments():
+    measure, _ = peaked_curve(30)
+    with pytest.raises(ValueError):
+        bs.find_power_knee(measure, 50, 10)
+    with pytest.raises(ValueError):
+        bs.find_power_knee(measure, 10, 50, tolerance=0)
+    with pytest.raises(ValueError):
+        bs.find_power_knee(measure, 10, 50, grid_points=1)
+
+
+@pytest.fixture
+def fake_clock(monkeypatch):
+    # Time only moves when the tuner sleeps, so measured rates are exact
+    now = [0.0]
+    monkeypatch.setattr(bs.time, "perf_counter", lambda: now[0])
+    monkeypatch.setattr(bs.time, "sleep", lambda seconds: now.__setitem__(0, now[0] + seconds))
+    return now
+
+
+@pytest.fixture
+def gpu():
+    return bs.GPUManager(FakeHardware(), device=bs.SimulatedGPU())
+
+
+@pytest.mark.parametrize("system_watts", [15.0, 30.0, 60.0])
+def test_tuner_finds_the_simulated_knee_and_restores_the_limit(fake_clock, gpu, system_watts):
+    # SimulatedGPU's clock grows with the square root of its draw, so work
+    # per watt including the system baseline peaks where the GPU draws as
+    # much as the rest of the system
+    tuner = bs.GPUTuner(gpu, bs.ClockThroughput(gpu), system_watts=system_watts,
+                        settle=0.5, duration=2.0, sample_interval=0.5)
+    best, samples = tuner.tune(grid_points=5, tolerance=2.0)
+    assert abs(best.limit - system_watts) <= 2.0
+    assert best.efficiency == max(sample.efficiency for sample in samples)
+    assert gpu.get_power_limit() == 80.0
+
+
+def test_tuner_restores_the_limit_when_measuring_fails(fake_clock, gpu):
+    class Broken(bs.Throughput):
+        def units(self):
+            raise RuntimeError("workload exited")
+
+    with pytest.raises(RuntimeError, match="workload exited"):
+        bs.GPUTuner(gpu, Broken(), settle=0.0, duration=1.0).tune()
+    assert gpu.get_power_limit() == 80.0
+
+
+def test_tuner_requires_progress(fake_clock, gpu):
+    class Idle(bs.Throughput):
+        def units(self):
+            return 0.0
+
+    with pytest.raises(RuntimeError, match="no progress"):
+        bs.GPUTuner(gpu, Idle(), settle=0.0, duration=1.0).tune()
+
+
+def test_tune_gpu_saves_the_limit_to_the_profile(fake_clock):
+    manager = bs.ProfileManager(FakeHardware(), use_cache=False)
+    gpu = manager._managers["gpu"] = bs.GPUManager(manager.executor, device=bs.SimulatedGPU())
+    best, _ = manager.tune_gpu("battery_saver", bs.ClockThroughput(gpu), system_watts=30.0,
+                               settle=0.0, duration=1.0)
+    assert manager.profile_config.definitions["battery_saver"]["gpu_power_limit"] == int(best.limit)
+    assert manager.get_profile("battery_saver").gpu_power_limit == int(best.limit)
+
+    manager.tune_gpu("performance", bs.ClockThroughput(gpu), save=False, settle=0.0, duration=1.0)
+    assert "performance" not in manager.profile_config.definitions
+
+
+def test_command_workload_counts_lines_and_numbers():
+    script = "import sys, time\nprint('frame')\nprint('2.5')\nsys.stdout.flush()\ntime.sleep(30)\n"
+    workload = bs.CommandWorkload([sys.executable, "-c", script])
+    try:
+        for _ in range(100):
+            if workload.units() >= 3.5:
+                break
+            bs.threading.Event().wait(0.05)
+        assert workload.units() == 3.5
+    finally:
+        workload.close()
+    assert workload.process.poll() is not None
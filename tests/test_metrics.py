@@ -0,0 +1,73 @@
+import pytest
+
+import battery_saver as bs
+
+
+@pytest.fixture
+def histogram():
+    histogram = bs.LatencyHistogram(buckets=(1.0, 2.0, 4.0))
+    for seconds in [0.5] * 4 + [1.5] * 4 + [3.0] * 2:
+        histogram.observe(seconds)
+    return histogram
+
+
+def test_quantiles_interpolate_within_a_bucket(histogram):
+    assert histogram.counts == [4, 4, 2, 0]
+    # Rank 5 of 10 is the first of the four samples in (1, 2]
+    assert histogram.quantile(0.5) == pytest.approx(1.25)
+    assert histogram.quantile(0.9) == pytest.approx(3.0)
+
+
+def test_quantiles_stay_within_the_observed_range(histogram):
+    assert histogram.quantile(0.0) == 0.5
+    assert histogram.quantile(1.0) == 3.0
+
+
+def test_quantile_of_an_empty_histogram_is_none():
+    assert bs.LatencyHistogram().quantile(0.5) is None
+    assert bs.LatencyHistogram().summary()["mean"] is None
+
+
+def test_overflow_bucket_interpolates_up_to_the_maximum():
+    histogram = bs.LatencyHistogram(buckets=(1.0,))
+    histogram.observe(0.5)
+    histogram.observe(9.0)
+    assert histogram.counts == [1, 1]
+    assert histogram.quantile(1.0) == 9.0
+    assert 1.0 < histogram.quantile(0.75) < 9.0
+
+
+def test_prometheus_histograms_are_cumulative_with_an_inf_bucket():
+    metrics = bs.Metrics()
+    for seconds in (0.003, 0.2, 100.0):
+        metrics.observe("battery_saver_step_seconds", seconds, step="gpu")
+    metrics.observe("battery_saver_step_seconds", 0.02, step="power_plan")
+    lines = metrics.to_prometheus().splitlines()
+
+    assert lines.count("# TYPE battery_saver_step_seconds histogram") == 1
+    gpu_buckets = [line for line in lines if line.startswith('battery_saver_step_seconds_bucket{step="gpu",')]
+    assert len(gpu_buckets) == len(bs.LATENCY_BUCKETS) + 1
+    assert 'battery_saver_step_seconds_bucket{step="gpu",le="0.0025"} 0' in lines
+    assert 'battery_saver_step_seconds_bucket{step="gpu",le="0.005"} 1' in lines
+    assert 'battery_saver_step_seconds_bucket{step="gpu",le="30"} 2' in lines
+    assert gpu_buckets[-1] == 'battery_saver_step_seconds_bucket{step="gpu",le="+Inf"} 3'
+    counts = [int(line.rsplit(" ", 1)[1]) for line in gpu_buckets]
+    assert counts == sorted(counts)
+    assert 'battery_saver_step_seconds_count{step="gpu"} 3' in lines
+    assert 'battery_saver_step_seconds_sum{step="gpu"} 100.203000' in lines
+    assert 'battery_saver_step_seconds_count{step="power_plan"} 1' in lines
+
+
+def test_prometheus_label_values_are_escaped():
+    metrics = bs.Metrics()
+    metrics.observe("battery_saver_command_seconds", 0.1, command='say "hi" \\')
+    assert 'battery_saver_command_seconds_count{command="say \\"hi\\" \\\\"} 1' in metrics.to_prometheus()
+
+
+def test_span_times_a_block_into_its_histogram():
+    metrics = bs.Metrics()
+    with metrics.span("battery_saver_apply_seconds", profile="quiet") as span:
+        pass
+    stats = metrics.stats()['battery_saver_apply_seconds{profile="quiet"}']
+    assert stats["count"] == 1
+    assert stats["sum"] == pytest.approx(span.elapsed)
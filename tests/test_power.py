@@ -0,0 +1,71 @@
+import subprocess
+
+import pytest
+
+import battery_saver as bs
+from fakes import BALANCED, HIGH_PERFORMANCE, PCIEXPRESS, PROCESSOR, SAVER, FakeHardware
+
+BOOST_MODE = "be337238-0d82-4146-a960-4f3749d470c7"
+PCIE_ASPM = "ee12f906-d277-404b-b6da-e5fa1a576df5"
+
+
+@pytest.fixture
+def oem_hardware():
+    # An OEM image that ships without the standard power saver scheme
+    hardware = FakeHardware()
+    del hardware.schemes[SAVER]
+    return hardware
+
+
+def test_plan_already_active_through_the_fallback_is_skipped(oem_hardware):
+    manager = bs.ProfileManager(oem_hardware, use_cache=False)
+    settings = manager.get_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert manager.power_manager.target_scheme_guid(settings.power_plan) == BALANCED
+    assert manager._apply_power_plan(settings) is bs.SKIPPED
+    assert f"$active -match '{BALANCED}'" in manager.compiler.compile(settings, manager).script
+
+
+def test_standard_plan_is_the_target_when_present():
+    manager = bs.ProfileManager(FakeHardware(), use_cache=False)
+    settings = manager.get_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert manager.power_manager.target_scheme_guid(settings.power_plan) == SAVER
+    assert manager._apply_power_plan(settings) == "Power plan"
+
+
+def test_failed_alias_falls_back_to_the_detected_plan(oem_hardware):
+    oem_hardware.scheme = HIGH_PERFORMANCE
+    power = bs.PowerManager(oem_hardware)
+    power.set_power_plan("saver")
+    assert oem_hardware.scheme == BALANCED
+    assert "powercfg /setactive SCHEME_MAX" in oem_hardware.calls
+
+
+def test_plan_that_cannot_be_activated_raises(oem_hardware):
+    power = bs.PowerManager(oem_hardware)
+    del power.power_plans["balanced"]
+    with pytest.raises(subprocess.CalledProcessError):
+        power.set_power_plan("saver")
+
+
+def test_power_settings_are_only_written_once():
+    hardware = FakeHardware()
+    manager = bs.ProfileManager(hardware, use_cache=False)
+    successes, errors = manager.apply_profile(bs.PowerProfile.BATTERY_SAVER, batched=False)
+    assert "Power settings" in successes
+    # boost_mode is disabled on DC only; ASPM's DC index is already maximum
+    assert len(hardware.setting_writes) == 2
+    assert hardware.settings[(SAVER, PROCESSOR, BOOST_MODE)] == [2, 0]
+    assert hardware.settings[(SAVER, PCIEXPRESS, PCIE_ASPM)] == [2, 2]
+    reads = sum(1 for call in hardware.calls if isinstance(call, str) and "powercfg /q " in call)
+
+    manager.apply_profile(bs.PowerProfile.BATTERY_SAVER, batched=False)
+    assert "power_settings" in manager.last_skipped
+    assert len(hardware.setting_writes) == 2
+    # Served from the readback cache
+    assert sum(1 for call in hardware.calls if isinstance(call, str) and "powercfg /q " in call) == reads
+
+    # A new process reads the settings back and still writes nothing
+    fresh = bs.ProfileManager(hardware, use_cache=False)
+    fresh.apply_profile(bs.PowerProfile.BATTERY_SAVER, batched=False)
+    assert "power_settings" in fresh.last_skipped
+    assert len(hardware.setting_writes) == 2
@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import battery_saver as bs
+
+FAKE_SHELL = [sys.executable, os.path.join(os.path.dirname(__file__), "fake_shell.py")]
+
+
+@pytest.fixture
+def session():
+    session = bs.PowerShellSession(FAKE_SHELL)
+    yield session
+    session.close()
+
+
+def test_output_and_exit_code(session):
+    result = session.run("echo hello\nwarn careful\nexit 4")
+    assert result.stdout == "hello"
+    assert result.stderr == "careful"
+    assert result.returncode == 4
+
+
+def test_command_is_framed_verbatim(session):
+    # Quotes, $ and non-ASCII text survive the base64 framing
+    text = "it's \"quoted\" $env:PATH ünïcødé ✓"
+    assert session.run(f"echo {text}").stdout == text
+
+
+def test_markers_do_not_leak_into_output(session):
+    result = session.run("echo one\necho two")
+    assert result.stdout.splitlines() == ["one", "two"]
+    assert "__battery_saver_" not in result.stdout + result.stderr
+
+
+def test_commands_share_one_process(session):
+    first = session.run("pid").stdout
+    second = session.run("pid").stdout
+    assert first == second
+    assert session.alive
+
+
+def test_empty_output(session):
+    result = session.run("exit 0")
+    assert (result.stdout, result.stderr, result.returncode) == ("", "", 0)
+
+
+def test_timeout_kills_the_session_and_the_next_command_restarts_it(session):
+    pid = session.run("pid").stdout
+    with pytest.raises(subprocess.TimeoutExpired):
+        session.run("sleep 5", timeout=0.3)
+    assert not session.alive
+    assert session.run("pid").stdout != pid
+
+
+def test_crash_is_reported_and_the_session_restarts(session):
+    pid = session.run("pid").stdout
+    with pytest.raises(subprocess.SubprocessError):
+        session.run("crash")
+    assert not session.alive
+    result = session.run("echo back")
+    assert result.stdout == "back"
+    assert session.run("pid").stdout != pid
+
+
+def test_pool_reuses_idle_sessions():
+    pool = bs.PowerShellPool(size=2, argv=FAKE_SHELL)
+    try:
+        pids = {pool.run("pid").stdout for _ in range(5)}
+        assert len(pids) == 1
+        with pytest.raises(subprocess.CalledProcessError):
+            pool.run("exit 2", check=True)
+    finally:
+        pool.close()
@@ -0,0 +1,128 @@
+import json
+import os
+
+import pytest
+
+import battery_saver as bs
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    return tmp_path / "profiles.json"
+
+
+def write(path, definitions, mtime_ns=None):
+    path.write_text(json.dumps(definitions), encoding="utf-8")
+    if mtime_ns is not None:
+        os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_builtin_profiles_resolve_without_a_config():
+    resolved = bs.resolve_profiles({})
+    assert set(resolved) == set(bs.BUILTIN_PROFILES)
+    assert resolved["battery_saver"]["power_settings"]["pcie_aspm"] == {"ac": 2, "dc": 2}
+
+
+@pytest.mark.parametrize("definition, message", [
+    ({"brightness": "dim"}, "brightness must be a number"),
+    ({"power_plan": "turbo"}, "power_plan must be one of"),
+    ({"kill_bloatware": 1}, "kill_bloatware must be true or false"),
+    ({"throttle_processes": "freeze"}, "throttle_processes must be one of"),
+    ({"services": {"SysMain": "delete"}}, "services.SysMain must be one of"),
+    ({"gpu_power_limit": -5}, "gpu_power_limit must be watts"),
+    ({"cpu_stapm_limit": "max"}, "cpu_stapm_limit must be a number"),
+    ({"power_settings": {"warp_drive": "on"}}, "warp_drive"),
+    ({"volume": 3}, "unknown setting 'volume'"),
+])
+def test_invalid_fields_are_rejected(definition, message):
+    with pytest.raises(bs.ProfileError, match=message):
+        bs.resolve_profiles({"quiet": dict(definition, inherits="battery_saver")})
+
+
+def test_a_profile_without_a_base_must_set_every_field():
+    with pytest.raises(bs.ProfileError, match="quiet: missing brightness"):
+        bs.resolve_profiles({"quiet": {"power_plan": "saver"}})
+
+
+def test_inherited_fields_are_overridden_one_by_one():
+    resolved = bs.resolve_profiles({
+        "quiet": {"inherits": "battery_saver", "brightness": 20, "power_settings": {"boost_mode": "disabled"}},
+        "quieter": {"inherits": "quiet", "services": ["SysMain"]},
+    })
+    assert resolved["quieter"]["brightness"] == 20
+    assert resolved["quieter"]["services"] == {"SysMain": "stop"}
+    assert resolved["quieter"]["power_plan"] == "saver"
+    # power_settings merge per setting rather than replacing the base's
+    assert set(resolved["quieter"]["power_settings"]) == {"boost_mode", "pcie_aspm"}
+
+
+def test_inheritance_cycles_are_rejected():
+    with pytest.raises(bs.ProfileError, match="inheritance cycle: a -> b -> a"):
+        bs.resolve_profiles({"a": {"inherits": "b"}, "b": {"inherits": "a"}})
+    with pytest.raises(bs.ProfileError, match="inheritance cycle"):
+        bs.resolve_profiles({"a": {"inherits": "a"}})
+
+
+@pytest.mark.parametrize("base", [["battery_saver"], 3, None, "  "])
+def test_inherits_must_name_a_profile(base):
+    with pytest.raises(bs.ProfileError, match="inherits must be the name of another profile"):
+        bs.resolve_profiles({"quiet": {"inherits": base}})
+
+
+def test_unknown_base_profile_is_rejected():
+    with pytest.raises(bs.ProfileError, match="quiet: unknown base profile 'missing'"):
+        bs.resolve_profiles({"quiet": {"inherits": "missing"}})
+
+
+def test_config_is_reread_only_when_its_mtime_changes(config_path):
+    write(config_path, {"quiet": {"inherits": "battery_saver", "brightness": 20}}, mtime_ns=1_000_000_000)
+    config = bs.ProfileConfig(config_path)
+    assert config.refresh()
+    assert config.resolved["quiet"]["brightness"] == 20
+    version = config.version
+
+    # Same mtime: the file is not read again
+    write(config_path, {"quiet": {"inherits": "battery_saver", "brightness": 30}}, mtime_ns=1_000_000_000)
+    assert not config.refresh()
+    assert config.resolved["quiet"]["brightness"] == 20
+
+    os.utime(config_path, ns=(2_000_000_000, 2_000_000_000))
+    assert config.refresh()
+    assert config.resolved["quiet"]["brightness"] == 30
+    assert config.version == version + 1
+
+
+def test_invalid_config_keeps_the_last_good_profiles(config_path):
+    write(config_path, {"quiet": {"inherits": "battery_saver"}}, mtime_ns=1_000_000_000)
+    config = bs.ProfileConfig(config_path)
+    config.refresh()
+    write(config_path, {"quiet": {"inherits": "quiet"}}, mtime_ns=2_000_000_000)
+    assert not config.refresh()
+    assert "quiet" in config.resolved
+    config_path.write_text("{not json", encoding="utf-8")
+    os.utime(config_path, ns=(4_000_000_000, 4_000_000_000))
+    assert not config.refresh()
+    assert "quiet" in config.resolved
+
+
+def test_save_validates_and_replaces_the_file_atomically(config_path, monkeypatch):
+    config = bs.ProfileConfig(config_path)
+    config.save({"quiet": {"inherits": "battery_saver", "brightness": 20}})
+    assert json.loads(config_path.read_text(encoding="utf-8"))["quiet"]["brightness"] == 20
+    assert config.resolved["quiet"]["brightness"] == 20
+    assert not config_path.with_name(config_path.name + ".tmp").exists()
+
+    # Invalid definitions never reach the disk
+    with pytest.raises(bs.ProfileError):
+        config.save({"quiet": {"inherits": "quiet"}})
+
+    # A write that fails part way leaves the old file in place
+    def failing_dump(data, f, **kwargs):
+        f.write('{"quiet": ')
+        raise OSError("disk full")
+
+    monkeypatch.setattr(bs.json, "dump", failing_dump)
+    with pytest.raises(OSError):
+        config.save({"quiet": {"inherits": "battery_saver", "brightness": 30}})
+    monkeypatch.undo()
+    assert json.loads(config_path.read_text(encoding="utf-8"))["quiet"]["brightness"] == 20
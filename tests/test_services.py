@@ -0,0 +1,78 @@
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware
+
+TASK = "\\Microsoft\\Windows\\Defrag\\ScheduledDefrag"
+ORIGINAL = {
+    "SysMain": bs.ServiceState("running", "auto"),
+    "WSearch": bs.ServiceState("running", "demand", can_pause=True),
+    "DiagTrack": bs.ServiceState("running", "auto"),
+    "Fax": bs.ServiceState("stopped", "demand"),
+}
+
+
+@pytest.fixture
+def control():
+    return bs.SimulatedServiceControl(dict(ORIGINAL), {TASK: True})
+
+
+@pytest.fixture
+def manager(control):
+    return bs.ServiceManager(FakeHardware(), service_control=control)
+
+
+def states(control):
+    return {name: control.query(name)[:2] for name in ORIGINAL}
+
+
+def test_suspend_then_restore_is_exact(manager, control):
+    services = {"SysMain": "stop", "WSearch": "pause", "DiagTrack": "disable", "Fax": "stop"}
+    changed, errors = manager.apply(services.items(), [TASK])
+    assert errors == []
+    # Fax was already stopped, so it is neither touched nor recorded
+    assert sorted(changed) == ["DiagTrack", "SysMain", "WSearch", TASK]
+    assert states(control) == {
+        "SysMain": ("stopped", "auto"),
+        "WSearch": ("paused", "demand"),
+        "DiagTrack": ("stopped", "disabled"),
+        "Fax": ("stopped", "demand"),
+    }
+    assert control.tasks[TASK] is False
+    assert sorted(record.name for record in manager.suspended()) == ["DiagTrack", "SysMain", "WSearch", TASK]
+
+    changed, errors = manager.restore()
+    assert errors == []
+    assert sorted(changed) == ["DiagTrack", "SysMain", "WSearch", TASK]
+    assert states(control) == {name: state[:2] for name, state in ORIGINAL.items()}
+    assert control.tasks[TASK] is True
+    assert manager.suspended() == []
+
+
+def test_reapplying_the_same_profile_changes_nothing(manager, control):
+    manager.apply([("SysMain", "stop")], [TASK])
+    calls = len(control.calls)
+    assert manager.apply([("SysMain", "stop")], [TASK]) == ([], [])
+    assert len(control.calls) == calls
+
+
+def test_changing_the_action_restores_before_suspending_again(manager, control):
+    manager.apply([("DiagTrack", "disable")], [])
+    changed, errors = manager.apply([("DiagTrack", "stop")], [])
+    assert errors == []
+    assert changed == ["DiagTrack"]
+    assert states(control)["DiagTrack"] == ("stopped", "auto")
+    manager.restore()
+    assert states(control)["DiagTrack"] == ("running", "auto")
+
+
+def test_missing_services_and_tasks_are_skipped(manager):
+    assert manager.apply([("NotInstalled", "stop")], ["\\Missing\\Task"]) == ([], [])
+    assert manager.suspended() == []
+
+
+def test_pause_of_a_service_that_cannot_pause_is_an_error(manager, control):
+    changed, errors = manager.apply([("SysMain", "pause")], [])
+    assert changed == []
+    assert errors == ["SysMain: does not accept pause"]
+    assert states(control)["SysMain"] == ("running", "auto")
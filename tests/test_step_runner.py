@@ -0,0 +1,125 @@
+import threading
+import time
+
+import pytest
+
+import battery_saver as bs
+
+
+class Recorder:
+    # Step functions that log when they start and finish and track how many
+    # run at once
+    def __init__(self):
+        self.events = []
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def step(self, name, duration=0.02, result=None, error=None):
+        def func():
+            with self._lock:
+                self.events.append(("start", name))
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+            time.sleep(duration)
+            with self._lock:
+                self.active -= 1
+                self.events.append(("end", name))
+            if error:
+                raise error
+            return result or name
+        return func
+
+    def index(self, kind, name):
+        return self.events.index((kind, name))
+
+
+@pytest.fixture
+def runner():
+    return bs.StepRunner(max_workers=2)
+
+
+def test_a_step_starts_after_its_dependencies(runner):
+    recorder = Recorder()
+    results = runner.run([
+        bs.ProfileStep("b", recorder.step("b"), depends_on=("a",)),
+        bs.ProfileStep("a", recorder.step("a")),
+    ])
+    assert all(result.ok for result in results.values())
+    assert recorder.index("end", "a") < recorder.index("start", "b")
+
+
+def test_a_step_that_overruns_its_timeout_fails_alone(runner):
+    release = threading.Event()
+    start = time.monotonic()
+    results = runner.run([
+        bs.ProfileStep("hung", lambda: release.wait(5), timeout=0.1),
+        bs.ProfileStep("quick", lambda: "done"),
+    ])
+    release.set()
+    assert time.monotonic() - start < 2
+    assert isinstance(results["hung"].error, TimeoutError)
+    assert results["quick"].success == "done"
+
+
+def test_a_failed_dependency_skips_its_dependents(runner):
+    recorder = Recorder()
+    results = runner.run([
+        bs.ProfileStep("plan", recorder.step("plan", error=OSError("access denied"))),
+        bs.ProfileStep("settings", recorder.step("settings"), depends_on=("plan",)),
+        bs.ProfileStep("apply", recorder.step("apply"), depends_on=("settings",)),
+        bs.ProfileStep("gpu", recorder.step("gpu")),
+    ])
+    assert str(results["plan"].error) == "access denied"
+    assert "skipped because plan failed" in str(results["settings"].error)
+    assert "skipped because settings failed" in str(results["apply"].error)
+    assert results["gpu"].ok
+    assert ("start", "settings") not in recorder.events
+    assert ("start", "apply") not in recorder.events
+
+
+def test_unsupported_steps_are_marked(runner):
+    def unsupported():
+        raise bs.NotSupportedError("no brightness control")
+
+    results = runner.run([bs.ProfileStep("brightness", unsupported)])
+    assert results["brightness"].unsupported and not results["brightness"].ok
+
+
+def test_chains_longer_than_the_pool_run_in_order(runner):
+    recorder = Recorder()
+    chains = {"a": 3, "b": 3, "c": 2}
+    steps = [bs.ProfileStep("solo", recorder.step("solo"))]
+    for chain, length in chains.items():
+        for i in range(length):
+            name = f"{chain}{i}"
+            depends_on = (f"{chain}{i - 1}",) if i else ()
+            steps.append(bs.ProfileStep(name, recorder.step(name), depends_on=depends_on))
+
+    results = runner.run(steps)
+    assert len(results) == 9 and all(result.ok for result in results.values())
+    assert recorder.peak <= 2
+    for step in steps:
+        for dep in step.depends_on:
+            assert recorder.index("end", dep) < recorder.index("start", step.name)
+
+
+def test_unknown_dependencies_are_rejected(runner):
+    with pytest.raises(ValueError, match="unknown steps: missing"):
+        runner.run([bs.ProfileStep("a", lambda: None, depends_on=("missing",))])
+
+
+def test_dependency_cycles_fail_instead_of_hanging(runner):
+    results = runner.run([
+        bs.ProfileStep("a", lambda: None, depends_on=("b",)),
+        bs.ProfileStep("b", lambda: None, depends_on=("a",)),
+    ])
+    assert all("dependency cycle" in str(result.error) for result in results.values())
+
+
+def test_submit_runs_steps_in_the_background(runner):
+    release = threading.Event()
+    future = runner.submit([bs.ProfileStep("wait", lambda: release.wait(5) and "released")])
+    assert not future.done()
+    release.set()
+    assert future.result(timeout=5)["wait"].success == "released"
@@ -0,0 +1,103 @@
+import queue
+import threading
+
+import pytest
+
+import battery_saver as bs
+from fakes import BALANCED, FakeHardware
+
+
+def events_until(worker, kind, timeout=5.0):
+    # Every event up to and including the first of `kind`
+    events = []
+    while True:
+        event = worker.events.get(timeout=timeout)
+        events.append(event)
+        if event[0] == kind:
+            return events
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+def test_requests_made_during_a_switch_collapse_to_the_last(gate):
+    applied = []
+
+    def apply(profile, cancel, progress):
+        applied.append(profile)
+        gate.wait(5)
+        return [profile], []
+
+    worker = bs.SwitchWorker(apply)
+    try:
+        worker.submit("battery_saver")
+        assert events_until(worker, "started") == [("started", "battery_saver")]
+        for profile in ("performance", "quiet", "balanced_custom"):
+            worker.submit(profile)
+        gate.set()
+
+        events = events_until(worker, "applied")
+        events += events_until(worker, "applied")
+        assert ("dropped", "performance") in events
+        assert ("dropped", "quiet") in events
+        assert events[-1] == ("applied", "balanced_custom", ["balanced_custom"], [])
+        assert applied == ["battery_saver", "balanced_custom"]
+    finally:
+        worker.close()
+
+
+def test_cancel_drops_the_waiting_request(gate):
+    def apply(profile, cancel, progress):
+        gate.wait(5)
+        if cancel.is_set():
+            raise bs.SwitchCancelled(profile)
+        return [], []
+
+    worker = bs.SwitchWorker(apply)
+    try:
+        worker.submit("battery_saver")
+        events_until(worker, "started")
+        worker.submit("performance")
+        assert worker.cancel()
+        gate.set()
+        events = events_until(worker, "cancelled")
+        assert ("dropped", "performance") in events
+        with pytest.raises(queue.Empty):
+            worker.events.get(timeout=0.2)
+    finally:
+        worker.close()
+
+
+def test_cancel_stops_steps_that_have_not_started(gate, monkeypatch):
+    hardware = FakeHardware()
+    manager = bs.ProfileManager(hardware, use_cache=False)
+    # One worker, so the steps after power_plan wait for it
+    manager.step_runner = bs.StepRunner(max_workers=1)
+    started = threading.Event()
+    apply_power_plan = manager._apply_power_plan
+
+    def blocking_power_plan(*args):
+        started.set()
+        gate.wait(5)
+        return apply_power_plan(*args)
+
+    monkeypatch.setattr(manager, "_apply_power_plan", blocking_power_plan)
+    worker = bs.SwitchWorker(lambda profile, cancel, progress: manager.apply_profile(
+        profile, cancel=cancel, progress=progress, batched=False))
+    try:
+        worker.submit(bs.PowerProfile.BATTERY_SAVER)
+        assert started.wait(5)
+        assert worker.cancel()
+        gate.set()
+        events = events_until(worker, "cancelled")
+        assert events[-1] == ("cancelled", "battery_saver")
+        # power_plan finished and was rolled back; nothing else ran
+        assert hardware.scheme == BALANCED
+        assert 1234 in hardware.processes
+        assert hardware.gpu_limit == 80.0
+    finally:
+        worker.close()
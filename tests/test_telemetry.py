@@ -0,0 +1,73 @@
+import time
+
+import pytest
+
+import battery_saver as bs
+
+
+def reading(t, watts=10.0, profile="battery_saver", cpu_load=20, gpu_watts=None, battery_percent=80):
+    return bs.TelemetrySample(t, battery_percent, False, watts, gpu_watts, cpu_load, profile)
+
+
+def test_samples_round_trip_at_stored_precision():
+    buffer = bs.TelemetryBuffer(capacity=4, start=1000.0)
+    buffer.append(bs.TelemetrySample(1001.234, 57, True, 12.346, None, None, "performance"))
+    [sample] = buffer.samples()
+    assert sample.time == pytest.approx(1001.23)
+    assert sample.battery_percent == 57
+    assert sample.on_ac is True
+    assert sample.discharge_watts == pytest.approx(12.35)
+    assert sample.gpu_watts is None and sample.cpu_load is None
+    assert sample.profile == "performance"
+
+
+def test_ring_keeps_the_newest_samples_in_order():
+    buffer = bs.TelemetryBuffer(capacity=5, start=0.0)
+    for t in range(8):
+        buffer.append(reading(float(t), watts=float(t)))
+    assert len(buffer) == 5
+    assert [sample.time for sample in buffer.samples()] == [3.0, 4.0, 5.0, 6.0, 7.0]
+    # The window start is found across the wrap point of the ring
+    assert [sample.time for sample in buffer.samples(since=5.5)] == [6.0, 7.0]
+    assert [sample.time for sample in buffer.samples(since=0.0)] == [3.0, 4.0, 5.0, 6.0, 7.0]
+    assert buffer.samples(since=100.0) == []
+
+
+def sampler_with(samples, start):
+    sampler = bs.TelemetrySampler(bs.TelemetrySource(), interval=1.0, capacity=64)
+    sampler.buffer = bs.TelemetryBuffer(64, start=start)
+    for sample in samples:
+        sampler.buffer.append(sample)
+    return sampler
+
+
+def test_summary_aggregates_per_profile():
+    t0 = time.time() - 20
+    samples = [reading(t0 + i) for i in range(10)]
+    samples += [reading(t0 + i, watts=30.0, profile="performance", cpu_load=None, gpu_watts=50.0)
+                for i in (10, 11, 12, 13, 14, 20)]
+    summary = sampler_with(samples, t0 - 1).summary()
+
+    saver = summary["battery_saver"]
+    assert saver["samples"] == 10
+    assert saver["seconds"] == pytest.approx(9)
+    assert saver["energy_wh"] == pytest.approx(10 * 9 / 3600)
+    assert saver["mean_watts"] == pytest.approx(10)
+    assert saver["mean_gpu_watts"] is None
+
+    performance = summary["performance"]
+    # The 6 s gap before the last sample counts as two intervals
+    assert performance["seconds"] == pytest.approx(6)
+    assert performance["energy_wh"] == pytest.approx(30 * 6 / 3600)
+    assert performance["mean_gpu_watts"] == pytest.approx(50)
+    assert performance["mean_cpu_load"] is None
+
+
+def test_summary_window_only_counts_recent_samples():
+    t0 = time.time() - 20
+    samples = [reading(t0 + i) for i in range(10)]
+    samples += [reading(t0 + i, watts=30.0, profile="performance") for i in (10, 11, 12, 13, 14, 20)]
+    summary = sampler_with(samples, t0 - 1).summary(window=8.5)
+    assert set(summary) == {"performance"}
+    assert summary["performance"]["samples"] == 4
+    assert summary["performance"]["seconds"] == pytest.approx(4)
@@ -0,0 +1,132 @@
+import os
+
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware
+
+
+def sample(pid, name, cpu_time=0.0, context_switches=0, session_id=1, create_time=1000):
+    return bs.ProcessSample(pid, name, create_time, session_id, cpu_time, context_switches)
+
+
+def test_rank_processes_orders_by_cpu_and_wakeups():
+    before = [sample(1, "busy.exe"), sample(2, "chatty.exe"), sample(3, "idle.exe")]
+    after = [
+        sample(1, "busy.exe", cpu_time=1.0),
+        sample(2, "chatty.exe", context_switches=6000),
+        sample(3, "idle.exe", cpu_time=0.01),
+    ]
+    ranked = bs.rank_processes(before, after, interval=2.0)
+    assert [activity.name for activity in ranked] == ["chatty.exe", "busy.exe", "idle.exe"]
+    busy = ranked[1]
+    assert busy.cpu_share == pytest.approx(0.5)
+    assert ranked[0].wakeups_per_second == pytest.approx(3000)
+    assert ranked[0].score == pytest.approx(3000 / bs.WAKEUPS_PER_CORE)
+
+
+def test_rank_processes_ignores_new_and_reused_pids():
+    before = [sample(1, "old.exe", create_time=1000)]
+    after = [sample(1, "new.exe", cpu_time=5.0, create_time=2000), sample(2, "started.exe", cpu_time=5.0)]
+    assert bs.rank_processes(before, after, interval=1.0) == []
+
+
+def test_rank_processes_rejects_a_zero_interval():
+    with pytest.raises(ValueError):
+        bs.rank_processes([], [], interval=0)
+
+
+def activity(pid, name, score, session_id=1):
+    return bs.ProcessActivity(pid, name, 1000, session_id, score, 0.0, score)
+
+
+def test_select_throttle_targets_skips_protected_processes():
+    ranked = [
+        activity(10, "svchost.exe", 0.9, session_id=0),
+        activity(11, "Explorer.EXE", 0.8),
+        activity(12, "game.exe", 0.7),
+        activity(13, "updater.exe", 0.5),
+        activity(14, "sync.exe", 0.3),
+        activity(15, "tiny.exe", 0.001),
+    ]
+    targets = bs.select_throttle_targets(ranked, ["explorer.exe"], limit=5, protected_pids=[12])
+    assert [target.name for target in targets] == ["updater.exe", "sync.exe"]
+
+
+def test_select_throttle_targets_honours_the_limit():
+    ranked = [activity(pid, f"app{pid}.exe", 1.0 - pid / 10) for pid in range(1, 6)]
+    assert [target.pid for target in bs.select_throttle_targets(ranked, [], limit=2)] == [1, 2]
+
+
+@pytest.fixture
+def control():
+    processes = [
+        sample(100, "indexer.exe"),
+        sample(101, "sync.exe"),
+        sample(102, "idle.exe"),
+        sample(103, "foreground.exe"),
+        sample(104, "svchost.exe", session_id=0),
+    ]
+    load = {100: (0.8, 0), 101: (0.0, 4000), 103: (1.0, 0), 104: (1.0, 0)}
+    return bs.SimulatedProcessControl(processes, load, foreground=103)
+
+
+@pytest.fixture
+def manager(control):
+    manager = bs.ProcessManager(FakeHardware(), process_control=control)
+    manager.sample_interval = 0.2
+    return manager
+
+
+def test_suspend_and_resume_round_trip(manager, control):
+    throttled = manager.throttle("suspend")
+    assert sorted(process.pid for process in throttled) == [100, 101]
+    assert control.suspended == {100, 101}
+    # Recorded on disk so another run can resume them
+    assert sorted(process.pid for process in manager.throttled()) == [100, 101]
+
+    # Throttling again does not touch processes that are already suspended
+    assert manager.throttle("suspend") == []
+
+    resumed = manager.resume_throttled()
+    assert sorted(process.pid for process in resumed) == [100, 101]
+    assert control.suspended == set()
+    assert manager.throttled() == []
+
+
+def test_eco_mode_restores_the_original_priority(manager, control):
+    manager.throttle("eco")
+    assert control.priorities[100] == control.IDLE_PRIORITY_CLASS
+    assert control.eco_qos == {100, 101}
+    manager.resume_throttled()
+    assert control.priorities[100] == control.NORMAL_PRIORITY_CLASS
+    assert control.eco_qos == set()
+
+
+def test_exited_processes_are_dropped_on_resume(manager, control):
+    manager.throttle("suspend")
+    del control.processes[100]
+    assert [process.pid for process in manager.resume_throttled()] == [101]
+    assert manager.throttled() == []
+
+
+def test_this_process_is_never_throttled(control):
+    control.processes[os.getpid()] = sample(os.getpid(), "python.exe")
+    control.load[os.getpid()] = (2.0, 0)
+    manager = bs.ProcessManager(FakeHardware(), process_control=control)
+    manager.sample_interval = 0.2
+    assert os.getpid() not in {process.pid for process in manager.throttle("suspend")}
+
+
+class NoEcoQoSControl(bs.SimulatedProcessControl):
+    def set_eco_qos(self, pid, enabled):
+        raise OSError("EcoQoS is not available")
+
+
+def test_failed_eco_qos_restores_the_priority():
+    control = NoEcoQoSControl([sample(100, "indexer.exe")], {100: (0.8, 0)})
+    manager = bs.ProcessManager(FakeHardware(), process_control=control)
+    manager.sample_interval = 0.2
+    assert manager.throttle("eco") == []
+    assert control.priorities[100] == control.NORMAL_PRIORITY_CLASS
+    assert manager.throttled() == []
@@ -0,0 +1,79 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+import battery_saver as bs
+from fakes import FakeHardware
+
+TRANSCRIPT = os.path.join(os.path.dirname(__file__), "data", "simulated_g16.jsonl")
+
+
+def test_record_then_replay_returns_the_same_results(tmp_path):
+    path = tmp_path / "transcript.jsonl"
+    recorder = bs.RecordingExecutor(FakeHardware(), path)
+    recorded = [
+        recorder.run_powershell("powercfg /getactivescheme"),
+        recorder.run(["C:\\nvidia\\nvidia-smi.exe", "--query-gpu=power.limit", "--format=csv,noheader,nounits"]),
+        recorder.exists("C:\\Tools\\RyzenAdj\\ryzenadj.exe"),
+    ]
+    with pytest.raises(FileNotFoundError):
+        recorder.run(["ryzenadj", "--info"])
+
+    entries = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert [entry["kind"] for entry in entries] == ["powershell", "run", "exists", "run"]
+    assert entries[-1]["error"] == "FileNotFoundError"
+    assert all(entry["latency"] >= 0 for entry in entries)
+
+    replay = bs.ReplayExecutor(path, realtime=False)
+    replayed = [
+        replay.run_powershell("powercfg /getactivescheme"),
+        replay.run(["C:\\nvidia\\nvidia-smi.exe", "--query-gpu=power.limit", "--format=csv,noheader,nounits"]),
+        replay.exists("C:\\Tools\\RyzenAdj\\ryzenadj.exe"),
+    ]
+    for before, after in zip(recorded[:2], replayed[:2]):
+        assert (after.returncode, after.stdout, after.stderr) == (before.returncode, before.stdout, before.stderr)
+    assert replayed[2] is recorded[2]
+    with pytest.raises(FileNotFoundError):
+        replay.run(["ryzenadj", "--info"])
+
+
+def test_repeated_commands_replay_in_order_then_repeat_the_last(tmp_path):
+    hardware = FakeHardware()
+    path = tmp_path / "transcript.jsonl"
+    recorder = bs.RecordingExecutor(hardware, path)
+    recorder.run_powershell("powercfg /getactivescheme")
+    hardware.scheme = "a1841308-3541-4fab-bc81-f71556f20b4a"
+    recorder.run_powershell("powercfg /getactivescheme")
+
+    replay = bs.ReplayExecutor(path, realtime=False)
+    outputs = [replay.run_powershell("powercfg /getactivescheme").stdout for _ in range(3)]
+    assert "Balanced" in outputs[0]
+    assert outputs[1] == outputs[2]
+    assert "Power saver" in outputs[1]
+
+
+def test_unrecorded_command_fails_loudly(tmp_path):
+    path = tmp_path / "transcript.jsonl"
+    bs.RecordingExecutor(FakeHardware(), path).run_powershell("powercfg /getactivescheme")
+    replay = bs.ReplayExecutor(path, realtime=False)
+    with pytest.raises(subprocess.SubprocessError, match="No recorded reply"):
+        replay.run_powershell("powercfg /setactive SCHEME_MAX")
+    with pytest.raises(subprocess.SubprocessError, match="No recorded reply"):
+        replay.run(["powercfg", "/getactivescheme"])
+
+
+def test_replayed_transcript_applies_a_profile():
+    manager = bs.ProfileManager(bs.ReplayExecutor(TRANSCRIPT, realtime=False), use_cache=False)
+    successes, _ = manager.apply_profile(bs.PowerProfile.BATTERY_SAVER)
+    assert "Power plan" in successes
+    assert "GPU power" in successes
+    assert manager.current_profile == "battery_saver"
+
+
+def test_benchmark_profile_switch_on_checked_in_transcript():
+    timings = bs.benchmark_profile_switch(TRANSCRIPT, repeat=3, realtime=False)
+    assert set(timings) == {"startup", "apply_min", "apply_mean", "apply_max"}
+    assert 0 <= timings["apply_min"] <= timings["apply_mean"] <= timings["apply_max"]
+    assert timings["startup"] >= 0